@@ -1,4 +1,5 @@
 import os
+import secrets
 import requests
 from fastapi import HTTPException, Security, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -6,6 +7,8 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 SUPABASE_AUTH_URL = f"{SUPABASE_URL}/auth/v1/user"
+# Bearer token for internal endpoints (/metrics); they are disabled when unset
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 
 security = HTTPBearer()
 
@@ -32,3 +35,15 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Security(security))
     print(f"✅ User Verified: {user_data}")
     
     return user_data  # ✅ Return the user details
+
+
+def verify_metrics_token(credentials: HTTPAuthorizationCredentials = Security(security)):
+    """
+    Guards internal endpoints with the METRICS_TOKEN bearer token rather than a
+    user's session: their data spans every user. Without METRICS_TOKEN set
+    they are not served.
+    """
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(credentials.credentials.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
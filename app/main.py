@@ -1,8 +1,32 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request, Depends
 import os
 from dotenv import load_dotenv
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from app.personal_agents.conversation_context import conversation_store, summarization_queue
+    from app.personal_agents.message_analysis import analysis_queue
+    from app.utils.openai_client import close_openai_client, start_openai_client
+    from app.utils.token_accounting import start_tokenizer
+
+    # Load the tokenizer before serving; fails startup if its ranks are unavailable
+    await start_tokenizer()
+    # One pooled OpenAI client for embeddings, moderation and the agents runner
+    start_openai_client()
+    # Start the conversation write-behind flusher; persist unflushed messages on shutdown
+    await conversation_store.start()
+    summarization_queue.start()
+    analysis_queue.start()
+    yield
+    await analysis_queue.stop()
+    await summarization_queue.stop()
+    await conversation_store.stop()
+    await close_openai_client()
+
+
+app = FastAPI(lifespan=lifespan)
 
 load_dotenv()
 
@@ -0,0 +1,34 @@
+# agent_registry.py
+# Agent templates, built once when their modules are imported at startup and
+# shared by every request. Per-request data (the user's traits, history, ...)
+# reaches an agent through the run context and dynamic instructions rather
+# than by building a new Agent for each request.
+# Registered agents report the usage of their model calls for billing
+# (see app/utils/billing.py).
+
+from typing import Dict
+from agents import Agent
+from app.utils.billing import usage_hooks
+
+
+_agents: Dict[str, Agent] = {}
+
+
+def register_agent(agent: Agent) -> Agent:
+    """
+    Registers an agent template under its name and returns it.
+    """
+    if agent.name in _agents and _agents[agent.name] is not agent:
+        raise ValueError(f"An agent named {agent.name} is already registered.")
+    if agent.hooks is None:
+        agent.hooks = usage_hooks
+    _agents[agent.name] = agent
+    return agent
+
+
+def get_agent(name: str) -> Agent:
+    return _agents[name]
+
+
+def registered_agents() -> Dict[str, Agent]:
+    return dict(_agents)
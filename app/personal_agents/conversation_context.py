@@ -1,15 +1,50 @@
-# This is a thread-safe container to store conversation history for a single user.
-# It also summarizes the conversation every 10 messages.
-# This stores the conversation history in local cache memory and is not persistent.
-
-# It is currently NOT being used.
-# See the Supabase/conversation_history.py for the persistent version currently in use.
+# In-process hot cache of recent conversation history, one ConversationContext per user.
+# Recent turns are served from memory; new messages are persisted to Supabase
+# asynchronously in batches by a background flusher (write-behind).
+# See supabase/conversation_history.py for the persistent storage.
 
 import asyncio
-from dataclasses import dataclass, field
+import os
+import time
 import logging
-from typing import List, Dict
-from agents import Agent, Runner
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+from app.supabase.conversation_history import (
+    SUMMARY_ROLE,
+    append_messages_to_history,
+    get_conversation_messages,
+    replace_conversation_history_with_summary,
+)
+from app.utils.job_queue import BackgroundJobQueue
+from app.utils.metrics import register_metrics
+from app.utils.token_count import count_tokens
+
+
+CONVERSATION_CACHE_MAX_USERS = int(os.getenv("CONVERSATION_CACHE_MAX_USERS", "1000"))
+CONVERSATION_CACHE_MAX_MESSAGES = int(os.getenv("CONVERSATION_CACHE_MAX_MESSAGES", "50"))
+CONVERSATION_MAX_PENDING = int(os.getenv("CONVERSATION_MAX_PENDING", "1000"))
+CONVERSATION_FLUSH_INTERVAL_SECONDS = float(os.getenv("CONVERSATION_FLUSH_INTERVAL_SECONDS", "1.0"))
+SUMMARY_TRIGGER_TOKENS = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "1500"))
+SUMMARIZATION_WORKERS = int(os.getenv("SUMMARIZATION_WORKERS", "2"))
+SUMMARIZATION_MAX_RETRIES = int(os.getenv("SUMMARIZATION_MAX_RETRIES", "2"))
+
+
+@dataclass
+class ConversationMessage:
+    role: str
+    content: str
+    ordinal: Optional[int] = None  # Assigned once the message is persisted
+    tokens: Optional[int] = None  # Token count of the formatted message, computed on first use
+    speaker: Optional[str] = None  # Display name of the user or agent; the role is shown without one
+
+    def format(self) -> str:
+        return f"{self.speaker or self.role}: {self.content}"
+
+    def token_count(self) -> int:
+        if self.tokens is None:
+            self.tokens = count_tokens(self.format())
+        return self.tokens
 
 
 @dataclass
@@ -17,84 +52,287 @@ class ConversationContext:
     """
     A thread-safe container to store conversation history for a single user.
     """
-    history: List[str] = field(default_factory=list)
+    user_id: str
+    history: List[ConversationMessage] = field(default_factory=list)
+    pending: List[ConversationMessage] = field(default_factory=list)
     lock: asyncio.Lock = field(default_factory=asyncio.Lock)
-    summarize_every: int = 10
+    loaded: bool = False
+    max_messages: int = CONVERSATION_CACHE_MAX_MESSAGES
 
-    async def add_message(self, role: str, message: str):
+    async def add_message(self, role: str, message: str, speaker: Optional[str] = None) -> ConversationMessage:
         """
-        Appends a new message to the conversation history.
+        Appends a new message to the conversation history and queues it for persistence.
         """
         async with self.lock:
-            self.history.append(f"{role}: {message}")
-            current_count = len(self.history)
-            
-        # Check the count outside the lock to avoid deadlock (since summarize() also acquires the lock)
-        if current_count >= self.summarize_every:
-            await self.summarize()
+            entry = ConversationMessage(role, message, speaker=speaker)
+            self.history.append(entry)
+            self.pending.append(entry)
+            self._trim()
+            return entry
 
-    async def get_context(self, limit: int = None) -> str:
+    async def get_history(self, limit: int = None) -> List[str]:
         """
-        Retrieves the full conversation history as a single string.
+        Retrieves the conversation history as a list of "speaker: message" strings.
         """
         async with self.lock:
-            # Optionally, you can truncate or summarize if history is too long
-            async with self.lock:
-                if limit is None:
-                    return "\n".join(self.history)
-                else:
-                    # Get the last 'limit' number of messages
-                    recent_messages = self.history[-limit:]
-                    return "\n".join(recent_messages)
+            messages = self.history if limit is None else self.history[-limit:]
+            return [message.format() for message in messages]
+
+    async def get_context(self, limit: int = None) -> str:
+        """
+        Retrieves the conversation history as a single string.
+        """
+        return "\n".join(await self.get_history(limit))
 
+    async def tokens_since_summary(self) -> int:
+        """
+        Returns the token count of the messages added since the latest summary.
+        """
+        async with self.lock:
+            return sum(
+                message.token_count() for message in self.history
+                if message.role != SUMMARY_ROLE
+            )
 
     async def clear(self):
         """
-        Clears the conversation history.
+        Clears the in-memory conversation history.
         """
         async with self.lock:
             self.history.clear()
-            
-    async def summarize(self) -> str:
-        """
-        Uses an AI agent to summarize the conversation stored in the context.
-        Once summarized, clears the context and replaces it only with the summary.
-
-        Returns:
-        str: The summary of the conversation.
-        """
-        # Retrieve the full conversation history.
-        full_history = await self.get_context()
-
-        # Define instructions for the summarization agent.
-        instructions = (
-            "You are an AI that summarizes a conversation. "
-            "Read the conversation below and provide a concise summary that captures the key points. "
-            "Keep it brief and to the point."
-        )
-
-        # Create the summarization agent.
-        summarization_agent = Agent(
-            name="Summarizer",
-            handoff_description="An agent that summarizes conversation context.",
-            instructions=instructions,
-            model="gpt-4o-mini",
-        )
-
-        # Construct the prompt with the conversation history.
-        prompt = f"Conversation:\n{full_history}\n\n"
-        
-        # Run the agent.
-        summary_result = await Runner.run(summarization_agent, prompt)
-        summary = summary_result.final_output.strip()
-
-        # Clear the existing conversation and store only the summary.
-        await self.clear()
-        await self.add_message("Summary", summary)
 
+    async def apply_summary(self, upto_ordinal: int, summary: str):
+        """
+        Mirrors a persisted summary in memory: every message up to and including
+        upto_ordinal is replaced by the summary message.
+        """
+        async with self.lock:
+            remaining = [
+                message for message in self.history
+                if message.ordinal is None or message.ordinal > upto_ordinal
+            ]
+            self.history = [ConversationMessage(SUMMARY_ROLE, summary, upto_ordinal)] + remaining
+
+    def _trim(self):
+        # Keep the leading summary (if any) plus the most recent messages.
+        if len(self.history) <= self.max_messages:
+            return
+        head = self.history[:1] if self.history[0].role == SUMMARY_ROLE else []
+        self.history = head + self.history[-(self.max_messages - len(head)):]
+
+
+class ConversationStore:
+    """
+    Holds a ConversationContext per user with LRU eviction of idle users and
+    persists new messages in batches through a background flusher.
+    """
+    def __init__(
+        self,
+        max_users: int = CONVERSATION_CACHE_MAX_USERS,
+        max_messages_per_user: int = CONVERSATION_CACHE_MAX_MESSAGES,
+        max_pending: int = CONVERSATION_MAX_PENDING,
+        flush_interval: float = CONVERSATION_FLUSH_INTERVAL_SECONDS,
+    ):
+        self.max_users = max_users
+        self.max_messages_per_user = max_messages_per_user
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.contexts: "OrderedDict[str, ConversationContext]" = OrderedDict()
+        self.pending_count = 0
+        self.rejected = 0
+        self._flush_failed_at: Optional[float] = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_requested = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """
+        Starts the background flusher. Called on application startup.
+        """
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """
+        Stops the background flusher and persists every unflushed message.
+        Called on application shutdown.
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        if self.pending_count:
+            logging.error(f"{self.pending_count} conversation messages could not be persisted on shutdown.")
+
+    async def get(self, user_id: str) -> ConversationContext:
+        """
+        Returns the user's context, loading it from Supabase on a cache miss.
+        """
+        context = self.contexts.get(user_id)
+        if context is None:
+            context = ConversationContext(user_id, max_messages=self.max_messages_per_user)
+            self.contexts[user_id] = context
+            # Never evict the context being returned: messages added to an
+            # evicted context would not be flushed
+            self._evict_idle(keep=user_id)
+        self.contexts.move_to_end(user_id)
+
+        if not context.loaded:
+            async with context.lock:
+                if not context.loaded:
+                    rows = await asyncio.to_thread(get_conversation_messages, user_id)
+                    context.history = [
+                        ConversationMessage(row["role"], row["content"], row["ordinal"], speaker=row.get("speaker"))
+                        for row in rows
+                    ] + context.history
+                    context._trim()
+                    context.loaded = True
+        return context
+
+    async def add_message(self, user_id: str, role: str, message: str, speaker: Optional[str] = None) -> bool:
+        """
+        Appends a message to the user's history. The message is persisted by
+        the background flusher; if too many messages are waiting, the caller
+        waits for a flush. Returns False, without adding the message, if they
+        are still waiting after it: while the database is failing, memory stays
+        bounded and callers are not each held up by another failing insert
+        (one is attempted per flush interval).
+        """
+        if self.pending_count >= self.max_pending:
+            if self._flush_failed_at is None or time.monotonic() - self._flush_failed_at >= self.flush_interval:
+                await self.flush()
+            if self.pending_count >= self.max_pending:
+                self.rejected += 1
+                logging.warning(f"{self.pending_count} conversation messages are waiting to be persisted; rejecting a message for user {user_id}.")
+                return False
+
+        context = await self.get(user_id)
+        await context.add_message(role, message, speaker)
+        self.pending_count += 1
+        self._flush_requested.set()
+        return True
+
+    async def get_history(self, user_id: str, limit: int = None) -> List[str]:
+        context = await self.get(user_id)
+        return await context.get_history(limit)
+
+    async def should_summarize(self, user_id: str) -> bool:
+        """
+        True once the turns since the latest summary exceed the summary token budget.
+        """
+        context = await self.get(user_id)
+        return await context.tokens_since_summary() >= SUMMARY_TRIGGER_TOKENS
+
+    def request_summary(self, user_id: str) -> bool:
+        """
+        Queues a background summarization for the user. Repeated requests while
+        one is queued or running collapse into that job.
+        """
+        return summarization_queue.submit(user_id, lambda: self.summarize(user_id))
+
+    async def summarize(self, user_id: str):
+        """
+        Persists the user's pending messages, folds the turns since the latest
+        summary into it and mirrors the result in memory.
+        """
+        await self.flush()
+        result = await replace_conversation_history_with_summary(user_id)
+        if result is None:
+            return None
+        upto_ordinal, summary = result
+        context = self.contexts.get(user_id)
+        if context is not None:
+            await context.apply_summary(upto_ordinal, summary)
         return summary
 
+    async def flush(self):
+        """
+        Persists every pending message with a single batched insert.
+        Messages that fail to persist are kept and retried on the next flush.
+        """
+        async with self._flush_lock:
+            batch: List[tuple] = []
+            for user_id, context in list(self.contexts.items()):
+                async with context.lock:
+                    if context.pending:
+                        batch.append((user_id, context.pending))
+                        context.pending = []
+            if not batch:
+                return
+
+            rows = [
+                {"user_id": user_id, "role": message.role, "speaker": message.speaker, "content": message.content}
+                for user_id, messages in batch
+                for message in messages
+            ]
+            stored = await asyncio.to_thread(append_messages_to_history, rows)
+
+            if stored is None:
+                # Put the messages back in front of anything queued meanwhile.
+                for user_id, messages in batch:
+                    context = self.contexts[user_id]
+                    async with context.lock:
+                        context.pending = messages + context.pending
+                self._flush_failed_at = time.monotonic()
+                return
+            self._flush_failed_at = None
+
+            for message, row in zip((m for _, messages in batch for m in messages), stored):
+                message.ordinal = row["ordinal"]
+            self.pending_count = max(0, self.pending_count - len(rows))
+            logging.info(f"Flushed {len(rows)} conversation messages for {len(batch)} users.")
+
+    async def _flush_loop(self):
+        while True:
+            await self._flush_requested.wait()
+            await asyncio.sleep(self.flush_interval)
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing conversation messages: {e}")
+            if self.pending_count:
+                # Retry on the next interval even if no new messages arrive
+                self._flush_requested.set()
+            self._evict_idle()
+
+    def _evict_idle(self, keep: Optional[str] = None):
+        # Evict least recently used users (other than keep) that have nothing
+        # left to persist. Nothing is evicted while a flush has messages in flight.
+        excess = len(self.contexts) - self.max_users
+        if excess <= 0 or self._flush_lock.locked():
+            return
+        for user_id, context in list(self.contexts.items()):
+            if excess <= 0:
+                break
+            if user_id == keep or context.pending or context.lock.locked():
+                continue
+            del self.contexts[user_id]
+            excess -= 1
+        if excess > 0:
+            self._flush_requested.set()
+
+    def metrics(self) -> dict:
+        return {
+            "users": len(self.contexts),
+            "pending_messages": self.pending_count,
+            "rejected_messages": self.rejected,
+            "flush_failing": self._flush_failed_at is not None,
+        }
+
+
+# Background summarization and post-conversation analysis, deduplicated per user.
+summarization_queue = BackgroundJobQueue(
+    "summarization",
+    workers=SUMMARIZATION_WORKERS,
+    max_retries=SUMMARIZATION_MAX_RETRIES,
+)
 
 # Global in-memory store for conversation contexts keyed by user ID.
 # For production in a multi-process scenario, consider a shared store like Redis.
-conversation_contexts: Dict[str, ConversationContext] = {}
+conversation_store = ConversationStore()
+register_metrics("conversation_store", conversation_store.metrics)
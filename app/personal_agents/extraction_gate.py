@@ -0,0 +1,109 @@
+# extraction_gate.py
+# Cheap local checks that run before the knowledge and slang extraction agents.
+# Most chat messages (greetings, acknowledgements, one-word replies) carry
+# nothing worth extracting, and the agents then return a value score below
+# the storage threshold after a full model call. The gate skips those calls
+# when the expected value is clearly low, and errs towards extracting otherwise.
+# It only looks at the message itself: whether its facts are already stored
+# is left to the merge on write, which also records the repeat mention.
+#
+# See benchmarks/extraction_gate_eval.py for calls saved vs. value missed on
+# recorded messages.
+
+import os
+import re
+import threading
+from collections import Counter
+from typing import Tuple
+from app.utils.metrics import register_metrics
+from app.utils.token_count import count_tokens
+
+
+EXTRACTION_GATE_ENABLED = os.getenv("EXTRACTION_GATE_ENABLED", "true").lower() == "true"
+KNOWLEDGE_GATE_MIN_TOKENS = int(os.getenv("KNOWLEDGE_GATE_MIN_TOKENS", "2"))
+SLANG_GATE_MIN_TOKENS = int(os.getenv("SLANG_GATE_MIN_TOKENS", "0"))  # Single-word messages ("bruh") can be slang
+
+# Greetings, acknowledgements and pleasantries. Informal forms ("lol", "gonna",
+# "ngl") are deliberately absent: they are what slang extraction looks for.
+GREETINGS = frozenset("""
+hi hello hey heya hiya greetings morning afternoon evening night goodnight good bye goodbye
+thanks thank thx ty please pls welcome sorry ok okay k fine great nice cool sure yes no yep nope
+alright right hmm hm mm ah oh uh um wow awesome perfect exactly indeed agreed
+""".split())
+
+# Common English function words
+STOPWORDS = frozenset("""
+a an the and or but if then so because as of at by for with about to from in on up down out over
+under again further once here there when where why how all any both each few more most other some
+such only own same than too very can will just should now is am are was were be been being have has
+had having do does did doing would could might must shall may this that these those what which who
+whom it its it's itself they them their theirs themselves he him his she her hers you your yours
+yourself i i'm i've i'd i'll me my mine myself we we're our ours us not don't doesn't didn't isn't
+aren't wasn't can't won't that's there's what's let's also really well still even get got
+""".split())
+
+# First-person words: knowledge is about the user, so short messages without them are skipped.
+FIRST_PERSON = frozenset("i i'm i've i'd i'll me my mine myself we we're we've our ours us".split())
+
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+class ExtractionGate:
+    """
+    Decides whether a message is worth an extraction call. Decisions and skip
+    reasons are counted for /metrics.
+    """
+    def __init__(self, kind: str, min_tokens: int, require_self_reference: bool):
+        self.kind = kind
+        self.min_tokens = min_tokens
+        self.require_self_reference = require_self_reference
+        self.checked = 0
+        self.skipped = Counter()
+        self._lock = threading.Lock()
+        register_metrics(f"{kind}_extraction_gate", self.metrics)
+
+    def should_extract(self, message: str) -> bool:
+        """
+        Runs the checks and counts the decision.
+        """
+        extract, reason = self.evaluate(message)
+        with self._lock:
+            self.checked += 1
+            if not extract:
+                self.skipped[reason] += 1
+        return extract
+
+    def evaluate(self, message: str) -> Tuple[bool, str]:
+        """
+        Returns (extract, reason) from the in-memory checks: token counting and
+        a lexicon lookup.
+        """
+        if not EXTRACTION_GATE_ENABLED:
+            return True, "disabled"
+
+        words = WORD_PATTERN.findall(message.lower())
+        if not words:
+            return False, "empty"
+        if self.min_tokens and count_tokens(message) < self.min_tokens:
+            return False, "too_short"
+
+        content_words = [word for word in words if word not in STOPWORDS and word not in GREETINGS]
+        if not content_words:
+            return False, "no_content"
+        if self.require_self_reference and len(content_words) < 2 and not FIRST_PERSON.intersection(words):
+            return False, "no_self_reference"
+        return True, "passed"
+
+    def metrics(self) -> dict:
+        with self._lock:
+            skipped = sum(self.skipped.values())
+            return {
+                "checked": self.checked,
+                "skipped": skipped,
+                "skip_rate": round(skipped / self.checked, 4) if self.checked else None,
+                "skipped_by_reason": dict(self.skipped),
+            }
+
+
+knowledge_gate = ExtractionGate("knowledge", KNOWLEDGE_GATE_MIN_TOKENS, require_self_reference=True)
+slang_gate = ExtractionGate("slang", SLANG_GATE_MIN_TOKENS, require_self_reference=False)
@@ -2,6 +2,8 @@ import datetime
 import logging
 from typing import List, Optional
 from agents import Agent, Runner
+from app.personal_agents.agent_registry import register_agent
+from app.personal_agents.extraction_gate import knowledge_gate
 from app.supabase.pgvector import find_similar_knowledge, store_user_knowledge
 from pydantic import BaseModel
 
@@ -31,46 +33,68 @@ instructions = (
 )
 
 
+knowledge_agent = register_agent(Agent(
+    name="KnowledgeExtractor",
+    handoff_description="An agent that extracts knowledge from user interactions.",
+    instructions=instructions,
+    model="gpt-4o-mini",
+    output_type=KnowledgeResult
+))
+
+
 class KnowledgeExtractionService:
     def __init__(self, user_id: str):
         self.user_id = user_id
-        self.extraction_agent = Agent(
-            name="KnowledgeExtractor",
-            handoff_description="An agent that extracts knowledge from user interactions.",
-            instructions=instructions,
-            model="gpt-4o-mini",
-            output_type=KnowledgeResult
-        )
+        self.extraction_agent = knowledge_agent
 
     def get_timestamp(self):
         return datetime.datetime.now().isoformat()
 
-    async def extract_knowledge(self, message: str) -> Optional[KnowledgeResult]:
+    async def extract_knowledge(self, message: str, store: bool = True) -> Optional[KnowledgeResult]:
+        """
+        Extracts knowledge from the message and stores it if valuable.
+        Messages that the local knowledge_gate rules out are skipped without a model call.
+        Pass store=False to store it yourself (e.g. with a batch of embeddings).
+        """
+        if not knowledge_gate.should_extract(message):
+            logging.info("Skipped knowledge extraction: message is unlikely to contain any.")
+            return None
         try:
             knowledge_result = await Runner.run(self.extraction_agent, message)
             result = KnowledgeResult(**knowledge_result.final_output.dict())
             
             logging.info(f"Extracted knowledge: {result}")  
 
-            if result.metadata.score.value_score < 0.3:
-                logging.info("Extracted knowledge is not valuable enough to store.")
+            result = self.accept(result)
+            if result is None:
                 return None
-
-            result.metadata.timestamp = self.get_timestamp()
-            await self.store_knowledge(result)
+            if store:
+                await self.store_knowledge(result)
             return result
         except Exception as e:
             logging.error(f"Error extracting knowledge: {e}")
             return None
 
-    def store_knowledge(self, knowledge: KnowledgeResult):
+    def accept(self, result: Optional[KnowledgeResult]) -> Optional[KnowledgeResult]:
+        """
+        Returns the extracted knowledge, timestamped, if it is valuable enough to store.
+        """
+        if result is None:
+            return None
+        if result.metadata.score.value_score < 0.3:
+            logging.info("Extracted knowledge is not valuable enough to store.")
+            return None
+        result.metadata.timestamp = self.get_timestamp()
+        return result
+
+    async def store_knowledge(self, knowledge: KnowledgeResult, embedding: Optional[List[float]] = None):
         """
         Store extracted knowledge in the pgvector-powered Supabase table.
         """
-        store_user_knowledge(self.user_id, knowledge.knowledge_text, knowledge.metadata.dict())
+        await store_user_knowledge(self.user_id, knowledge.knowledge_text, knowledge.metadata.dict(), embedding)
 
-    def retrieve_similar_knowledge(self, query: str, top_k=5):
+    async def retrieve_similar_knowledge(self, query: str, top_k=5, query_embedding: Optional[List[float]] = None):
         """
         Retrieve stored knowledge that is similar to the given query.
         """
-        return find_similar_knowledge(self.user_id, query, top_k)
+        return await find_similar_knowledge(self.user_id, query, top_k, query_embedding)
@@ -0,0 +1,212 @@
+# message_analysis.py
+# MBTI, OCEAN, knowledge and slang analysis of a message, optionally in a single model call.
+# The four analyses used to be four separate agent runs, each re-sending the
+# message with its own system prompt. The combined agent returns all four
+# results in one structured output, and each result is routed to the same
+# service and repository update as before.
+#
+# The combined call only pays off on long inputs: its prompt and output schema
+# are larger than any single agent's, and one call decodes all four outputs in
+# sequence. benchmarks/analysis_calls.py measures it at about four times fewer
+# input tokens than the separate agents for a summarization batch, but more
+# input tokens, higher cost and about 2.3x the p50 latency for chat-length
+# messages. Per-message analysis therefore runs the separate agents
+# concurrently by default (ANALYSIS_MODE), and the summarization batch asks for
+# mode="combined".
+
+import os
+import asyncio
+import itertools
+import logging
+from dataclasses import dataclass
+from typing import Optional
+from agents import Agent, Runner
+from app.personal_agents.agent_registry import register_agent
+from pydantic import BaseModel
+from app.personal_agents import knowledge_extraction, slang_extraction
+from app.personal_agents.extraction_gate import knowledge_gate, slang_gate
+from app.personal_agents.knowledge_extraction import KnowledgeExtractionService, KnowledgeResult
+from app.personal_agents.slang_extraction import SlangExtractionService, SlangResult
+from app.psychology import mbti_analysis, ocean_analysis
+from app.psychology.mbti_analysis import MBTIAnalysisService, MBTIResponse
+from app.psychology.ocean_analysis import OceanAnalysisService, OceanResponse
+from app.supabase.pgvector import generate_embeddings
+from app.supabase.supabase_mbti import MBTI
+from app.supabase.supabase_ocean import Ocean
+from app.utils.job_queue import BackgroundJobQueue
+
+
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "separate")  # separate | combined; the default for per-message analysis
+ANALYSIS_MODES = ("combined", "separate")
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+ANALYSIS_MAX_QUEUE_SIZE = int(os.getenv("ANALYSIS_MAX_QUEUE_SIZE", "1000"))
+
+
+class MessageAnalysis(BaseModel):
+    mbti: MBTIResponse
+    ocean: OceanResponse
+    knowledge: Optional[KnowledgeResult]
+    slang: Optional[SlangResult]
+
+
+instructions = (
+    "You analyze a user's message in four ways and return all four results at once.\n\n"
+    "## mbti\n" + mbti_analysis.instructions + "\n\n"
+    "## ocean\n" + ocean_analysis.instructions.strip() + "\n\n"
+    "## knowledge\n" + knowledge_extraction.instructions.strip() + "\n"
+    "Set knowledge to null if there is nothing to extract.\n\n"
+    "## slang\n" + slang_extraction.instructions.strip() + "\n"
+    "Set slang to null if there is nothing to extract.\n"
+)
+
+analysis_agent = register_agent(Agent(
+    name="MessageAnalyzer",
+    handoff_description="An agent that runs MBTI, OCEAN, knowledge and slang analysis of a message in one pass.",
+    instructions=instructions,
+    model="gpt-4o-mini",
+    output_type=MessageAnalysis,
+))
+
+
+@dataclass
+class AnalysisResults:
+    mbti: Optional[MBTIResponse] = None
+    ocean: Optional[OceanResponse] = None
+    knowledge: Optional[KnowledgeResult] = None
+    slang: Optional[SlangResult] = None
+
+
+class MessageAnalysisService:
+    """
+    Service class that runs every per-message analysis and routes each result
+    to its service: MBTI and OCEAN rolling averages, knowledge and slang storage.
+    """
+    def __init__(self, user_id: str, mbti: Optional[MBTI] = None, ocean: Optional[Ocean] = None):
+        self.user_id = user_id
+        self.mbti_service = MBTIAnalysisService(user_id, mbti=mbti)
+        self.ocean_service = OceanAnalysisService(user_id, ocean=ocean)
+        self.knowledge_service = KnowledgeExtractionService(user_id)
+        self.slang_service = SlangExtractionService(user_id)
+
+    async def analyze(self, message: str, mode: Optional[str] = None, store: bool = True) -> AnalysisResults:
+        """
+        Analyzes the message, updates the MBTI and OCEAN scores and, with store=True,
+        stores valuable knowledge and slang (embedded in one request).
+        Each analysis logs and swallows its own failures; failed results are None.
+        """
+        mode = mode or ANALYSIS_MODE
+        if mode not in ANALYSIS_MODES:
+            raise ValueError(f"Unknown analysis mode: {mode}")
+
+        if mode == "combined":
+            results = await self._analyze_combined(message)
+        else:
+            results = await self._analyze_separately(message)
+
+        if store:
+            await self.store_extractions(results.knowledge, results.slang)
+        return results
+
+    async def _analyze_combined(self, message: str) -> AnalysisResults:
+        try:
+            analysis_result = await Runner.run(analysis_agent, message)
+            analysis = MessageAnalysis(**analysis_result.final_output.dict())
+            logging.info(f"Message analysis: {analysis}")
+        except Exception as e:
+            logging.error(f"Error in combined message analysis: {e}")
+            return AnalysisResults()
+
+        try:
+            await asyncio.gather(
+                asyncio.to_thread(self.mbti_service.record_response, analysis.mbti),
+                asyncio.to_thread(self.ocean_service.record_response, analysis.ocean),
+            )
+        except Exception as e:
+            logging.error(f"Error saving MBTI/OCEAN analysis: {e}")
+
+        # The one call cannot leave out the extractions, but the gates still
+        # decide which are kept, as they do for the separate agents
+        return AnalysisResults(
+            mbti=analysis.mbti,
+            ocean=analysis.ocean,
+            knowledge=self.knowledge_service.accept(analysis.knowledge) if knowledge_gate.should_extract(message) else None,
+            slang=self.slang_service.accept(analysis.slang) if slang_gate.should_extract(message) else None,
+        )
+
+    async def _analyze_separately(self, message: str) -> AnalysisResults:
+        mbti, ocean, knowledge, slang = await asyncio.gather(
+            self.mbti_service.analyze_message(message),
+            self.ocean_service.analyze_message(message),
+            self.knowledge_service.extract_knowledge(message, store=False),
+            self.slang_service.extract_slang(message, store=False),
+        )
+        return AnalysisResults(mbti, ocean, knowledge, slang)
+
+    async def store_extractions(self, knowledge: Optional[KnowledgeResult], slang: Optional[SlangResult]):
+        """
+        Embeds the extracted knowledge and slang in one request, then stores them.
+        """
+        texts = [item for item in (knowledge and knowledge.knowledge_text, slang and slang.slang_text) if item]
+        if not texts:
+            return
+        embeddings = dict(zip(texts, await generate_embeddings(texts)))
+        if knowledge:
+            await self.knowledge_service.store_knowledge(knowledge, embeddings[knowledge.knowledge_text])
+        if slang:
+            await self.slang_service.store_slang(slang, embeddings[slang.slang_text])
+
+
+# Every analysis that updates a user's rolling averages runs on this queue:
+# fire-and-forget per-message analyses, the summarization batch's, and those a
+# request waits for (run_analysis). Every analysis is its own job (unique keys,
+# so nothing is coalesced); jobs for the same user (the key's group) run one at
+# a time, in order, so that rolling averages are never updated from a stale
+# read. The queue hands a user's later jobs to the worker running their first
+# one, so a burst from one user occupies a single worker.
+analysis_queue = BackgroundJobQueue(
+    "analysis",
+    workers=ANALYSIS_WORKERS,
+    max_retries=0,
+    max_queue_size=ANALYSIS_MAX_QUEUE_SIZE,
+    group_of=lambda key: key[0],
+)
+_job_ids = itertools.count()
+
+
+def submit_analysis(user_id: str, message: str, mode: Optional[str] = None) -> bool:
+    """
+    Queues a background analysis of the message. Returns False if the queue is full.
+    """
+    return analysis_queue.submit((user_id, next(_job_ids)), lambda: _analyze_in_background(user_id, message, mode))
+
+
+async def run_analysis(user_id: str, message: str, mode: Optional[str] = None) -> MessageAnalysisService:
+    """
+    Analyzes the message on the queue, after the user's earlier analyses, and
+    waits for it. Returns the service, whose scores include this message's.
+    Raises RuntimeError if the queue is full.
+    """
+    done = asyncio.get_running_loop().create_future()
+
+    async def job():
+        try:
+            service = await asyncio.to_thread(MessageAnalysisService, user_id)
+            await service.analyze(message, mode=mode)
+        except Exception as e:
+            if not done.done():
+                done.set_exception(e)
+            raise
+        if not done.done():
+            done.set_result(service)
+
+    if not analysis_queue.submit((user_id, next(_job_ids)), job):
+        raise RuntimeError(f"Analysis queue is full; could not analyze a message for user {user_id}.")
+    return await done
+
+
+async def _analyze_in_background(user_id: str, message: str, mode: Optional[str]):
+    # Read the current scores when the job runs, after any earlier job for the user saved its update
+    service = await asyncio.to_thread(MessageAnalysisService, user_id)
+    results = await service.analyze(message, mode=mode)
+    if results.mbti is None and results.ocean is None:
+        raise RuntimeError(f"Message analysis failed for user {user_id}.")
@@ -1,6 +1,7 @@
 import logging
 from typing import List, Optional
 from agents import Agent, Runner, function_tool
+from app.personal_agents.agent_registry import register_agent
 from pydantic import BaseModel, Field
 
 class TodoItem(BaseModel):
@@ -32,27 +33,21 @@ class PlannerResult(BaseModel):
                 item.result = result
                 break
 
+instructions = (
+    "You are an AI planner tasked with creating a clear, actionable plan based on a user's input. "
+    "Create a plan with 3-5 specific, actionable steps that can be executed in sequence. "
+    "Each step should be concrete and achievable. "
+    "Your output should be a JSON object with two keys: 'plan' (a summary of the plan) and 'todo_list' "
+    "(a list of specific, actionable steps)."
+)
+
 class PlannerService:
     """
     A service that encapsulates an AI planner agent which generates actionable plans 
     and dynamic to-do lists based on a user's input.
     """
     def __init__(self):
-        instructions = (
-            "You are an AI planner tasked with creating a clear, actionable plan based on a user's input. "
-            "Create a plan with 3-5 specific, actionable steps that can be executed in sequence. "
-            "Each step should be concrete and achievable. "
-            "Your output should be a JSON object with two keys: 'plan' (a summary of the plan) and 'todo_list' "
-            "(a list of specific, actionable steps)."
-        )
-        self.agent = Agent(
-            name="Planner",
-            handoff_description="An agent that generates clear, actionable plans.",
-            instructions=instructions,
-            model="gpt-4o-mini",
-            output_type=PlannerOutput,
-            tools=[self.create_plan]
-        )
+        self.agent = planner_agent
 
     @function_tool
     async def create_plan(self, task: str) -> PlannerResult:
@@ -76,3 +71,19 @@ class PlannerService:
         except Exception as e:
             logging.error(f"Error creating plan: {e}")
             raise ValueError(f"Failed to create plan: {str(e)}")
+
+
+planner_agent = register_agent(Agent(
+    name="Planner",
+    handoff_description="An agent that generates clear, actionable plans.",
+    instructions=instructions,
+    model="gpt-4o-mini",
+    output_type=PlannerOutput,
+    tools=[PlannerService.create_plan]
+))
+
+# The planner as a tool of the conversation agents, wrapped once
+planner_tool = planner_agent.as_tool(
+    tool_name="create_plan",
+    tool_description="A tool that creates a plan for the user to follow."
+)
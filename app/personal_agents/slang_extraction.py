@@ -2,6 +2,8 @@ from datetime import datetime
 import logging
 from typing import List, Optional
 from agents import Agent, Runner
+from app.personal_agents.agent_registry import register_agent
+from app.personal_agents.extraction_gate import slang_gate
 from app.supabase.pgvector import find_similar_knowledge, find_similar_slang, store_user_knowledge, store_user_slang
 from pydantic import BaseModel
 
@@ -28,47 +30,69 @@ instructions = (
     "If the value score is below 0.3, do not store the slang. Return your result in the following JSON format:\n"
 )
 
+slang_agent = register_agent(Agent(
+    name="SlangExtractor",
+    handoff_description="An agent that extracts slang and informal language from user interactions, filtering out swear words.",
+    instructions=instructions,
+    model="gpt-4o-mini",
+    output_type=SlangResult
+))
+
+
 class SlangExtractionService:
     def __init__(self, user_id: str):
         self.user_id = user_id
-        self.extraction_agent = Agent(
-            name="SlangExtractor",
-            handoff_description="An agent that extracts slang and informal language from user interactions, filtering out swear words.",
-            instructions=instructions,
-            model="gpt-4o-mini",
-            output_type=SlangResult
-        )
+        self.extraction_agent = slang_agent
 
     def get_timestamp(self) -> str:
         return datetime.now().isoformat()
 
-    async def extract_slang(self, message: str) -> Optional[SlangResult]:
+    async def extract_slang(self, message: str, store: bool = True) -> Optional[SlangResult]:
+        """
+        Extracts slang from the message and stores it if valuable.
+        Messages that the local slang_gate rules out are skipped without a model call.
+        Pass store=False to store it yourself (e.g. with a batch of embeddings).
+        """
+        if not slang_gate.should_extract(message):
+            logging.info("Skipped slang extraction: message is unlikely to contain any.")
+            return None
         try:
             slang_result = await Runner.run(self.extraction_agent, message)
             result = SlangResult(**slang_result.final_output.dict())
             
             logging.info(f"Extracted slang: {result}")
             
-            if result.metadata.score.value_score < 0.3:
-                logging.info("Extracted slang is not valuable enough to store.")
+            result = self.accept(result)
+            if result is None:
                 return None
-            
-            result.metadata.timestamp = self.get_timestamp()
-            self.store_slang(result)
+            if store:
+                await self.store_slang(result)
             
             return result
         except Exception as e:
             logging.error(f"Error extracting slang: {e}")
             return None
 
-    async def store_slang(self, slang: SlangResult):
+    def accept(self, result: Optional[SlangResult]) -> Optional[SlangResult]:
+        """
+        Returns the extracted slang, timestamped, if it is valuable enough to store.
+        """
+        if result is None:
+            return None
+        if result.metadata.score.value_score < 0.3:
+            logging.info("Extracted slang is not valuable enough to store.")
+            return None
+        result.metadata.timestamp = self.get_timestamp()
+        return result
+
+    async def store_slang(self, slang: SlangResult, embedding: Optional[List[float]] = None):
         """
         Store extracted slang in the vector store using a similar function to your knowledge extraction.
         """
-        store_user_slang(self.user_id, slang.slang_text, slang.metadata.dict())
+        await store_user_slang(self.user_id, slang.slang_text, slang.metadata.dict(), embedding)
 
-    def retrieve_similar_slang(self, query: str, top_k: int = 2):
+    async def retrieve_similar_slang(self, query: str, top_k: int = 2, query_embedding: Optional[List[float]] = None):
         """
         Retrieve stored slang that is similar to the given query.
         """
-        return find_similar_slang(self.user_id, query, top_k)
+        return await find_similar_slang(self.user_id, query, top_k, query_embedding)
@@ -1,7 +1,9 @@
 import logging
+from typing import Optional
 from pydantic import BaseModel
 from app.supabase.supabase_mbti import MBTI, MBTIRepository
 from agents import Agent, Runner, function_tool
+from app.personal_agents.agent_registry import register_agent
 
 
 logging.basicConfig(level=logging.INFO)
@@ -22,13 +24,13 @@ instructions = (
     "With 0 being being fully judging and 1 being fully perceiving." 
 )
 
-mbti_agent = Agent(
+mbti_agent = register_agent(Agent(
     name="MBTI",
     handoff_description="A MBTI analysis agent.",
     instructions=instructions,
     model="gpt-4o-mini",
     output_type=MBTIResponse,
-)
+))
 
 
 class MBTIAnalysisService:
@@ -36,11 +38,15 @@ class MBTIAnalysisService:
     Service class that coordinates MBTI data retrieval, analysis, and updates.
     """
 
-    def __init__(self, user_id: str):
+    def __init__(self, user_id: str, mbti: Optional[MBTI] = None):
         self.user_id = user_id
         self.repository = MBTIRepository()
-        self.mbti = self.mbti = self.repository.get_mbti(self.user_id) or MBTI()  # default
-        self.load_mbti()
+        if mbti is not None:
+            # Seeded from an already-loaded record (e.g. the persona bundle)
+            self.mbti = mbti.copy()
+        else:
+            self.mbti = MBTI()  # default
+            self.load_mbti()
 
     def load_mbti(self):
         """
@@ -65,12 +71,7 @@ class MBTIAnalysisService:
         """
         try:
             mbti_result = await Runner.run(mbti_agent, message)
-                        
-            # Update the rolling average
-            self._update_mbti_rolling_average(MBTIResponse(**mbti_result.final_output.dict()))
-            
-            # Save the updated MBTI data to Supabase
-            self.save_mbti()
+            self.record_response(MBTIResponse(**mbti_result.final_output.dict()))
             
             logging.info(f"MBTI result: {mbti_result}")
                         
@@ -81,6 +82,16 @@ class MBTIAnalysisService:
             return None  # Return None to indicate analysis failed
     
 
+    def record_response(self, response: MBTIResponse):
+        """
+        Folds one analysis result into the rolling average and saves it.
+        """
+        # Update the rolling average
+        self._update_mbti_rolling_average(response)
+
+        # Save the updated MBTI data to Supabase
+        self.save_mbti()
+
     def _update_mbti_rolling_average(self, new_mbti: MBTIResponse):
         """
         Updates the rolling average for each dimension.
@@ -111,10 +122,17 @@ class MBTIAnalysisService:
         
         print("MBTI Self: ", self.mbti)
         
-        e_i = "E" if self.mbti.extraversion_introversion >= 0.5 else "I"
-        s_n = "S" if self.mbti.sensing_intuition >= 0.5 else "N"
-        t_f = "T" if self.mbti.thinking_feeling >= 0.5 else "F"
-        j_p = "J" if self.mbti.judging_perceiving >= 0.5 else "P"
+        return self.type_from_scores(self.mbti)
+
+    @staticmethod
+    def type_from_scores(mbti: MBTI) -> str:
+        """
+        Converts a set of MBTI scores into a 4-letter type (E/I, S/N, T/F, J/P).
+        """
+        e_i = "E" if mbti.extraversion_introversion >= 0.5 else "I"
+        s_n = "S" if mbti.sensing_intuition >= 0.5 else "N"
+        t_f = "T" if mbti.thinking_feeling >= 0.5 else "F"
+        j_p = "J" if mbti.judging_perceiving >= 0.5 else "P"
         return e_i + s_n + t_f + j_p
 
     @staticmethod
@@ -1,6 +1,8 @@
 from pydantic import BaseModel
 from agents import Agent, Runner
+from app.personal_agents.agent_registry import register_agent
 import logging
+from typing import Optional
 from app.supabase.supabase_ocean import Ocean, OceanRepository
 
     
@@ -26,20 +28,24 @@ The OCEAN personality analysis should have 5 dimensions:
 Each dimension should have a score between 0 and 1, with 1 being the highest score.
 """
 
-ocean_agent = Agent(
+ocean_agent = register_agent(Agent(
     name="OCEAN",
     handoff_description="A Ocean framework sentiment analysis agent.",
     instructions=instructions,
     model="gpt-4o-mini",
     output_type=OceanResponse,
-)
+))
 
 class OceanAnalysisService:
-    def __init__(self, user_id: str):
+    def __init__(self, user_id: str, ocean: Optional[Ocean] = None):
         self.user_id = user_id
         self.repository = OceanRepository()
-        self.ocean = self.repository.get_ocean(self.user_id) or Ocean()
-        self.load_ocean()
+        if ocean is not None:
+            # Seeded from an already-loaded record (e.g. the persona bundle)
+            self.ocean = ocean.copy()
+        else:
+            self.ocean = Ocean()
+            self.load_ocean()
 
     def load_ocean(self):
         stored_ocean = self.repository.get_ocean(self.user_id)
@@ -55,12 +61,7 @@ class OceanAnalysisService:
         try:
             ocean_result = await Runner.run(ocean_agent, message)
             logging.info(f"OCEAN result: {ocean_result}")
-                    
-            # Update rolling average
-            self._update_ocean_rolling_average(OceanResponse(**ocean_result.final_output.dict()))
-            
-            # Save the updated OCEAN data to Supabase
-            self.save_ocean()
+            self.record_response(OceanResponse(**ocean_result.final_output.dict()))
             
             return ocean_result.final_output
             
@@ -68,6 +69,16 @@ class OceanAnalysisService:
             logging.error(f"Error in OCEAN analysis: {e}")
             return None  # Return None to indicate analysis failed
 
+    def record_response(self, response: OceanResponse):
+        """
+        Folds one analysis result into the rolling average and saves it.
+        """
+        # Update rolling average
+        self._update_ocean_rolling_average(response)
+
+        # Save the updated OCEAN data to Supabase
+        self.save_ocean()
+
     def _update_ocean_rolling_average(self, new_ocean: OceanResponse):
         old_count = self.ocean.response_count
         new_count = old_count + 1
@@ -85,12 +96,19 @@ class OceanAnalysisService:
         """
         Returns the current OCEAN scores as personality traits.
         """
+        return self.traits_from_scores(self.ocean)
+
+    @staticmethod
+    def traits_from_scores(ocean: Ocean) -> dict:
+        """
+        Converts a set of OCEAN scores into High/Low personality traits.
+        """
         return {
-            "openness": "High" if self.ocean.openness >= 0.5 else "Low",
-            "conscientiousness": "High" if self.ocean.conscientiousness >= 0.5 else "Low",
-            "extraversion": "High" if self.ocean.extraversion >= 0.5 else "Low",
-            "agreeableness": "High" if self.ocean.agreeableness >= 0.5 else "Low",
-            "neuroticism": "High" if self.ocean.neuroticism >= 0.5 else "Low"
+            "openness": "High" if ocean.openness >= 0.5 else "Low",
+            "conscientiousness": "High" if ocean.conscientiousness >= 0.5 else "Low",
+            "extraversion": "High" if ocean.extraversion >= 0.5 else "Low",
+            "agreeableness": "High" if ocean.agreeableness >= 0.5 else "Low",
+            "neuroticism": "High" if ocean.neuroticism >= 0.5 else "Low"
         }
 
 
@@ -1,5 +1,7 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from fastapi.responses import JSONResponse
+from app.auth import verify_metrics_token
+from app.utils.metrics import collect_metrics
 
 health_check_router = APIRouter()
 
@@ -7,3 +9,8 @@ health_check_router = APIRouter()
 @health_check_router.get("/")
 async def health_check():
     return JSONResponse(content={"status": "I am Alive!"}, status_code=200)
+
+
+@health_check_router.get("/metrics", dependencies=[Depends(verify_metrics_token)])
+async def metrics():
+    return JSONResponse(content=collect_metrics(), status_code=200)
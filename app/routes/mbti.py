@@ -3,9 +3,12 @@ from fastapi import APIRouter, Request, Depends
 from app.psychology.mbti_analysis import MBTIAnalysisService
 from pydantic import BaseModel
 from app.auth import verify_token
+from app.supabase.persona import PersonaRepository
+import asyncio
 
 
 router = APIRouter()
+persona_repo = PersonaRepository()
 
 
 class MBTIRequest(BaseModel):
@@ -91,8 +94,7 @@ async def update_mbti(data: MBTIUpdateRequest, user=Depends(verify_token)):
 @router.get("/mbti-type")
 async def get_mbti_type(user=Depends(verify_token)):
     user_id =  user_id = user["id"] 
-    service = MBTIAnalysisService(user_id)
-    mbti_type = service.get_mbti_type()
-    return {"mbti_type": mbti_type}
+    persona = await asyncio.to_thread(persona_repo.get_bundle, user_id)
+    return {"mbti_type": persona.mbti_type}
 
 
@@ -25,7 +25,7 @@ async def check_text_content(text: str) -> ModerationResponse:
     Check if text content is safe according to OpenAI's content policy.
     """
     try:
-        moderation = moderation_service.check_content(text)
+        moderation = await moderation_service.check_content(text)
 
         if moderation is None:
             raise HTTPException(status_code=503, detail="Content moderation check failed. See server logs for details.")
@@ -55,7 +55,7 @@ async def check_image_content(request: ImageModerationRequest) -> ModerationResp
     Check if image content is safe according to OpenAI's content policy
     """
     try:
-        moderation = moderation_service.check_image(request.image_url)
+        moderation = await moderation_service.check_image(request.image_url)
 
         if moderation is None:
             raise HTTPException(status_code=503, detail="Content moderation check failed. See server logs for details.")
@@ -85,7 +85,7 @@ async def is_safe(request: ContentModerationRequest) -> bool:
     Check if text or image content is safe
     """
     try:
-        is_safe = moderation_service.is_safe(request.text, request.image_url)
+        is_safe = await moderation_service.is_safe(request.text, request.image_url)
         return is_safe
     except Exception as e:
         raise HTTPException(status_code=503, detail="Content moderation check failed. See server logs for details.")
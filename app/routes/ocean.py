@@ -3,9 +3,12 @@ from app.supabase.supabase_ocean import Ocean
 from fastapi import APIRouter, Request, Depends
 from pydantic import BaseModel
 from app.psychology.ocean_analysis import OceanAnalysisService
+from app.supabase.persona import PersonaRepository
+import asyncio
 
 
 router = APIRouter()
+persona_repo = PersonaRepository()
 
 
 class OceanRequest(BaseModel):
@@ -92,11 +95,10 @@ async def update_ocean(data: OceanUpdateRequest, user=Depends(verify_token)):
 @router.get("/ocean-traits")
 async def get_ocean_traits(user=Depends(verify_token)):
     user_id = user["id"]
-    service = OceanAnalysisService(user_id)
-    traits = service.get_personality_traits()
+    persona = await asyncio.to_thread(persona_repo.get_bundle, user_id)
     return {
-        "personality_traits": traits,
-        "raw_scores": service.ocean.dict()
+        "personality_traits": persona.ocean_traits,
+        "raw_scores": persona.ocean.dict()
     }
 
 
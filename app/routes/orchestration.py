@@ -1,18 +1,29 @@
-from http.client import HTTPException
 from app.personal_agents.knowledge_extraction import KnowledgeExtractionService
-from app.personal_agents.planner import PlannerService
+from app.personal_agents.message_analysis import run_analysis, submit_analysis
+from app.personal_agents.agent_registry import register_agent
+from app.personal_agents.planner import planner_tool
 from app.personal_agents.slang_extraction import SlangExtractionService
-from app.psychology.mbti_analysis import MBTIAnalysisService
-from app.psychology.ocean_analysis import OceanAnalysisService
-from app.supabase.conversation_history import append_message_to_history, get_or_create_conversation_history, replace_conversation_history_with_summary
+from app.personal_agents.conversation_context import conversation_store
+from app.supabase.conversation_history import ASSISTANT_ROLE, USER_ROLE
+from app.supabase.persona import PersonaRepository
+from app.supabase.credit_holds import CreditHold
 from app.supabase.profiles import ProfileRepository
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
+from dataclasses import dataclass, field
+from typing import Any, List, Literal, Optional, Tuple
+import os
+import time
 import asyncio
 import logging
 from app.auth import verify_token
-from agents import Agent, Runner, WebSearchTool, FileSearchTool, function_tool
-from app.utils.token_count import calculate_credits_to_deduct, calculate_provider_cost, count_tokens
+from agents import Agent, RunContextWrapper, Runner, WebSearchTool, FileSearchTool, function_tool
+from app.utils.context_packer import ContextPacker, Section, similar_items
+from app.utils.prefetch import REQUIRED, PrefetchStage
+from app.utils.prompts import PromptBuilder, prompt_cache_stats
+from app.utils.streaming import sse_response, stream_agent
+from app.utils.billing import UsageLedger, start_usage_ledger
+from app.utils.token_count import calculate_credits_to_deduct, estimate_provider_cost
 
 
 router = APIRouter()
@@ -23,6 +34,14 @@ class UserInput(BaseModel):
 
 
 profile_repo = ProfileRepository()
+persona_repo = PersonaRepository()
+
+# convo_lead's inputs; the slang lookup makes an embedding call
+convo_lead_prefetch = PrefetchStage("convo_lead", timeouts={"persona": 2.0, "slang": 1.5, "history": 2.0})
+
+# Model calls a convo lead run's credit hold covers: the agent's reply, a
+# tool-call turn and the planner. A run stops once its usage reaches the hold.
+CONVO_LEAD_HOLD_CALLS = int(os.getenv("CONVO_LEAD_HOLD_CALLS", "3"))
 
 
 def get_user_name(user_id: str) -> str:
@@ -79,64 +98,151 @@ async def retrieve_personalized_info_about_user(user_id: str, query: str) -> str
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
+# Vector stores searched by the orchestration agent's file search tool, comma-separated
+OPENAI_VECTOR_STORE_IDS = [store_id for store_id in os.getenv("OPENAI_VECTOR_STORE_IDS", "").split(",") if store_id]
+
+
+# Token budgets of the prompt context sections
+CONVO_LEAD_HISTORY_TOKENS = int(os.getenv("CONVO_LEAD_HISTORY_TOKENS", "2000"))
+CONVO_LEAD_HISTORY_DROP_STEP = int(os.getenv("CONVO_LEAD_HISTORY_DROP_STEP", "8"))
+SIMILAR_KNOWLEDGE_TOKENS = int(os.getenv("SIMILAR_KNOWLEDGE_TOKENS", "400"))
+SLANG_EXAMPLE_TOKENS = int(os.getenv("SLANG_EXAMPLE_TOKENS", "100"))
+
+
+@dataclass
+class WitContext:
+    mbti_type: str
+    style_prompt: str
+    ocean_traits: Any
+    similar_knowledge: Any
+    sections: Optional[List[Tuple[str, str]]] = field(default=None, repr=False)  # Packed once per run
+
+
+wit_packer = ContextPacker("orchestration", {
+    "MBTI Type": 16,
+    "Conversational Style": 64,
+    "OCEAN Traits": 64,
+    "Similar Previous Knowledge": SIMILAR_KNOWLEDGE_TOKENS,
+})
+
+
+wit_prompt = PromptBuilder(
+    "You are a conversational agent. Respond to the user using the information provided below."
+)
+
+
+def wit_instructions(run_context: RunContextWrapper[WitContext], agent: Agent) -> str:
+    context = run_context.context
+    if context.sections is None:
+        context.sections = wit_packer.pack([
+            Section("MBTI Type", context.mbti_type),
+            Section("Conversational Style", context.style_prompt),
+            Section("OCEAN Traits", context.ocean_traits),
+            Section("Similar Previous Knowledge", similar_items(context.similar_knowledge, "knowledge_text"), drop="least_similar"),
+        ])
+    return wit_prompt.build(context.sections)
+
+
+wit_agent = register_agent(Agent[WitContext](
+    name="Wit",
+    handoff_description="A conversational response agent given the context.",
+    instructions=wit_instructions,
+    model="gpt-4o-mini",
+    tools=[WebSearchTool()] + ([FileSearchTool(vector_store_ids=OPENAI_VECTOR_STORE_IDS)] if OPENAI_VECTOR_STORE_IDS else []),
+))
+
+
+@dataclass
+class ConvoLeadContext:
+    user_id: str
+    user_name: Optional[str]
+    mbti_type: str
+    style_prompt: str
+    ocean_traits: Any
+    slang: Any
+    history: List[str]
+    sections: Optional[List[Tuple[str, str]]] = field(default=None, repr=False)  # Packed once per run
+
+
+convo_lead_packer = ContextPacker("convo_lead", {
+    "User": 64,
+    "Personality MBTI Type": 16,
+    "Conversational Style": 64,
+    "Personality OCEAN Traits": 64,
+    "Conversation History": CONVO_LEAD_HISTORY_TOKENS,
+    "Examples of the User's Language": SLANG_EXAMPLE_TOKENS,
+})
+
+
+# Static instructions first and user data after, least volatile first, so that
+# repeat turns share the longest possible cached prompt prefix.
+convo_lead_prompt = PromptBuilder("""
+You are a conversational agent.
+
+If the user's name is not available, ask for it first.
+When the user's name is given, update it using the update_user_name tool with the user_id below.
+
+You will lead the conversation with the user. You will ask questions to get to know the user better.
+Ask your questions in a natural way as the conversation progresses. Ask questions that are relevant to gain accurate MBTI type and OCEAN analysis traits of the user.
+Ask questions that are relevant to the user's message.
+
+Keep your language simple, natural, and conversational. Keep it at a 5th grade level.
+
+DO NOT MENTION MBTI OR OCEAN analysis in your response.
+
+Below are the user's details and personality, the conversational style to use, the conversation so far,
+and examples of the user's language; use similar language as the user.
+""")
+
+
+def convo_lead_instructions(run_context: RunContextWrapper[ConvoLeadContext], agent: Agent) -> str:
+    context = run_context.context
+    if context.sections is None:
+        context.sections = convo_lead_packer.pack([
+            Section("User", {"user_id": context.user_id, "name": context.user_name}),
+            Section("Personality MBTI Type", context.mbti_type),
+            Section("Conversational Style", context.style_prompt),
+            Section("Personality OCEAN Traits", context.ocean_traits),
+            Section("Conversation History", context.history, drop="oldest", step=CONVO_LEAD_HISTORY_DROP_STEP),
+            Section("Examples of the User's Language", similar_items(context.slang, "slang_text"), drop="least_similar"),
+        ])
+    return convo_lead_prompt.build(context.sections)
+
+
+convo_lead_agent = register_agent(Agent[ConvoLeadContext](
+    name="Astra AI",
+    handoff_description="A conversational agent that leads the conversation with the user to get to know them better.",
+    instructions=convo_lead_instructions,
+    model="gpt-4o-mini",
+    tools=[
+        get_users_name, update_user_name, 
+        retrieve_personalized_info_about_user,
+        planner_tool,
+    ]
+))
+
+
 @router.post("/orchestration")
-async def orchestrate(user_input: UserInput, user=Depends(verify_token)):
+async def orchestrate(
+    user_input: UserInput,
+    analysis_mode: Optional[Literal["combined", "separate"]] = None,
+    wait_for_analysis: bool = False,
+    user=Depends(verify_token),
+):
     """
     Orchestrates sentiment analysis, personality assessments (MBTI, OCEAN),
     knowledge extraction, similarity search, and dynamic AI response generation.
+    The response is built from the currently stored traits while the analyses of
+    this message run in the background; pass wait_for_analysis=true to run them
+    first and respond with the updated traits.
+    The analyses run as concurrent individual agents by default (cheaper and
+    faster for chat-length messages); pass analysis_mode=combined to run them
+    as one model call instead.
     """
     try:
-        user_id = user["id"]
-        message = user_input.message
-        
-        logging.info(f"User ID: {user_id}")
-
-        # Run analyses concurrently
-        mbti_service = MBTIAnalysisService(user_id)
-        mbti_task = asyncio.create_task(mbti_service.analyze_message(message))
-        
-        ocean_service = OceanAnalysisService(user_id)
-        ocean_task = asyncio.create_task(ocean_service.analyze_message(message))
-
-        knowledge_service = KnowledgeExtractionService(user_id)
-
-        # Wait for all tasks to complete
-        await mbti_task  # MBTI updates asynchronously
-        await ocean_task  # OCEAN updates asynchronously
-        
-        # Retrieve stored MBTI & OCEAN
-        mbti_type = mbti_service.get_mbti_type()
-        style_prompt = mbti_service.generate_style_prompt(mbti_type)
-        ocean_traits = ocean_service.get_personality_traits()
-        
-        logging.info(f"MBTI Type: {mbti_type, style_prompt}")
-        logging.info(f"OCEAN Traits: {ocean_traits}")
-
-        # Run similarity search on extracted knowledge
-        similar_knowledge = await knowledge_service.retrieve_similar_knowledge(message, top_k=3)
-
-        # Construct dynamic system prompt
-        system_prompt = (
-            f"MBTI Type: {mbti_type, style_prompt}.\n"
-            f"OCEAN Traits: {ocean_traits}.\n"
-            f"Similar Previous Knowledge: {similar_knowledge}."
-        )
-        
-        logging.info(f"System prompt: {system_prompt}")
-
-        # Generate AI response using system prompt
-        conversational_agent = Agent(
-            name="Wit",
-            handoff_description="A conversational response agent given the context.",
-            instructions= system_prompt + "\n\n You are a conversational agent. Respond to the user using the information provided.",
-            model="gpt-4o-mini",
-            tools=[
-                WebSearchTool(),
-                FileSearchTool()
-            ]
-        )
-
-        response = await Runner.run(conversational_agent, message)
+        context = await prepare_orchestration(user["id"], user_input.message, analysis_mode, wait_for_analysis)
+        response = await Runner.run(wit_agent, user_input.message, context=context)
+        prompt_cache_stats.record("orchestration", response.context_wrapper.usage)
               
         logging.info(f"Response Object: {response}")  
 
@@ -145,137 +251,206 @@ async def orchestrate(user_input: UserInput, user=Depends(verify_token)):
     except Exception as e:
         logging.error(f"Error processing orchestration: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
-    
-    
-@router.post("/convo-lead")
-async def convo_lead(user_input: UserInput, user=Depends(verify_token)):
+
+
+@router.post("/orchestration/stream")
+async def orchestrate_stream(
+    user_input: UserInput,
+    analysis_mode: Optional[Literal["combined", "separate"]] = None,
+    wait_for_analysis: bool = False,
+    user=Depends(verify_token),
+):
     """
-    Leads the conversation with the user. Asking questions to get to know the user better.  
+    Streaming variant of /orchestration: the response is sent as Server-Sent
+    Events ("delta" events with text as it is generated, then "done").
     """
-    user_id = user["id"]
-    
-    # TODO: Add a check to see if the user has enough credits by calculating the token used in the message
-    credits = profile_repo.get_user_credit(user_id)
-    if credits is None or credits < 1:
-        raise HTTPException(status_code=402, detail="Insufficient credits")
-    
-    # Get the users name
-    user_name = get_user_name(user_id)
-    
-    # Append the new user message to the conversation history
-    if user_name is None:
-        append_message_to_history(user_id, "user", user_input.message)
+    started_at = time.perf_counter()
+    try:
+        context = await prepare_orchestration(user["id"], user_input.message, analysis_mode, wait_for_analysis)
+    except Exception as e:
+        logging.error(f"Error processing orchestration: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+    return sse_response(stream_agent("orchestration", wit_agent, user_input.message, started_at, context=context))
+
+
+async def prepare_orchestration(user_id: str, message: str, analysis_mode: Optional[str], wait_for_analysis: bool) -> WitContext:
+    """
+    Gathers the user's traits and similar knowledge for the response agent.
+    """
+    logging.info(f"User ID: {user_id}")
+
+    if wait_for_analysis:
+        # Run the MBTI, OCEAN, knowledge and slang analyses and store their results.
+        # They run on the analysis queue, after the user's queued analyses, and
+        # update the rolling averages from the stored scores, not the cached
+        # persona bundle, which can predate the previous message's update.
+        analysis_service = await run_analysis(user_id, message, mode=analysis_mode)
+        mbti_type = analysis_service.mbti_service.get_mbti_type()
+        style_prompt = analysis_service.mbti_service.generate_style_prompt(mbti_type)
+        ocean_traits = analysis_service.ocean_service.get_personality_traits()
+        knowledge_service = analysis_service.knowledge_service
     else:
-        append_message_to_history(user_id, user_name, user_input.message)
-    
-    # Initialize the services
-    mbti_service = MBTIAnalysisService(user_id)    
-    ocean_service = OceanAnalysisService(user_id)
-    slang_service = SlangExtractionService(user_id)
-
-    # Retrieve stored MBTI & OCEAN
-    mbti_type = mbti_service.get_mbti_type()
-    style_prompt = mbti_service.generate_style_prompt(mbti_type)
-    ocean_traits = ocean_service.get_personality_traits()
-    slang_result = slang_service.retrieve_similar_slang(user_input.message)
+        # Respond with the stored traits (from the cached persona bundle); this
+        # message's analyses update them afterwards
+        submit_analysis(user_id, message, mode=analysis_mode)
+        persona = await asyncio.to_thread(persona_repo.get_bundle, user_id)
+        mbti_type = persona.mbti_type
+        style_prompt = persona.style_prompt
+        ocean_traits = persona.ocean_traits
+        knowledge_service = KnowledgeExtractionService(user_id)
     
+    logging.info(f"MBTI Type: {mbti_type, style_prompt}")
+    logging.info(f"OCEAN Traits: {ocean_traits}")
+
+    # Run similarity search on extracted knowledge
+    similar_knowledge = await knowledge_service.retrieve_similar_knowledge(message, top_k=3)
+
+    return WitContext(mbti_type, style_prompt, ocean_traits, similar_knowledge)
     
-    # Retrieve or create the conversation context for the user
-    history = get_or_create_conversation_history(user_id)
     
-    instructions = f"""
-        You are a conversational agent. 
-        
-        The user_id is {user_id}.
-        You are having a conversation with (this is the user's name) {user_name}. 
-        If their name is not available, ask for it first. 
-        When the user's name is given, update it using the update_user_name tool.
-                
-        You will lead the conversation with the user. You will ask questions to get to know the user better.
-        Ask your questions in a natural way as the conversation progresses. Ask questions that are relevant to gain accurate MBTI type and OCEAN analysis traits of the user.
-        Ask questions that are relevant to the user's message.
-        
-        Keep your language simple, natural, and conversational. Keep it at a 5th grade level.
-        
-        DO NOT MENTION MBTI OR OCEAN analysis in your response.
-        
-        Personality OCEAN Traits of the {user_id} are: {ocean_traits}
-        Personality MBTI Type of the {user_id} is: {mbti_type}
-        
-        Your conversational style should be: {style_prompt}
-        
-        Use similar language as the user, here are some examples: {slang_result}
-
-        Conversation History: {history}
+@router.post("/convo-lead")
+async def convo_lead(user_input: UserInput, user=Depends(verify_token)):
     """
-    
-    logging.info(f"Convo Lead Instructions: {instructions}")
-    
-    # Initialize the planner agent
-    planner_agent = PlannerService().agent
-    
-    # Generate AI response using system prompt
-    convo_lead_agent = Agent(
-        name="Astra AI",
-        handoff_description="A conversational agent that leads the conversation with the user to get to know them better.",
-        instructions=instructions,
-        model="gpt-4o-mini",
-        tools=[
-            get_users_name, update_user_name, 
-            retrieve_personalized_info_about_user,
-            planner_agent.as_tool(
-                tool_name="create_plan",
-                tool_description="A tool that creates a plan for the user to follow."
-            )
-        ]
-    )
+    Leads the conversation with the user. Asking questions to get to know the user better.  
+    """
+    context, hold = await prepare_convo_lead(user["id"], user_input.message)
+    ledger = start_usage_ledger(credit_limit=hold.amount)
     
     try:
-        # Count the tokens in the user's message
-        input_tokens = count_tokens(user_input.message)
-                
-        response = await Runner.run(convo_lead_agent, user_input.message)
+        response = await Runner.run(convo_lead_agent, user_input.message, context=context)
+        prompt_cache_stats.record("convo_lead", response.context_wrapper.usage)
     
         logging.info(f"Convo Lead Response: {response}")
-            
-        # Append the agent's response back to the conversation history
-        append_message_to_history(user_id, convo_lead_agent.name, response.final_output)
-        
-        if len(history) >= 10:
-            await replace_conversation_history_with_summary(user_id)
-            
-        # Count the tokens in the agent's response
-        output_tokens = count_tokens(response.final_output)
-
-        # Calculate the cost of the tokens
-        provider_cost = calculate_provider_cost(user_input.message, convo_lead_agent.model)
-        credits_cost = calculate_credits_to_deduct(provider_cost)
-        
-        costs = f"""
-        Input Tokens: {input_tokens}
-        Output Tokens: {output_tokens}
-        Total Tokens: {input_tokens + output_tokens}\n
-        Provider Cost: {provider_cost}
-        Credits Cost: {credits_cost}
-        """
-        logging.info(f"Costs: {costs}")
-        
-        # Deduct the credits from the user's balance
-        profile_repo.deduct_credits(user_id, credits_cost)
+
+        await finish_convo_lead(user["id"], convo_lead_agent, response.final_output, ledger, hold)
                     
         return response.final_output
             
     except Exception as e:
         logging.error(f"Error processing convo lead: {e}")
+        await asyncio.to_thread(settle_unfinished_convo_lead, ledger, hold)
         raise HTTPException(status_code=500, detail="Internal Server Error")
-    
 
 
+@router.post("/convo-lead/stream")
+async def convo_lead_stream(user_input: UserInput, user=Depends(verify_token)):
+    """
+    Streaming variant of /convo-lead: the response is sent as Server-Sent Events
+    ("delta" events with text as it is generated, then "done"). The reply is
+    added to the history and credits are deducted once the stream completes;
+    if it does not, the usage so far is charged and the rest of the hold released.
+    A hold is settled once, so an abort racing the capture charges nothing twice.
+    """
+    started_at = time.perf_counter()
+    user_id = user["id"]
+    context, hold = await prepare_convo_lead(user_id, user_input.message)
+    # Started here so that the streamed run's task inherits it
+    ledger = start_usage_ledger(credit_limit=hold.amount)
+
+    async def on_complete(final_output):
+        logging.info(f"Convo Lead Response: {final_output}")
+        await finish_convo_lead(user_id, convo_lead_agent, final_output, ledger, hold)
+
+    return sse_response(stream_agent(
+        "convo_lead", convo_lead_agent, user_input.message, started_at, on_complete,
+        context=context,
+        # on_abort is synchronous; the capture's database write runs off the event loop
+        on_abort=lambda: asyncio.get_running_loop().run_in_executor(None, settle_unfinished_convo_lead, ledger, hold),
+    ))
+
+
+async def prepare_convo_lead(user_id: str, message: str) -> Tuple[ConvoLeadContext, CreditHold]:
+    """
+    Loads the user's inputs, holds the run's estimated cost and appends their
+    message to the history. Returns the run context of the conversation agent
+    and the credit hold, to be captured or released when the run ends.
+    """
+    # Load name, credits and personality traits (one cached lookup), similar slang
+    # and the conversation history concurrently. Slang and history fall back to
+    # empty values; the persona is required for the credit check.
+    try:
+        inputs = await convo_lead_prefetch.run(
+            persona=(lambda: asyncio.to_thread(persona_repo.get_bundle, user_id), REQUIRED),
+            slang=(lambda: SlangExtractionService(user_id).retrieve_similar_slang(message), {"message": "No similar slang found."}),
+            history=(lambda: conversation_store.get_history(user_id), []),
+        )
+    except Exception as e:
+        logging.error(f"Error loading convo lead inputs: {e}")
+        raise HTTPException(status_code=503, detail="Service Unavailable")
+    persona = inputs["persona"]
+    slang_result = inputs["slang"]
+    history = inputs["history"]
     
+    # Get the users name
+    user_name = persona.name
+
+    context = ConvoLeadContext(
+        user_id=user_id,
+        user_name=user_name,
+        mbti_type=persona.mbti_type,
+        style_prompt=persona.style_prompt,
+        ocean_traits=persona.ocean_traits,
+        slang=slang_result,
+        history=history,
+    )
+
+    # Hold an estimate of the run's cost, so concurrent requests cannot
+    # overdraw the balance; the actual usage, up to the hold, is captured afterwards
+    instructions = convo_lead_instructions(RunContextWrapper(context), convo_lead_agent)
+    estimated_credits = calculate_credits_to_deduct(
+        CONVO_LEAD_HOLD_CALLS * estimate_provider_cost(instructions + message, convo_lead_agent.model)
+    )
+    hold = profile_repo.hold_credits(user_id, estimated_credits, persona.credits)
+    if hold is None:
+        raise HTTPException(status_code=402, detail="Insufficient credits")
+
+    try:
+        # Append the new user message to the conversation history. The history
+        # above was read before it, so the prompt does not repeat the agent's input.
+        if not await conversation_store.add_message(user_id, USER_ROLE, message, speaker=user_name):
+            raise HTTPException(status_code=503, detail="Service Unavailable")
 
+        logging.info(f"Convo Lead Context: {context}")
+    except BaseException:
+        # Cancellation included: the caller only settles holds it receives
+        profile_repo.release_credits(hold)
+        raise
+    return context, hold
+
+
+async def finish_convo_lead(user_id: str, agent: Agent, final_output: str, ledger: UsageLedger, hold: CreditHold):
+    """
+    Appends the agent's reply to the history, queues a summary when due and
+    captures the credits for the usage recorded in the request's ledger
+    against the request's hold.
+    """
+    # Append the agent's response back to the conversation history
+    if not await conversation_store.add_message(user_id, ASSISTANT_ROLE, final_output, speaker=agent.name):
+        logging.error(f"Reply for user {user_id} was not added to the history: too many messages waiting to be persisted")
+    
+    if await conversation_store.should_summarize(user_id):
+        conversation_store.request_summary(user_id)
 
-        
-        
+    # The provider-reported usage of every model call in the run, sub-agents included
+    costs = ledger.summary()
+    logging.info(f"Costs: {costs}")
+    
+    # Charge the actual credits and release the rest of the hold. Shielded, so
+    # a client disconnect cannot interrupt a deduction the database may apply
+    if not await asyncio.shield(asyncio.to_thread(profile_repo.capture_credits, hold, costs["credits"])):
+        logging.error(f"{costs['credits']} credits for a convo lead run of user {user_id} were not charged")
 
-        
 
+def settle_unfinished_convo_lead(ledger: UsageLedger, hold: CreditHold):
+    """
+    Settles the hold of a run that failed or was aborted: the model calls it
+    has already made are charged, and the hold is released only if it made none.
+    Does nothing if the hold was already settled.
+    """
+    credits = ledger.credits()
+    if credits > 0:
+        logging.info(f"Charging {credits} credits for an unfinished convo lead run of user {hold.user_id}")
+        if not profile_repo.capture_credits(hold, credits):
+            logging.error(f"{credits} credits for an unfinished convo lead run of user {hold.user_id} were not charged")
+    else:
+        profile_repo.release_credits(hold)
@@ -27,7 +27,7 @@ async def slang_extract(data: SlangRequest, user=Depends(verify_token)):
     return slang_result
 
 @router.post("/retrieve-slang")
-def retrieve_slang(query: SlangRequest, user=Depends(verify_token)):
+async def retrieve_slang(query: SlangRequest, user=Depends(verify_token)):
     """
     Retrieves stored slang relevant to the user's message.
     """
@@ -37,7 +37,7 @@ def retrieve_slang(query: SlangRequest, user=Depends(verify_token)):
     slang_service = SlangExtractionService(user_id)
     
     # Find similar stored slang
-    similar_slang = slang_service.retrieve_similar_slang(query.message, top_k=5)
+    similar_slang = await slang_service.retrieve_similar_slang(query.message, top_k=5)
     
     return { "similar_slang": similar_slang }
 
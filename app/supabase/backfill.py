@@ -0,0 +1,310 @@
+# backfill.py
+# Resumable bulk (re-)embedding of stored knowledge and slang.
+# Use it to move every vector to a new embedding model, or with --missing-only
+# to repair rows whose embedding could not be generated when they were stored.
+#
+# Rows are read in id order with keyset pagination, embedded in batches by a
+# bounded number of concurrent requests (with exponential backoff on rate limits
+# and transient errors) and written back in bulk through the
+# bulk_update_embeddings RPC (migrations/004). Progress is checkpointed to a
+# local JSON file after every written page, so an interrupted run resumes where
+# it stopped.
+#
+# Run from the repository root:
+#     python -m app.supabase.backfill [--table knowledge|slang] [--model MODEL] [--missing-only]
+# Against in-memory stand-ins for Supabase and the embeddings API (no credentials needed):
+#     python -m app.supabase.backfill --stand-in 20000
+
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import logging
+from typing import Dict, List, Optional
+import httpx
+import numpy as np
+import openai
+
+logging.basicConfig(level=logging.INFO)
+
+BACKFILL_CHECKPOINT_PATH = os.getenv("BACKFILL_CHECKPOINT_PATH", ".cache/backfill_checkpoint.json")
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "256"))
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "4"))
+BACKFILL_MAX_RETRIES = int(os.getenv("BACKFILL_MAX_RETRIES", "6"))
+BACKFILL_RETRY_DELAY = float(os.getenv("BACKFILL_RETRY_DELAY", "1.0"))
+
+TABLES = {
+    "knowledge": ("user_knowledge", "knowledge_text"),
+    "slang": ("user_slang", "slang_text"),
+}
+
+# Errors worth retrying: rate limits, timeouts, dropped connections and 5xx responses
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class SupabaseTable:
+    """
+    Reads and writes the id, text and embedding columns of a Supabase table.
+    """
+    def __init__(self, table_name: str, text_column: str):
+        from app.supabase.pgvector import supabase
+        self.supabase = supabase
+        self.table_name = table_name
+        self.text_column = text_column
+
+    def page(self, after_id, limit: int, missing_only: bool) -> List[dict]:
+        query = self.supabase.table(self.table_name).select(f"id, {self.text_column}").order("id").limit(limit)
+        if after_id is not None:
+            query = query.gt("id", after_id)
+        if missing_only:
+            query = query.is_("embedding", "null")
+        return query.execute().data or []
+
+    def write(self, rows: List[dict]) -> int:
+        """
+        Writes {"id", "embedding"} rows with one RPC call, falling back to
+        row-by-row updates if the RPC is not installed.
+        """
+        try:
+            response = self.supabase.rpc("bulk_update_embeddings", {"p_table": self.table_name, "p_rows": rows}).execute()
+            return response.data or 0
+        except Exception as e:
+            logging.warning(f"bulk_update_embeddings failed for {self.table_name}, updating row by row: {e}")
+        for row in rows:
+            self.supabase.table(self.table_name).update(
+                {"embedding": row["embedding"]}, returning="minimal"
+            ).eq("id", row["id"]).execute()
+        return len(rows)
+
+
+class StandInTable:
+    """
+    In-memory table with the same interface as SupabaseTable, for dry runs and
+    throughput measurements without a database.
+    """
+    def __init__(self, table_name: str, text_column: str, rows: int):
+        self.table_name = table_name
+        self.text_column = text_column
+        self.rows = {i: {"id": i, text_column: f"{table_name} entry {i}", "embedding": None} for i in range(1, rows + 1)}
+
+    def page(self, after_id, limit: int, missing_only: bool) -> List[dict]:
+        page = []
+        for row_id in range((after_id or 0) + 1, len(self.rows) + 1):
+            row = self.rows[row_id]
+            if missing_only and row["embedding"] is not None:
+                continue
+            page.append({"id": row_id, self.text_column: row[self.text_column]})
+            if len(page) == limit:
+                break
+        return page
+
+    def write(self, rows: List[dict]) -> int:
+        for row in rows:
+            self.rows[row["id"]]["embedding"] = row["embedding"]
+        return len(rows)
+
+
+class OpenAIEmbedder:
+    """
+    Embeds batches with the OpenAI embeddings API and stores the results in the
+    embedding cache, so the vector indexes can re-rank with them right away.
+    """
+    def __init__(self, model: str):
+        from app.utils.openai_client import get_openai_client
+        self.model = model
+        self.client = get_openai_client().with_options(max_retries=0)  # Retries are handled by embed_with_backoff
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        from app.utils.embedding_cache import embedding_cache
+        response = await self.client.embeddings.create(model=self.model, input=texts)
+        embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        await asyncio.to_thread(embedding_cache.set_many, self.model, dict(zip(texts, embeddings)))
+        return embeddings
+
+
+class StandInEmbedder:
+    """
+    Deterministic fake embeddings with simulated request latency and rate limiting.
+    """
+    def __init__(self, dimensions: int = 1536, latency: float = 0.05, rate_limit_rate: float = 0.05):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency)
+        if random.random() < self.rate_limit_rate:
+            request = httpx.Request("POST", "http://stand-in/v1/embeddings")
+            raise openai.RateLimitError("Rate limit reached (stand-in)", response=httpx.Response(429, request=request), body=None)
+        embeddings = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+            embeddings.append((vector / np.linalg.norm(vector)).tolist())
+        return embeddings
+
+
+async def embed_with_backoff(embedder, texts: List[str], semaphore: asyncio.Semaphore,
+                             max_retries: int = BACKFILL_MAX_RETRIES, retry_delay: float = BACKFILL_RETRY_DELAY) -> List[List[float]]:
+    """
+    Embeds one batch under the concurrency limit, retrying retryable errors with
+    exponential backoff and jitter. The semaphore is released while backing off.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            async with semaphore:
+                return await embedder.embed(texts)
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = retry_delay * 2 ** attempt * (0.5 + random.random())
+            logging.warning(f"Embedding batch of {len(texts)} failed ({type(e).__name__}); retrying in {delay:.1f}s.")
+            await asyncio.sleep(delay)
+
+
+class Checkpoint:
+    """
+    Per-table progress ({"last_id", "rows", "model", "missing_only"}) persisted as JSON.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.state: Dict[str, dict] = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def resume(self, table_name: str, model: str, missing_only: bool) -> dict:
+        state = self.state.get(table_name)
+        if state and (state.get("model"), state.get("missing_only")) == (model, missing_only):
+            return state
+        if state:
+            logging.warning(f"Ignoring {table_name} checkpoint from a run with different options.")
+        self.state[table_name] = {"last_id": None, "rows": 0, "model": model, "missing_only": missing_only, "done": False}
+        return self.state[table_name]
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(temporary, self.path)
+
+
+async def backfill_table(table, embedder, checkpoint: Checkpoint, model: str, missing_only: bool = False,
+                         batch_size: int = BACKFILL_BATCH_SIZE, concurrency: int = BACKFILL_CONCURRENCY) -> tuple:
+    """
+    Re-embeds one table from its checkpoint onwards.
+    Each page holds `concurrency` batches, embedded concurrently; the bulk write
+    of one page overlaps with embedding the next.
+    Returns (rows written, seconds).
+    """
+    state = checkpoint.resume(table.table_name, model, missing_only)
+    if state.get("done"):
+        logging.info(f"{table.table_name} already backfilled; use --reset to start over.")
+        return 0, 0.0
+
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+    written = 0
+    pending_write: Optional[tuple] = None  # (task, last id of the page being written)
+
+    async def finish_write():
+        nonlocal written
+        task, last_id = pending_write
+        count = await task
+        written += count
+        state["last_id"] = last_id
+        state["rows"] += count
+        checkpoint.save()
+        elapsed = time.perf_counter() - started
+        logging.info(f"{table.table_name}: {state['rows']} rows re-embedded ({written / elapsed:.0f} rows/s)")
+
+    after_id = state["last_id"]
+    while True:
+        page = await asyncio.to_thread(table.page, after_id, batch_size * concurrency, missing_only)
+        if not page:
+            break
+        after_id = page[-1]["id"]
+        rows = [row for row in page if row.get(table.text_column)]
+        batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+        results = await asyncio.gather(*(
+            embed_with_backoff(embedder, [row[table.text_column] for row in batch], semaphore) for batch in batches
+        ))
+        updates = [
+            {"id": row["id"], "embedding": embedding}
+            for batch, embeddings in zip(batches, results)
+            for row, embedding in zip(batch, embeddings)
+        ]
+        if pending_write is not None:
+            await finish_write()
+        pending_write = (asyncio.create_task(asyncio.to_thread(table.write, updates)), after_id)
+
+    if pending_write is not None:
+        await finish_write()
+    state["done"] = True
+    checkpoint.save()
+    return written, time.perf_counter() - started
+
+
+async def backfill(tables: List, embedder, checkpoint: Checkpoint, model: str, missing_only: bool = False,
+                   batch_size: int = BACKFILL_BATCH_SIZE, concurrency: int = BACKFILL_CONCURRENCY) -> Dict[str, tuple]:
+    report = {}
+    for table in tables:
+        report[table.table_name] = await backfill_table(table, embedder, checkpoint, model, missing_only, batch_size, concurrency)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed stored knowledge and slang.")
+    parser.add_argument("--table", choices=sorted(TABLES), action="append", help="Table to backfill (default: all)")
+    parser.add_argument("--model", help="Embedding model (default: EMBEDDING_MODEL)")
+    parser.add_argument("--missing-only", action="store_true", help="Only embed rows without an embedding")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=BACKFILL_CONCURRENCY)
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT_PATH)
+    parser.add_argument("--reset", action="store_true", help="Ignore the checkpoint and start over")
+    parser.add_argument("--stand-in", type=int, metavar="ROWS", help="Use in-memory stand-ins with ROWS rows per table")
+    parser.add_argument("--stand-in-latency", type=float, default=0.05, help="Stand-in seconds per embeddings request")
+    parser.add_argument("--stand-in-rate-limit", type=float, default=0.05, help="Stand-in share of rate-limited requests")
+    args = parser.parse_args()
+
+    names = args.table or sorted(TABLES)
+    if args.stand_in:
+        model = args.model or "stand-in"
+        tables = [StandInTable(*TABLES[name], rows=args.stand_in) for name in names]
+        embedder = StandInEmbedder(latency=args.stand_in_latency, rate_limit_rate=args.stand_in_rate_limit)
+        checkpoint_path = f"{args.checkpoint}.stand-in" if args.checkpoint else None
+    else:
+        from app.supabase.pgvector import EMBEDDING_MODEL
+        model = args.model or EMBEDDING_MODEL
+        tables = [SupabaseTable(*TABLES[name]) for name in names]
+        embedder = OpenAIEmbedder(model)
+        checkpoint_path = args.checkpoint
+
+    if args.reset and checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = Checkpoint(checkpoint_path)
+
+    report = asyncio.run(backfill(tables, embedder, checkpoint, model, args.missing_only, args.batch_size, args.concurrency))
+    total_rows = sum(rows for rows, _ in report.values())
+    total_seconds = sum(seconds for _, seconds in report.values())
+    for table_name, (rows, seconds) in report.items():
+        rate = rows / seconds if seconds else 0
+        print(f"{table_name}: {rows} rows in {seconds:.1f}s ({rate:.0f} rows/s)")
+    print(f"total: {total_rows} rows in {total_seconds:.1f}s ({total_rows / total_seconds if total_seconds else 0:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# compaction.py
+# Offline compaction of near-duplicate knowledge and slang entries.
+# Each user's rows are clustered by the cosine similarity of their stored
+# embeddings, keeping only clusters whose members are all near-duplicates of
+# each other. Every cluster is merged into its most mentioned row, whose
+# mention_count becomes the sum of the cluster's, and the other rows are
+# deleted, in one transaction (merge_duplicate_rows, migrations/007).
+#
+# Run from the repository root:
+#     python -m app.supabase.compaction [--table knowledge|slang] [--user USER_ID] [--threshold 0.95] [--dry-run]
+#
+# Running servers pick up the removed rows when their vector indexes reload
+# (VECTOR_INDEX_TTL_SECONDS).
+
+import argparse
+import logging
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+from app.supabase.pgvector import DUPLICATE_SIMILARITY_THRESHOLD, supabase
+from app.supabase.vector_index import duplicate_clusters, to_unit_vector
+
+logging.basicConfig(level=logging.INFO)
+
+TABLES = {
+    "knowledge": ("user_knowledge", "knowledge_text"),
+    "slang": ("user_slang", "slang_text"),
+}
+PAGE_SIZE = 1000
+
+
+def iter_user_ids() -> Iterator[str]:
+    """
+    Yields every profile ID, paging by keyset.
+    """
+    last_id = None
+    while True:
+        query = supabase.table("profiles").select("id").order("id").limit(PAGE_SIZE)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = query.execute().data or []
+        for row in rows:
+            yield row["id"]
+        if len(rows) < PAGE_SIZE:
+            return
+        last_id = rows[-1]["id"]
+
+
+def load_rows(table_name: str, text_column: str, user_id: str) -> List[dict]:
+    """
+    Loads a user's rows with their embeddings, paging by keyset.
+    """
+    rows, last_id = [], None
+    while True:
+        query = supabase.table(table_name)\
+            .select(f"id, {text_column}, mention_count, embedding")\
+            .eq("user_id", user_id).order("id").limit(PAGE_SIZE)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        page = query.execute().data or []
+        rows += page
+        if len(page) < PAGE_SIZE:
+            return [row for row in rows if row.get("embedding") is not None]
+        last_id = page[-1]["id"]
+
+
+def compact_user(table_name: str, text_column: str, user_id: str, threshold: float, dry_run: bool = False) -> int:
+    """
+    Merges the near-duplicate rows of one user. Returns the number of rows removed
+    (or that would be removed, with dry_run).
+    """
+    rows = load_rows(table_name, text_column, user_id)
+    if len(rows) < 2:
+        return 0
+    vectors = np.stack([to_unit_vector(row["embedding"]) for row in rows])
+    # The most mentioned rows become the clusters' representatives, and are kept
+    order = sorted(range(len(rows)), key=lambda i: -(rows[i]["mention_count"] or 0))
+
+    removed = 0
+    for cluster in duplicate_clusters(vectors, threshold, order):
+        keep, duplicates = rows[cluster[0]], [rows[i] for i in cluster[1:]]
+        mention_count = sum(row["mention_count"] or 0 for row in [keep] + duplicates)
+        logging.info(
+            f"{table_name} user {user_id}: merging {len(duplicates)} entries into {keep[text_column]!r} "
+            f"(mention_count {mention_count})"
+        )
+        if dry_run:
+            removed += len(duplicates)
+            continue
+        response = supabase.rpc("merge_duplicate_rows", {
+            "p_table": table_name,
+            "p_keep": {"id": keep["id"]},
+            "p_duplicates": [{"id": row["id"]} for row in duplicates],
+        }).execute()
+        removed += response.data or 0
+    return removed
+
+
+def compact(tables: List[str], user_ids: Optional[List[str]] = None, threshold: float = DUPLICATE_SIMILARITY_THRESHOLD,
+            dry_run: bool = False) -> Dict[str, Dict[str, int]]:
+    """
+    Compacts the given tables for the given users (default: every user).
+    Returns {table name: {user ID: rows removed}} for users with removals.
+    """
+    report: Dict[str, Dict[str, int]] = {TABLES[table][0]: {} for table in tables}
+    for user_id in user_ids or iter_user_ids():
+        for table in tables:
+            table_name, text_column = TABLES[table]
+            try:
+                removed = compact_user(table_name, text_column, user_id, threshold, dry_run)
+            except Exception as e:
+                logging.error(f"Error compacting {table_name} for user {user_id}: {e}")
+                continue
+            if removed:
+                report[table_name][user_id] = removed
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge near-duplicate knowledge and slang entries.")
+    parser.add_argument("--table", choices=sorted(TABLES), action="append", help="Table to compact (default: all)")
+    parser.add_argument("--user", action="append", help="User ID to compact (default: every user)")
+    parser.add_argument("--threshold", type=float, default=DUPLICATE_SIMILARITY_THRESHOLD)
+    parser.add_argument("--dry-run", action="store_true", help="Report merges without writing")
+    args = parser.parse_args()
+
+    report = compact(args.table or sorted(TABLES), args.user, args.threshold, args.dry_run)
+    verb = "would remove" if args.dry_run else "removed"
+    for table_name, users in report.items():
+        for user_id, removed in sorted(users.items(), key=lambda item: -item[1]):
+            print(f"{table_name}\t{user_id}\t{verb} {removed}")
+        print(f"{table_name}: {verb} {sum(users.values())} rows across {len(users)} users")
+
+
+if __name__ == "__main__":
+    main()
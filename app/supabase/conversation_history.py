@@ -3,13 +3,14 @@ import asyncio
 import os
 import json
 import logging
-from app.personal_agents.knowledge_extraction import KnowledgeExtractionService
-from app.personal_agents.slang_extraction import SlangExtractionService
-from app.psychology.mbti_analysis import MBTIAnalysisService
-from app.psychology.ocean_analysis import OceanAnalysisService
+from typing import List, Optional
+from app.personal_agents.message_analysis import submit_analysis
+from app.supabase.persona_cache import invalidate_persona
+from app.utils.token_count import truncate_to_tokens
 from supabase import create_client, Client
 from dotenv import load_dotenv
 from agents import Agent, Runner
+from app.personal_agents.agent_registry import register_agent
 
 
 # Load environment variables
@@ -24,124 +25,181 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 logging.basicConfig(level=logging.INFO)
 
-def get_or_create_conversation_history(user_id: str) -> list:
+TABLE_NAME = "conversation_messages"
+# Message roles. The display name of whoever spoke is stored separately, as the speaker.
+USER_ROLE = "user"
+ASSISTANT_ROLE = "assistant"
+SUMMARY_ROLE = "Summary"
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", "200"))
+SUMMARY_MAX_MESSAGE_TOKENS = int(os.getenv("SUMMARY_MAX_MESSAGE_TOKENS", "1000"))
+
+summarization_instructions = (
+    "You are an AI that maintains a running summary of a conversation. "
+    "You are given the existing summary (if any) and the new turns since it was written. "
+    "Return an updated, concise summary that keeps the key points of both. "
+    f"Keep it brief and to the point, under {SUMMARY_MAX_WORDS} words."
+)
+
+summarization_agent = register_agent(Agent(
+    name="Summarizer",
+    handoff_description="An agent that summarizes conversation context.",
+    instructions=summarization_instructions,
+    model="gpt-4o-mini",
+))
+
+
+def format_message(row: dict) -> str:
     """
-    Retrieves the conversation history for the given user_id.
-    
-    Returns a list of messages (each message is a string).
-    If no record exists, creates a new record with an empty history and returns an empty list.
+    Formats a stored message row as a "speaker: content" history entry,
+    falling back to the role for messages without a speaker.
+    """
+    return f"{row.get('speaker') or row['role']}: {row['content']}"
+
+def get_conversation_messages(user_id: str) -> List[dict]:
+    """
+    Retrieves the message rows for the given user_id from the latest summary onwards,
+    oldest first. Each row has "ordinal", "role", "speaker" and "content".
     """
     try:
-        response = supabase.table("conversation_history").select("history").eq("user_id", user_id).execute()
-        data = response.data
-        
-        if data and len(data) > 0:
-            logging.info(f"Retrieved history for user {user_id}: {data[0]['history']}")
-            return data[0]["history"]
-        else:
-            logging.info(f"No conversation history found for user {user_id}. Creating new record.")
-            # Insert a new record with an empty history for the user
-            insert_response = supabase.table("conversation_history").insert({
-                "user_id": user_id,
-                "history": []
-            }).execute()
-            logging.info(f"New conversation history record created for user {user_id}.")
-            return []
+        response = supabase.rpc("get_conversation_since_summary", {"p_user_id": user_id}).execute()
+        return response.data or []
     except Exception as e:
-        logging.error(f"Error retrieving conversation history for user {user_id}: {e}")
+        logging.error(f"Error retrieving conversation messages for user {user_id}: {e}")
         return []
 
-def update_conversation_history(user_id: str, history: list):
+def get_recent_messages(user_id: str, limit: int) -> List[str]:
     """
-    Updates the conversation history for the given user_id.
+    Retrieves the last `limit` messages for the given user_id, oldest first.
     """
     try:
-        response = supabase.table("conversation_history").update({"history": history}).eq("user_id", user_id).execute()
-        logging.info(f"Updated conversation history for user {user_id}.")
+        response = supabase.table(TABLE_NAME).select("ordinal, role, speaker, content")\
+            .eq("user_id", user_id)\
+            .order("ordinal", desc=True)\
+            .limit(limit).execute()
+        return [format_message(row) for row in reversed(response.data or [])]
     except Exception as e:
-        logging.error(f"Error updating conversation history for user {user_id}: {e}")
+        logging.error(f"Error retrieving recent messages for user {user_id}: {e}")
+        return []
 
-def append_message_to_history(user_id: str, role: str, message: str) -> list:
+def get_or_create_conversation_history(user_id: str) -> list:
     """
-    Appends a new message to the conversation history and updates the record.
-    Returns the updated history.
+    Retrieves the conversation history for the given user_id.
+    
+    Returns a list of messages (each message is a string), starting with the latest summary if there is one.
+    Returns an empty list if the user has no history yet.
     """
-    # Retrieve the current history.
-    history = get_or_create_conversation_history(user_id)
-    new_message = f"{role}: {message}"
-    history.append(new_message)
-    update_conversation_history(user_id, history)
+    history = [format_message(row) for row in get_conversation_messages(user_id)]
+    logging.info(f"Retrieved {len(history)} history messages for user {user_id}.")
     return history
 
+def append_message_to_history(user_id: str, role: str, message: str, speaker: Optional[str] = None) -> Optional[dict]:
+    """
+    Appends a new message to the conversation history with a single insert.
+    Returns the stored row (including its ordinal), or None if the insert failed.
+    """
+    try:
+        response = supabase.table(TABLE_NAME).insert({
+            "user_id": user_id,
+            "role": role,
+            "speaker": speaker,
+            "content": message
+        }).execute()
+        return response.data[0] if response.data else None
+    except Exception as e:
+        logging.error(f"Error appending message to history for user {user_id}: {e}")
+        return None
+
+def append_messages_to_history(rows: List[dict]) -> Optional[List[dict]]:
+    """
+    Appends a batch of messages (each a dict with "user_id", "role", "speaker" and "content") with a single insert.
+    Returns the stored rows in insertion order, or None if the insert failed.
+    """
+    try:
+        response = supabase.table(TABLE_NAME).insert(rows).execute()
+        return response.data
+    except Exception as e:
+        logging.error(f"Error appending {len(rows)} messages to history: {e}")
+        return None
+
 def clear_conversation_history(user_id: str):
     """
     Clears the conversation history for the given user_id.
     """
     try:
-        response = supabase.table("conversation_history").update({"history": []}).eq("user_id", user_id).execute()
+        response = supabase.table(TABLE_NAME).delete().eq("user_id", user_id).execute()
+        invalidate_persona(user_id)
         logging.info(f"Cleared conversation history for user {user_id}.")
     except Exception as e:
         logging.error(f"Error clearing conversation history for user {user_id}: {e}")
 
+def replace_history_range_with_summary(user_id: str, upto_ordinal: int, summary: str) -> bool:
+    """
+    Atomically replaces every message up to and including upto_ordinal with a single summary message.
+    Messages appended after upto_ordinal are kept.
+    """
+    try:
+        supabase.rpc("replace_conversation_range_with_summary", {
+            "p_user_id": user_id,
+            "p_upto_ordinal": upto_ordinal,
+            "p_summary": summary
+        }).execute()
+        invalidate_persona(user_id)
+        return True
+    except Exception as e:
+        logging.error(f"Error replacing history range for user {user_id}: {e}")
+        return False
+
 async def replace_conversation_history_with_summary(user_id: str):
     """
-    Extracts knowledge from the conversation history, runs MBTI and OCEAN analyses
-    Replaces the conversation history with a summary.
+    Folds the turns since the latest summary into it, then queues the extraction of knowledge and slang
+    from those turns and the MBTI and OCEAN analyses of them. Only the new turns are re-read, so the summarizer's
+    input stays roughly constant as the conversation grows.
     The summary is stored as a single message in the history.
+    Returns a (summarized up to ordinal, summary) tuple, or None if there was nothing to summarize.
+    Raises if summarization fails so that the caller can retry; the analyses are queued once the
+    summary is stored, so a retry never repeats them.
     """
     try:
-        history = get_or_create_conversation_history(user_id)
-        history_string = "\n".join(history)
-        
-        # Extract knowledge from the history.
-        extraction = KnowledgeExtractionService(user_id)
-        extract_task = asyncio.create_task(extraction.extract_knowledge(history_string))
-        await extract_task
-
-        # Run MBTI analysis
-        mbti_service = MBTIAnalysisService(user_id)
-        mbti_task = asyncio.create_task(mbti_service.analyze_message(history_string))
-        await mbti_task
-
-        # Run OCEAN analysis
-        ocean_service = OceanAnalysisService(user_id)
-        ocean_task = asyncio.create_task(ocean_service.analyze_message(history_string))
-        await ocean_task
-        
-        # Run SLANG analysis
-        slang_service = SlangExtractionService(user_id)
-        slang_task = asyncio.create_task(slang_service.extract_slang(history_string))
-        await slang_task
-    
-        # Define instructions for the summarization agent.
-        instructions = (
-            "You are an AI that summarizes a conversation. "
-            "Read the conversation below and provide a concise summary that captures the key points. "
-            "Keep it brief and to the point."
+        messages = await asyncio.to_thread(get_conversation_messages, user_id)
+        previous_summary = None
+        if messages and messages[0]["role"] == SUMMARY_ROLE:
+            previous_summary = messages[0]["content"]
+        new_turns = [row for row in messages if row["role"] != SUMMARY_ROLE]
+        if not new_turns:
+            return None
+
+        # Cap each turn so that one very long message cannot blow the prompt budget.
+        new_turns_string = "\n".join(
+            truncate_to_tokens(format_message(row), SUMMARY_MAX_MESSAGE_TOKENS) for row in new_turns
         )
 
-        # Create the summarization agent.
-        summarization_agent = Agent(
-            name="Summarizer",
-            handoff_description="An agent that summarizes conversation context.",
-            instructions=instructions,
-            model="gpt-4o-mini",
+        # Construct the prompt with the existing summary and the new turns only.
+        prompt = (
+            f"Existing summary:\n{previous_summary or '(none)'}\n\n"
+            f"New turns:\n{new_turns_string}\n\n"
         )
-
-        # Construct the prompt with the conversation history.
-        prompt = f"Conversation:\n{history}\n\n"
         
         # Run the agent.
         summary_result = await Runner.run(summarization_agent, prompt)
         summary = summary_result.final_output.strip()
         
-        # wrap summary in a list.
-        summary = [f"Summary: {summary}"]
-
-        # Clear the existing conversation and store only the summary.
-        update_conversation_history(user_id, summary)
+        # Replace the summarized messages with the summary. Messages appended
+        # while the summary was generated are left in place.
+        upto_ordinal = messages[-1]["ordinal"]
+        if not await asyncio.to_thread(replace_history_range_with_summary, user_id, upto_ordinal, summary):
+            raise RuntimeError("Failed to store the conversation summary.")
 
         logging.info(f"Replaced conversation history with summary for user {user_id}.")
-        return summary
     except Exception as e:
         logging.error(f"Error replacing conversation history for user {user_id}: {e}")
+        raise
+
+    # Queue the MBTI, OCEAN, knowledge and slang analyses of the summarized
+    # turns. They are queued only once the turns have been replaced: a retried
+    # summarization must not update the rolling averages or store knowledge and
+    # slang for the same turns twice. The analysis queue runs them after the
+    # user's per-message analyses, never concurrently with them.
+    # One combined call: on a batch of turns it needs far fewer input tokens than four separate ones
+    if not submit_analysis(user_id, new_turns_string, mode="combined"):
+        logging.error(f"Could not queue the analysis of summarized turns for user {user_id}: the analysis queue is full.")
+    return upto_ordinal, summary
@@ -0,0 +1,191 @@
+# credit_holds.py
+# In-process credit balances and holds (reservations) per user, used by
+# ProfileRepository.hold_credits / capture_credits / release_credits.
+# A request holds its estimated cost before doing billable work, so concurrent
+# requests from one user cannot all pass the balance check and overdraw. On
+# completion the actual cost is captured and the rest of the hold released.
+# Captures are deducted atomically in the database (migrations/005) and the
+# cached balance is only updated from the database's result.
+# Holds expire, so a request that never settles (a crash, a dropped stream)
+# does not lock up the user's credits. Each hold is settled (captured or
+# released) at most once: a second settlement, e.g. an abort handler racing a
+# capture that a client disconnect interrupted, is a no-op.
+# Kept free of repository imports, like persona_cache.py.
+
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+from app.utils.metrics import register_metrics
+
+
+CREDIT_HOLD_TTL_SECONDS = float(os.getenv("CREDIT_HOLD_TTL_SECONDS", "300"))
+# How long a cached balance is trusted before it is refreshed from the caller's
+# (persona bundle) or the database's value, while the user has no holds
+CREDIT_BALANCE_TTL_SECONDS = float(os.getenv("CREDIT_BALANCE_TTL_SECONDS", os.getenv("PERSONA_CACHE_TTL_SECONDS", "60")))
+CREDIT_BALANCE_MAX_USERS = int(os.getenv("CREDIT_BALANCE_MAX_USERS", "10000"))
+
+
+@dataclass(frozen=True)
+class CreditHold:
+    id: str
+    user_id: str
+    amount: int
+    expires_at: float
+
+
+class CreditBalances:
+    """
+    Thread-safe per-user balances and the holds against them. A user's
+    available credits are their balance minus their unexpired holds.
+    """
+    def __init__(self, hold_ttl_seconds: float, balance_ttl_seconds: float, maxsize: int):
+        self.hold_ttl_seconds = hold_ttl_seconds
+        self.balance_ttl_seconds = balance_ttl_seconds
+        self.maxsize = maxsize
+        self._balances: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+        self._holds: Dict[str, Dict[str, CreditHold]] = {}
+        # Ids of the holds being or already settled, most recent last
+        self._settled: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.expired = 0
+        self.failed_captures = 0
+
+    def hold(self, user_id: str, amount: int, load_balance: Callable[[], Optional[int]]) -> Optional[CreditHold]:
+        """
+        Holds amount credits if the user has them available. Returns the hold,
+        or None if the available balance is insufficient or unknown.
+        load_balance is called only when no fresh balance is cached.
+        """
+        with self._lock:
+            balance = self._cached_balance(user_id)
+        if balance is None:
+            loaded = load_balance()
+            if loaded is None:
+                return None
+            with self._lock:
+                balance = self._cached_balance(user_id)
+                if balance is None:
+                    balance = self._set(user_id, loaded)
+
+        with self._lock:
+            holds = self._unexpired_holds(user_id)
+            available = balance - sum(hold.amount for hold in holds.values())
+            if available < amount:
+                logging.info(f"Credit hold of {amount} refused for user {user_id}: {available} available")
+                return None
+            hold = CreditHold(uuid.uuid4().hex, user_id, amount, time.monotonic() + self.hold_ttl_seconds)
+            holds[hold.id] = hold
+            self._holds[user_id] = holds
+            return hold
+
+    def settle(self, hold: CreditHold) -> bool:
+        """
+        Claims the settlement of a hold. Returns False if it was already
+        claimed; the caller then must not charge or release it again.
+        The hold keeps counting against the balance until it is captured,
+        released or failed.
+        """
+        with self._lock:
+            if hold.id in self._settled:
+                return False
+            self._settled[hold.id] = None
+            while len(self._settled) > self.maxsize:
+                self._settled.popitem(last=False)
+            return True
+
+    def capture(self, hold: CreditHold, balance: int):
+        """
+        Ends a hold whose cost has been deducted in the database, and records
+        the balance the database returned.
+        """
+        with self._lock:
+            self._drop_hold(hold)
+            self._set(hold.user_id, balance)
+
+    def release(self, hold: CreditHold):
+        """
+        Ends the hold without charging it.
+        """
+        with self._lock:
+            self._drop_hold(hold)
+
+    def fail(self, hold: CreditHold):
+        """
+        Ends a hold whose cost could not be deducted.
+        """
+        with self._lock:
+            self._drop_hold(hold)
+            self.failed_captures += 1
+
+    def set_balance(self, user_id: str, balance: int):
+        """
+        Writes a new balance through (credit purchases, direct deductions).
+        """
+        with self._lock:
+            self._set(user_id, balance)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            active = [hold for holds in self._holds.values() for hold in holds.values() if hold.expires_at > now]
+            return {
+                "cached_balances": len(self._balances),
+                "active_holds": len(active),
+                "held_credits": sum(hold.amount for hold in active),
+                "expired_holds": self.expired,
+                "failed_captures": self.failed_captures,
+            }
+
+    # The helpers below are called with the lock held
+
+    def _cached_balance(self, user_id: str) -> Optional[int]:
+        entry = self._balances.get(user_id)
+        if entry is None:
+            return None
+        refreshed_at, balance = entry
+        # A balance with holds against it is kept until they are settled
+        if refreshed_at + self.balance_ttl_seconds < time.monotonic() and not self._unexpired_holds(user_id):
+            del self._balances[user_id]
+            return None
+        self._balances.move_to_end(user_id)
+        return balance
+
+    def _set(self, user_id: str, balance: int) -> int:
+        self._balances[user_id] = (time.monotonic(), balance)
+        self._balances.move_to_end(user_id)
+        while len(self._balances) > self.maxsize:
+            evicted, _ = self._balances.popitem(last=False)
+            self._holds.pop(evicted, None)
+        return balance
+
+    def _unexpired_holds(self, user_id: str) -> Dict[str, CreditHold]:
+        holds = self._holds.get(user_id)
+        if not holds:
+            return {}
+        now = time.monotonic()
+        for hold_id in [hold_id for hold_id, hold in holds.items() if hold.expires_at <= now]:
+            logging.warning(f"Credit hold {hold_id} of user {user_id} expired before it was settled")
+            del holds[hold_id]
+            self.expired += 1
+        if not holds:
+            del self._holds[user_id]
+        return holds
+
+    def _drop_hold(self, hold: CreditHold):
+        holds = self._holds.get(hold.user_id)
+        if holds is not None:
+            holds.pop(hold.id, None)
+            if not holds:
+                del self._holds[hold.user_id]
+
+
+# Global balances keyed by user ID.
+# Each worker process holds its own copy; the balance TTL bounds how long
+# another worker's writes can go unseen.
+credit_balances = CreditBalances(CREDIT_HOLD_TTL_SECONDS, CREDIT_BALANCE_TTL_SECONDS, CREDIT_BALANCE_MAX_USERS)
+register_metrics("credit_holds", credit_balances.metrics)
@@ -0,0 +1,35 @@
+-- Returns everything the conversation endpoints need about a user in one round trip:
+-- profile name and credits, MBTI and OCEAN scores, and the conversation history.
+-- Used by PersonaRepository in app/supabase/persona.py.
+
+create or replace function get_persona_bundle(p_user_id uuid)
+returns json
+language sql
+stable
+as $$
+    select json_build_object(
+        'profile', (
+            select json_build_object('name', p.name, 'credits', p.credits)
+            from profiles p
+            where p.id = p_user_id
+        ),
+        'mbti', (
+            select row_to_json(m)
+            from mbti_personality m
+            where m.user_id = p_user_id
+            limit 1
+        ),
+        'ocean', (
+            select row_to_json(o)
+            from ocean_personality o
+            where o.user_id = p_user_id
+            limit 1
+        ),
+        'history', (
+            select h.history
+            from conversation_history h
+            where h.user_id = p_user_id
+            limit 1
+        )
+    );
+$$;
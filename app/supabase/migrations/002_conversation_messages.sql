@@ -0,0 +1,106 @@
+-- Append-only conversation history: one row per message instead of one JSON
+-- array per user. Used by app/supabase/conversation_history.py.
+
+create table if not exists conversation_messages (
+    ordinal bigint generated always as identity primary key,
+    user_id uuid not null,
+    role text not null,
+    content text not null,
+    created_at timestamptz not null default now()
+);
+
+-- "Last N messages" reads
+create index if not exists conversation_messages_user_ordinal_idx
+    on conversation_messages (user_id, ordinal desc);
+
+-- "Since last summary" reads
+create index if not exists conversation_messages_user_summary_idx
+    on conversation_messages (user_id, ordinal desc)
+    where role = 'Summary';
+
+-- Copy existing histories over, splitting "role: content" entries.
+insert into conversation_messages (user_id, role, content)
+select h.user_id,
+       split_part(m.entry, ': ', 1),
+       substr(m.entry, length(split_part(m.entry, ': ', 1)) + 3)
+from conversation_history h,
+     jsonb_array_elements_text(h.history::jsonb) with ordinality as m(entry, position)
+where not exists (select 1 from conversation_messages c where c.user_id = h.user_id)
+order by h.user_id, m.position;
+
+
+-- Messages from the latest summary (inclusive) onwards, oldest first.
+create or replace function get_conversation_since_summary(p_user_id uuid)
+returns setof conversation_messages
+language sql
+stable
+as $$
+    select *
+    from conversation_messages m
+    where m.user_id = p_user_id
+      and m.ordinal >= coalesce((
+          select s.ordinal
+          from conversation_messages s
+          where s.user_id = p_user_id and s.role = 'Summary'
+          order by s.ordinal desc
+          limit 1
+      ), 0)
+    order by m.ordinal;
+$$;
+
+
+-- Atomically replaces every message up to and including p_upto_ordinal with a
+-- single summary row. The summary keeps p_upto_ordinal so that messages
+-- appended while the summary was being generated stay after it.
+create or replace function replace_conversation_range_with_summary(
+    p_user_id uuid,
+    p_upto_ordinal bigint,
+    p_summary text
+)
+returns void
+language plpgsql
+as $$
+begin
+    delete from conversation_messages
+    where user_id = p_user_id and ordinal < p_upto_ordinal;
+
+    update conversation_messages
+    set role = 'Summary', content = p_summary
+    where user_id = p_user_id and ordinal = p_upto_ordinal;
+end;
+$$;
+
+
+-- The persona bundle now reads the latest summary from conversation_messages.
+create or replace function get_persona_bundle(p_user_id uuid)
+returns json
+language sql
+stable
+as $$
+    select json_build_object(
+        'profile', (
+            select json_build_object('name', p.name, 'credits', p.credits)
+            from profiles p
+            where p.id = p_user_id
+        ),
+        'mbti', (
+            select row_to_json(m)
+            from mbti_personality m
+            where m.user_id = p_user_id
+            limit 1
+        ),
+        'ocean', (
+            select row_to_json(o)
+            from ocean_personality o
+            where o.user_id = p_user_id
+            limit 1
+        ),
+        'latest_summary', (
+            select s.content
+            from conversation_messages s
+            where s.user_id = p_user_id and s.role = 'Summary'
+            order by s.ordinal desc
+            limit 1
+        )
+    );
+$$;
@@ -0,0 +1,50 @@
+-- Similarity search returns projected columns only: no embedding vectors in
+-- the response. An empty result means the user has nothing stored, so callers
+-- no longer pre-check with select("*").
+-- The result is a JSON array so the RPC does not depend on the id/metadata column types.
+
+drop function if exists find_similar_knowledge(uuid, vector, integer);
+
+create or replace function find_similar_knowledge(user_id uuid, embedding vector(1536), top_k integer default 5)
+returns json
+language sql
+stable
+as $$
+    select coalesce(json_agg(r order by r.similarity desc), '[]'::json)
+    from (
+        select k.id,
+               k.knowledge_text,
+               k.metadata,
+               k.mention_count,
+               1 - (k.embedding <=> find_similar_knowledge.embedding) as similarity
+        from user_knowledge k
+        where k.user_id = find_similar_knowledge.user_id
+        order by k.embedding <=> find_similar_knowledge.embedding
+        limit top_k
+    ) r;
+$$;
+
+drop function if exists find_similar_slang(uuid, vector, integer);
+
+create or replace function find_similar_slang(user_id uuid, embedding vector(1536), top_k integer default 5)
+returns json
+language sql
+stable
+as $$
+    select coalesce(json_agg(r order by r.similarity desc), '[]'::json)
+    from (
+        select s.id,
+               s.slang_text,
+               s.metadata,
+               s.mention_count,
+               1 - (s.embedding <=> find_similar_slang.embedding) as similarity
+        from user_slang s
+        where s.user_id = find_similar_slang.user_id
+        order by s.embedding <=> find_similar_slang.embedding
+        limit top_k
+    ) r;
+$$;
+
+-- Duplicate checks on store look up (user_id, text) and project id, mention_count.
+create index if not exists user_knowledge_user_text_idx on user_knowledge (user_id, knowledge_text);
+create index if not exists user_slang_user_text_idx on user_slang (user_id, slang_text);
@@ -0,0 +1,29 @@
+-- Bulk embedding writes for the backfill CLI (app/supabase/backfill.py).
+-- p_rows is a JSON array of {"id": ..., "embedding": [...]} objects. Rows are
+-- read with json_populate_recordset so ids and vectors take the table's own
+-- column types. Only the embedding column is written.
+-- Re-embedding with a model of different dimensions also requires altering
+-- the embedding columns and the similarity RPCs.
+
+create or replace function bulk_update_embeddings(p_table text, p_rows json)
+returns integer
+language plpgsql
+as $$
+declare
+    updated integer;
+begin
+    if p_table not in ('user_knowledge', 'user_slang') then
+        raise exception 'bulk_update_embeddings: unsupported table %', p_table;
+    end if;
+
+    execute format(
+        'update %1$I t set embedding = r.embedding
+         from json_populate_recordset(null::%1$I, $1) r
+         where t.id = r.id',
+        p_table
+    ) using p_rows;
+
+    get diagnostics updated = row_count;
+    return updated;
+end;
+$$;
@@ -0,0 +1,16 @@
+-- Atomic credit deduction for captures of credit holds (app/supabase/credit_holds.py).
+-- The balance is decremented in the database (credits = credits - amount,
+-- floored at zero) rather than written as an absolute value computed from a
+-- cached read, so concurrent captures, purchases and deductions from any
+-- worker are never overwritten. Returns the new balance, or null if the user
+-- has no profile.
+
+create or replace function deduct_credits(p_user_id uuid, p_amount integer)
+returns integer
+language sql
+as $$
+    update profiles
+    set credits = greatest(coalesce(credits, 0) - p_amount, 0)
+    where id = p_user_id
+    returning credits;
+$$;
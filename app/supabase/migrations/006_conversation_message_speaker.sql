@@ -0,0 +1,45 @@
+-- Separates who is speaking from what kind of message it is. role is now one
+-- of 'user', 'assistant' or 'Summary'; the display name (the user's name, or
+-- the agent's) is kept in speaker. A user named "Summary" or named like the
+-- agent can no longer be mistaken for a summary or agent row, and a rename
+-- no longer splits their history. Used by app/supabase/conversation_history.py.
+
+alter table conversation_messages add column if not exists speaker text;
+
+-- Existing rows stored the display name as the role. Rows under the user's
+-- current name are theirs; "Astra AI" is the only agent that wrote to the
+-- history; any other name is the user's under an earlier name.
+update conversation_messages m
+set speaker = m.role, role = 'user'
+from profiles p
+where p.id = m.user_id
+  and m.role = p.name
+  and m.role not in ('user', 'assistant', 'Summary');
+
+update conversation_messages
+set speaker = role, role = 'assistant'
+where role = 'Astra AI';
+
+update conversation_messages
+set speaker = role, role = 'user'
+where role not in ('user', 'assistant', 'Summary');
+
+
+-- As in 002, and clears the speaker of the row that becomes the summary.
+create or replace function replace_conversation_range_with_summary(
+    p_user_id uuid,
+    p_upto_ordinal bigint,
+    p_summary text
+)
+returns void
+language plpgsql
+as $$
+begin
+    delete from conversation_messages
+    where user_id = p_user_id and ordinal < p_upto_ordinal;
+
+    update conversation_messages
+    set role = 'Summary', speaker = null, content = p_summary
+    where user_id = p_user_id and ordinal = p_upto_ordinal;
+end;
+$$;
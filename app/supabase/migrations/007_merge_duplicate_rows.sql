@@ -0,0 +1,48 @@
+-- Atomic near-duplicate merges for offline compaction (app/supabase/compaction.py).
+-- Deletes the duplicate rows and adds their mention counts to the kept row in
+-- one transaction, so a failure part way through cannot leave both copies or
+-- lose the duplicates' counts. Counts are read from the rows as they are
+-- deleted, so mentions recorded since compaction loaded them are kept.
+-- p_keep is {"id": ...} and p_duplicates a JSON array of {"id": ...} objects,
+-- read with json_populate_record(set) so ids take the table's own column type.
+-- Raises (rolling the merge back) if the kept row no longer exists.
+-- Returns the number of rows removed.
+
+create or replace function merge_duplicate_rows(p_table text, p_keep json, p_duplicates json)
+returns integer
+language plpgsql
+as $$
+declare
+    merged_mentions integer;
+    removed integer;
+    updated integer;
+begin
+    if p_table not in ('user_knowledge', 'user_slang') then
+        raise exception 'merge_duplicate_rows: unsupported table %', p_table;
+    end if;
+
+    execute format(
+        'with deleted as (
+             delete from %1$I t
+             using json_populate_recordset(null::%1$I, $1) d, json_populate_record(null::%1$I, $2) k
+             where t.id = d.id and t.id <> k.id
+             returning t.mention_count
+         )
+         select coalesce(sum(coalesce(mention_count, 0)), 0), count(*) from deleted',
+        p_table
+    ) using p_duplicates, p_keep into merged_mentions, removed;
+
+    execute format(
+        'update %1$I t set mention_count = coalesce(t.mention_count, 0) + $2, last_updated = now()
+         from json_populate_record(null::%1$I, $1) k
+         where t.id = k.id',
+        p_table
+    ) using p_keep, merged_mentions;
+
+    get diagnostics updated = row_count;
+    if updated = 0 then
+        raise exception 'merge_duplicate_rows: % row % no longer exists', p_table, p_keep;
+    end if;
+    return removed;
+end;
+$$;
@@ -0,0 +1,97 @@
+# persona.py
+# Per-user persona bundle: everything the conversation endpoints read about a
+# user before calling the model, loaded in one batched fetch and cached in-process.
+
+import os
+import logging
+from typing import Optional
+from supabase import create_client, Client
+from pydantic import BaseModel, Field
+from app.psychology.mbti_analysis import MBTIAnalysisService
+from app.psychology.ocean_analysis import OceanAnalysisService
+from app.supabase.persona_cache import persona_cache
+from app.supabase.supabase_mbti import MBTI
+from app.supabase.supabase_ocean import Ocean
+
+logging.basicConfig(level=logging.INFO)
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+
+class PersonaBundle(BaseModel):
+    user_id: str
+    name: Optional[str] = None
+    credits: Optional[int] = None
+    mbti: MBTI = Field(default_factory=MBTI)
+    mbti_type: str
+    style_prompt: str
+    ocean: Ocean = Field(default_factory=Ocean)
+    ocean_traits: dict
+    latest_summary: Optional[str] = None
+
+
+class PersonaRepository:
+    """
+    Repository class that loads persona bundles from Supabase and serves
+    them from the in-process persona cache.
+    """
+    def __init__(self):
+        self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+    def get_bundle(self, user_id: str) -> PersonaBundle:
+        """
+        Returns the persona bundle for a user.
+        On a cache hit no Supabase call is made; on a miss the bundle is loaded
+        with a single RPC and cached until it expires or a write path invalidates it.
+        """
+        return persona_cache.get_or_load(user_id, lambda: self.load_bundle(user_id))
+
+    def load_bundle(self, user_id: str) -> PersonaBundle:
+        """
+        Loads the persona bundle from Supabase, bypassing the cache.
+        """
+        try:
+            response = self.supabase.rpc("get_persona_bundle", {"p_user_id": user_id}).execute()
+            data = response.data or {}
+        except Exception as e:
+            logging.error(f"Error fetching persona bundle for user {user_id}, falling back to table reads: {e}")
+            data = self._load_tables(user_id)
+
+        profile = data.get("profile") or {}
+        mbti = MBTI(**data["mbti"]) if data.get("mbti") else MBTI()
+        ocean = Ocean(**data["ocean"]) if data.get("ocean") else Ocean()
+        mbti_type = MBTIAnalysisService.type_from_scores(mbti)
+
+        return PersonaBundle(
+            user_id=user_id,
+            name=profile.get("name"),
+            credits=profile.get("credits"),
+            mbti=mbti,
+            mbti_type=mbti_type,
+            style_prompt=MBTIAnalysisService.generate_style_prompt(mbti_type),
+            ocean=ocean,
+            ocean_traits=OceanAnalysisService.traits_from_scores(ocean),
+            latest_summary=data.get("latest_summary"),
+        )
+
+    def _load_tables(self, user_id: str) -> dict:
+        """
+        Reads the bundle's tables one by one. Used when the get_persona_bundle
+        RPC is not installed or fails.
+        """
+        data = {}
+        try:
+            profile = self.supabase.table("profiles").select("name, credits").eq("id", user_id).execute()
+            data["profile"] = profile.data[0] if profile.data else None
+            mbti = self.supabase.table("mbti_personality").select("*").eq("user_id", user_id).execute()
+            data["mbti"] = mbti.data[0] if mbti.data else None
+            ocean = self.supabase.table("ocean_personality").select("*").eq("user_id", user_id).execute()
+            data["ocean"] = ocean.data[0] if ocean.data else None
+            summary = self.supabase.table("conversation_messages").select("content")\
+                .eq("user_id", user_id).eq("role", "Summary")\
+                .order("ordinal", desc=True).limit(1).execute()
+            data["latest_summary"] = summary.data[0]["content"] if summary.data else None
+        except Exception as e:
+            logging.error(f"Error fetching persona tables for user {user_id}: {e}")
+        return data
@@ -0,0 +1,119 @@
+# persona_cache.py
+# In-process TTL cache for per-user persona bundles (see persona.py).
+# Kept free of repository imports so that every write path can invalidate
+# the cache without creating circular imports.
+
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+PERSONA_CACHE_TTL_SECONDS = float(os.getenv("PERSONA_CACHE_TTL_SECONDS", "60"))
+PERSONA_CACHE_MAX_USERS = int(os.getenv("PERSONA_CACHE_MAX_USERS", "10000"))
+
+
+class TTLCache:
+    """
+    A thread-safe LRU cache whose entries expire after a fixed time-to-live.
+
+    Loads are guarded by a per-key generation counter: if a key is invalidated
+    while its value is being loaded, the (now stale) loaded value is returned
+    to the caller but not stored.
+    """
+    def __init__(self, ttl_seconds: float, maxsize: int):
+        self.ttl_seconds = ttl_seconds
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, generation: Optional[int] = None) -> None:
+        with self._lock:
+            if generation is not None and self._generations.get(key, 0) != generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_load(self, key: str, loader: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value for key, calling loader() on a miss.
+        A loader result of None is not cached.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            generation = self._generations.get(key, 0)
+        value = loader()
+        if value is not None:
+            self.set(key, value, generation)
+        return value
+
+    def update(self, key: str, updater: Callable[[Any], Any]) -> None:
+        """
+        Replaces a cached value in place with updater(value), keeping its expiry.
+        Does nothing if the key is not cached.
+        """
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            entry = self._data.get(key)
+            if entry is None:
+                return
+            expires_at, value = entry
+            self._data[key] = (expires_at, updater(value))
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in self._data:
+                self._generations[key] = self._generations.get(key, 0) + 1
+            self._data.clear()
+
+
+# Global persona cache keyed by user ID.
+# For production in a multi-process scenario, each worker holds its own copy;
+# the TTL bounds how long another worker's writes can go unseen.
+persona_cache = TTLCache(PERSONA_CACHE_TTL_SECONDS, PERSONA_CACHE_MAX_USERS)
+
+
+def invalidate_persona(user_id: str) -> None:
+    """
+    Drops the cached persona bundle for a user. Called by the write paths
+    that change data held in the bundle (MBTI, OCEAN, history).
+    """
+    persona_cache.invalidate(user_id)
+    logging.debug(f"Invalidated persona bundle for user {user_id}.")
+
+
+def patch_persona(user_id: str, **fields) -> None:
+    """
+    Writes new field values (e.g. name, credits) through to a cached persona
+    bundle so that frequent profile writes do not force a full reload.
+    """
+    persona_cache.update(user_id, lambda bundle: bundle.copy(update=fields))
@@ -1,9 +1,14 @@
 import json
 import os
+import asyncio
 from supabase import create_client
 from dotenv import load_dotenv
-from openai import OpenAI
 import logging
+from typing import List, Optional
+from app.supabase.vector_index import VectorIndexCache, index_dimensions
+from app.utils.embedding_cache import embedding_cache
+from app.utils.openai_client import get_openai_client
+from app.utils.token_count import count_tokens
 
 
 load_dotenv()
@@ -11,124 +16,231 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+
+def _cached_embeddings(texts: List[str]) -> dict:
+    """
+    Full-precision embeddings for exact re-ranking in the vector indexes (cache only, no API calls).
+    """
+    return embedding_cache.get_many(EMBEDDING_MODEL, texts)
+
+def _cache_embeddings(embeddings: dict):
+    """
+    Caches stored embeddings the vector indexes read for re-ranking. The tables'
+    vectors are EMBEDDING_MODEL's (backfill.py re-embeds them when it changes).
+    """
+    embedding_cache.set_many(EMBEDDING_MODEL, embeddings)
+
+# In-process per-user vector indexes; pgvector remains the source of truth
+knowledge_index = VectorIndexCache(
+    supabase, "user_knowledge", "knowledge_text",
+    cached_vectors=_cached_embeddings, cache_vectors=_cache_embeddings, truncate_to=index_dimensions(EMBEDDING_MODEL)
+)
+slang_index = VectorIndexCache(
+    supabase, "user_slang", "slang_text",
+    cached_vectors=_cached_embeddings, cache_vectors=_cache_embeddings, truncate_to=index_dimensions(EMBEDDING_MODEL)
+)
+
+# Provider limits for a single embeddings request
+EMBEDDING_BATCH_MAX_INPUTS = 2048
+EMBEDDING_BATCH_MAX_TOKENS = 250_000
 
 # Embedding generation
-def generate_embedding(text):
+async def generate_embedding(text):
     """
     Converts text into an embedding vector using OpenAI's latest embedding model.
+    Embeddings are served from the content-addressed embedding cache when possible.
     """
-    try:
-        response = client.embeddings.create(
-            model="text-embedding-ada-002",  # Use the latest embedding model
-            input=text
-        )
-        embedding = response.data[0].embedding
-        logging.info(f"Embedding generated: {embedding}")
-        return embedding
-    except Exception as e:
-        logging.error(f"Error generating embedding: {e}")
-        return None
-
+    return (await generate_embeddings([text]))[0]
 
-# User knowledge
-def store_user_knowledge(user_id: str, knowledge_text: str, metadata: dict):
+async def generate_embeddings(texts: List[str]) -> List[Optional[List[float]]]:
     """
-    Stores extracted knowledge in the vector database with safety checks.
+    Converts a list of texts into embedding vectors, returned in input order.
+    Texts are deduplicated, cache hits are filled from the embedding cache and
+    the misses are sent in as few requests as the provider's batch limits allow,
+    concurrently over the shared OpenAI client.
+    A text whose embedding could not be generated maps to None.
+    """
+    unique_texts = list(dict.fromkeys(texts))
+    embeddings = await asyncio.to_thread(embedding_cache.get_many, EMBEDDING_MODEL, unique_texts)
+    misses = [text for text in unique_texts if text not in embeddings]
+
+    async def embed_batch(batch: List[str]):
+        try:
+            response = await get_openai_client().embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=batch
+            )
+            generated = {batch[item.index]: item.embedding for item in response.data}
+            logging.info(f"Embeddings generated: {len(generated)} texts in one request")
+            await asyncio.to_thread(embedding_cache.set_many, EMBEDDING_MODEL, generated)
+            embeddings.update(generated)
+        except Exception as e:
+            logging.error(f"Error generating embeddings for {len(batch)} texts: {e}")
+
+    await asyncio.gather(*(embed_batch(batch) for batch in _embedding_batches(misses)))
+    return [embeddings.get(text) for text in texts]
+
+def _embedding_batches(texts: List[str]):
+    """
+    Splits texts into request-sized batches by input count and token count.
+    """
+    batch, batch_tokens = [], 0
+    for text in texts:
+        tokens = count_tokens(text)
+        if batch and (len(batch) >= EMBEDDING_BATCH_MAX_INPUTS or batch_tokens + tokens > EMBEDDING_BATCH_MAX_TOKENS):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def _without_embeddings(rows) -> list:
+    """
+    Drops embedding vectors from search results. The RPCs in migrations/003 no
+    longer return them; this guards against older RPC versions that still do.
     """
-    embedding = generate_embedding(knowledge_text)
-    
-    logging.info(f"Embedding generated: {embedding}")   
+    if not rows:
+        return []
+    return [{key: value for key, value in row.items() if key != "embedding"} for row in rows]
 
-    # Check if knowledge already exists to prevent duplicates
-    existing = supabase.table("user_knowledge").select("*").eq("user_id", user_id).eq("knowledge_text", knowledge_text).execute()
 
-    if existing.data:
+# Near-duplicate detection on write. A new text whose embedding is at least this
+# similar to one of the user's stored texts is merged into that row instead of
+# inserted. Similarity ranges depend on the embedding model; tune per model.
+DUPLICATE_SIMILARITY_THRESHOLD = float(os.getenv("DUPLICATE_SIMILARITY_THRESHOLD", "0.95"))
+
+def _store_text(table_name: str, text_column: str, index: VectorIndexCache, user_id: str, text: str, metadata: dict, embedding):
+    """
+    Stores a text row (knowledge or slang) for a user, merging it into an existing
+    row when the text is an exact or near duplicate. A merge bumps mention_count and
+    replaces the metadata but keeps the stored text and embedding.
+    """
+    # Exact duplicates (projected: no embedding over the wire)
+    existing = supabase.table(table_name).select("id, mention_count")\
+        .eq("user_id", user_id)\
+        .eq(text_column, text)\
+        .limit(1).execute()
+    match = existing.data[0] if existing.data else None
+
+    # Near duplicates, from the user's in-process vector index
+    if match is None and embedding is not None:
+        nearest = index.search(user_id, embedding, 1)
+        if nearest and nearest[0]["similarity"] >= DUPLICATE_SIMILARITY_THRESHOLD:
+            match = nearest[0]
+            logging.info(
+                f"Merging near-duplicate {table_name} entry into {match['id']} "
+                f"(similarity {match['similarity']:.3f}): {text!r} ~ {match[text_column]!r}"
+            )
+
+    if match is not None:
         # Increase mention count and update timestamp
-        new_count = existing.data[0]["mention_count"] + 1
-        supabase.table("user_knowledge").update({
+        new_count = match["mention_count"] + 1
+        updated = supabase.table(table_name).update({
             "metadata": json.dumps(metadata),
             "last_updated": "now()",
             "mention_count": new_count
-        }).eq("id", existing.data[0]["id"]).execute()
-        print("Updated existing knowledge entry.")
-    else:
-        # Insert new knowledge
-        supabase.table("user_knowledge").insert({
-            "user_id": user_id,
-            "knowledge_text": knowledge_text,
-            "embedding": embedding,
-            "metadata": json.dumps(metadata),
+        }, count="exact", returning="minimal").eq("id", match["id"]).execute()
+        if updated.count:
+            index.update(user_id, match["id"], metadata=json.dumps(metadata), mention_count=new_count)
+            return "updated"
+        # The match is gone (e.g. merged away by compaction since the index
+        # loaded): reload the index and store the text as a new row
+        logging.warning(f"{table_name} entry {match['id']} no longer exists; inserting {text!r} instead.")
+        index.invalidate(user_id)
+
+    inserted = supabase.table(table_name).insert({
+        "user_id": user_id,
+        text_column: text,
+        "embedding": embedding,
+        "metadata": json.dumps(metadata),
+        "mention_count": 1
+    }).execute()
+    if inserted.data and embedding is not None:
+        row = inserted.data[0]
+        index.add(user_id, {
+            "id": row["id"],
+            text_column: text,
+            "metadata": row["metadata"],
             "mention_count": 1
-        }).execute()
+        }, embedding)
+    return "inserted"
 
-def find_similar_knowledge(user_id: str, query: str, top_k=5):
+def _find_similar(rpc_name: str, index: VectorIndexCache, user_id: str, query_embedding, top_k: int) -> list:
     """
-    Finds the most relevant knowledge for a user based on a query.
+    Returns the user's top_k rows most similar to the query embedding.
     """
-    query_embedding = generate_embedding(query)
-
-    # Ensure the user has stored knowledge before searching
-    existing = supabase.table("user_knowledge").select("*").eq("user_id", user_id).execute()
-
-    if not existing.data:
-        return {"message": "No knowledge stored for this user."}
-
-    response = supabase.rpc("find_similar_knowledge", {
+    # Serve the search from the in-process index; fall back to the RPC if it cannot be loaded.
+    # The RPC returns an empty list when the user has nothing stored,
+    # so no separate existence check is needed.
+    results = index.search(user_id, query_embedding, top_k) if query_embedding is not None else None
+    if results is not None:
+        return results
+
+    response = supabase.rpc(rpc_name, {
         "user_id": user_id,
         "embedding": query_embedding,
         "top_k": top_k
     }).execute()
 
-    return response.data if response.data else {"message": "No similar knowledge found."}
+    results = _without_embeddings(response.data)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"{rpc_name} payload: {len(json.dumps(results))} bytes for {len(results)} rows")
+    return results
+
+# User knowledge
+async def store_user_knowledge(user_id: str, knowledge_text: str, metadata: dict, embedding: Optional[List[float]] = None):
+    """
+    Stores extracted knowledge in the vector database with safety checks.
+    Knowledge that repeats, or closely paraphrases, an existing entry is merged into it.
+    Pass `embedding` when it was already generated (e.g. with generate_embeddings).
+    """
+    if embedding is None:
+        embedding = await generate_embedding(knowledge_text)
+
+    stored = await asyncio.to_thread(
+        _store_text, "user_knowledge", "knowledge_text", knowledge_index, user_id, knowledge_text, metadata, embedding
+    )
+    if stored == "updated":
+        print("Updated existing knowledge entry.")
+
+async def find_similar_knowledge(user_id: str, query: str, top_k=5, query_embedding: Optional[List[float]] = None):
+    """
+    Finds the most relevant knowledge for a user based on a query.
+    Pass `query_embedding` when it was already generated (e.g. with generate_embeddings).
+    """
+    if query_embedding is None:
+        query_embedding = await generate_embedding(query)
+
+    results = await asyncio.to_thread(_find_similar, "find_similar_knowledge", knowledge_index, user_id, query_embedding, top_k)
+    return results if results else {"message": "No similar knowledge found."}
 
 # User slang
-def store_user_slang(user_id: str, slang_text: str, metadata: dict):
+async def store_user_slang(user_id: str, slang_text: str, metadata: dict, embedding: Optional[List[float]] = None):
     """
     Stores extracted slang in the vector store in a dedicated table (e.g. "user_slang").
+    Slang that repeats, or closely matches, an existing entry is merged into it.
+    Pass `embedding` when it was already generated (e.g. with generate_embeddings).
     """
-    embedding = generate_embedding(slang_text)
-    logging.info(f"Embedding generated for slang: {embedding}")
-    
-    # Check if this slang entry already exists to avoid duplicates
-    existing = supabase.table("user_slang").select("*")\
-        .eq("user_id", user_id)\
-        .eq("slang_text", slang_text).execute()
-    
-    if existing.data:
-        new_count = existing.data[0]["mention_count"] + 1
-        supabase.table("user_slang").update({
-            "metadata": json.dumps(metadata),
-            "last_updated": "now()",
-            "mention_count": new_count
-        }).eq("id", existing.data[0]["id"]).execute()
+    if embedding is None:
+        embedding = await generate_embedding(slang_text)
+
+    stored = await asyncio.to_thread(
+        _store_text, "user_slang", "slang_text", slang_index, user_id, slang_text, metadata, embedding
+    )
+    if stored == "updated":
         print("Updated existing slang entry.")
-    else:
-        supabase.table("user_slang").insert({
-            "user_id": user_id,
-            "slang_text": slang_text,
-            "embedding": embedding,
-            "metadata": json.dumps(metadata),
-            "mention_count": 1
-        }).execute()
 
-def find_similar_slang(user_id: str, query: str, top_k=5):
+async def find_similar_slang(user_id: str, query: str, top_k=5, query_embedding: Optional[List[float]] = None):
     """
     Finds the most similar slang entries for a user based on a query.
+    Pass `query_embedding` when it was already generated (e.g. with generate_embeddings).
     """
-    query_embedding = generate_embedding(query)
-    
-    # Ensure the user has stored slang before searching
-    existing = supabase.table("user_slang").select("*").eq("user_id", user_id).execute()
-    if not existing.data:
-        return {"message": "No slang stored for this user."}
-    
-    response = supabase.rpc("find_similar_slang", {
-        "user_id": user_id,
-        "embedding": query_embedding,
-        "top_k": top_k
-    }).execute()
-    
-    return response.data if response.data else {"message": "No similar slang found."}
\ No newline at end of file
+    if query_embedding is None:
+        query_embedding = await generate_embedding(query)
+
+    results = await asyncio.to_thread(_find_similar, "find_similar_slang", slang_index, user_id, query_embedding, top_k)
+    return results if results else {"message": "No similar slang found."}
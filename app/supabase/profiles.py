@@ -3,6 +3,8 @@ import logging
 from typing import Optional, List
 from supabase import create_client, Client
 from pydantic import BaseModel
+from app.supabase.persona_cache import patch_persona
+from app.supabase.credit_holds import CreditHold, credit_balances
 
 logging.basicConfig(level=logging.INFO)
 
@@ -86,6 +88,7 @@ class ProfileRepository:
         """
         try:
             response = self.supabase.table(self.table_name).update({"name": name}).eq("id", user_id).execute()
+            patch_persona(user_id, name=name)
             return True
         except Exception as e:
             logging.error(f"Error updating name for user_id: {user_id}: {e}")
@@ -156,6 +159,8 @@ class ProfileRepository:
         """
         try:
             response = self.supabase.table(self.table_name).update({"credits": credit}).eq("id", user_id).execute()
+            patch_persona(user_id, credits=credit)
+            credit_balances.set_balance(user_id, credit)
             return True
         except Exception as e:
             logging.error(f"Error updating credits for user_id: {user_id}: {e}")
@@ -173,11 +178,68 @@ class ProfileRepository:
             new_credits = current_credits - amount
  
             response = self.supabase.table(self.table_name).update({"credits": new_credits}).eq("id", user_id).execute()
+            patch_persona(user_id, credits=new_credits)
+            credit_balances.set_balance(user_id, new_credits)
             return True
         except Exception as e:
             logging.error(f"Failed to deduct credits for user {user_id}: {e}")
             return False
 
+    def hold_credits(self, user_id: str, amount: int, balance: Optional[int] = None) -> Optional[CreditHold]:
+        """
+        Reserves an estimated cost before running billable work, against the
+        in-memory balance. balance is the caller's already loaded balance (e.g.
+        from the persona bundle); the database is read only if neither it nor
+        a cached balance is available.
+        Returns the hold, or None if the user does not have the credits available.
+        """
+        return credit_balances.hold(user_id, amount, lambda: balance if balance is not None else self.get_user_credit(user_id))
+
+    def capture_credits(self, hold: CreditHold, amount: int) -> bool:
+        """
+        Settles a hold: deducts the actual cost, up to the amount held, and
+        releases the rest. The deduction is a single atomic decrement in the
+        database (deduct_credits RPC), so writes from other workers are never
+        overwritten; the in-memory balance is updated only once it has succeeded.
+        A hold is settled once: capturing or releasing it again does nothing.
+        Returns False if the credits could not be deducted.
+        """
+        if not credit_balances.settle(hold):
+            logging.info(f"Credit hold {hold.id} of user {hold.user_id} is already settled")
+            return True
+        if amount > hold.amount:
+            logging.warning(f"Capturing {hold.amount} credits held for user {hold.user_id} instead of the {amount} used")
+            amount = hold.amount
+        if amount <= 0:
+            credit_balances.release(hold)
+            return True
+        try:
+            response = self.supabase.rpc("deduct_credits", {"p_user_id": hold.user_id, "p_amount": amount}).execute()
+            new_credits = response.data
+        except Exception as e:
+            logging.error(f"Failed to capture {amount} credits for user {hold.user_id}: {e}")
+            credit_balances.fail(hold)
+            return False
+        if new_credits is None:
+            logging.error(f"Failed to capture {amount} credits for user {hold.user_id}: no profile record found")
+            credit_balances.fail(hold)
+            return False
+        if new_credits == 0:
+            # deduct_credits floors the balance at 0, e.g. when another worker
+            # charged the user meanwhile; the difference is not charged
+            logging.warning(f"Capturing {amount} credits took the balance of user {hold.user_id} to 0; any shortfall was not charged")
+        credit_balances.capture(hold, new_credits)
+        patch_persona(hold.user_id, credits=new_credits)
+        return True
+
+    def release_credits(self, hold: CreditHold):
+        """
+        Releases a hold without charging it (the work failed or was cancelled).
+        Does nothing if the hold is already settled.
+        """
+        if credit_balances.settle(hold):
+            credit_balances.release(hold)
+
     def get_profile(self, user_id: str) -> Optional[Profile]:
         """
         Retrieves the profile record for a specific user from Supabase.
@@ -204,6 +266,8 @@ class ProfileRepository:
             current = self.get_user_credit(user_id)
             new_total = current + additional_credits
             response = self.supabase.table("profiles").update({"credits": new_total}).eq("id", user_id).execute()
+            patch_persona(user_id, credits=new_total)
+            credit_balances.set_balance(user_id, new_total)
             return self.get_user_credit(user_id)
         except Exception as e:
             logging.error(f"Failed to increment credits for user {user_id}: {e}")
@@ -3,6 +3,7 @@ import logging
 from typing import Optional
 from supabase import create_client, Client
 from pydantic import BaseModel, Field
+from app.supabase.persona_cache import invalidate_persona
 
 logging.basicConfig(level=logging.INFO)
 
@@ -62,5 +63,6 @@ class MBTIRepository:
                 # Insert
                 self.supabase.table(self.table_name).insert(record_dict).execute()
                 logging.info(f"Inserted new MBTI record for user_id: {user_id}")
+            invalidate_persona(user_id)
         except Exception as e:
             logging.error(f"Error upserting MBTI data for user {user_id}: {e}")
@@ -3,6 +3,7 @@ import logging
 from typing import Optional
 from supabase import create_client, Client
 from pydantic import BaseModel
+from app.supabase.persona_cache import invalidate_persona
 
 logging.basicConfig(level=logging.INFO)
 
@@ -54,5 +55,6 @@ class OceanRepository:
             else:
                 self.supabase.table(self.table_name).insert(record_dict).execute()
                 logging.info(f"Inserted new OCEAN record for user_id: {user_id}")
+            invalidate_persona(user_id)
         except Exception as e:
             logging.error(f"Error upserting OCEAN data for user {user_id}: {e}")
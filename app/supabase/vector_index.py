@@ -0,0 +1,432 @@
+# vector_index.py
+# In-process per-user vector index in front of the pgvector similarity RPCs.
+# Each user's vectors live in one contiguous matrix of L2-normalized vectors and
+# are searched by brute-force dot product. pgvector stays the source of truth:
+# indexes are loaded lazily, updated on writes from this process and reloaded
+# after a TTL so writes from other workers are picked up.
+#
+# To hold many users per worker, vectors are stored compactly (float16, or int8
+# with a per-vector scale), optionally truncated to fewer dimensions for
+# Matryoshka-trained models (text-embedding-3-*). The top candidates of the
+# compact search are re-ranked exactly against their full-precision vectors,
+# read from the embedding cache or, for candidates it does not have, from the
+# table (and then cached).
+#
+# Compact precisions trade some latency for memory: their codes are upcast to
+# float32 block by block for each search. In benchmarks/vector_quantization.py
+# int8 uses a quarter of float32's memory and scores about as fast (9-14 ms vs
+# 7-11 ms per query over 20k vectors); float16 is much slower (60-90 ms) and
+# only worth it where int8 recall is not acceptable. Set
+# VECTOR_INDEX_PRECISION=float32 when memory is not the constraint.
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from app.utils.metrics import LatencyStats, register_metrics
+
+
+VECTOR_INDEX_MAX_BYTES = int(os.getenv("VECTOR_INDEX_MAX_BYTES", str(256 * 1024 * 1024)))
+VECTOR_INDEX_TTL_SECONDS = float(os.getenv("VECTOR_INDEX_TTL_SECONDS", "300"))
+VECTOR_INDEX_PRECISION = os.getenv("VECTOR_INDEX_PRECISION", "int8")  # float32 | float16 | int8
+VECTOR_INDEX_DIMENSIONS = int(os.getenv("VECTOR_INDEX_DIMENSIONS", "0"))  # 0 keeps every dimension
+VECTOR_INDEX_RERANK_FACTOR = int(os.getenv("VECTOR_INDEX_RERANK_FACTOR", "4"))
+# Rows read per request when loading a user's index. Pages are read until one
+# comes back empty, so a server-side row cap (PostgREST's max-rows) smaller
+# than this cannot truncate the index.
+VECTOR_INDEX_LOAD_PAGE_SIZE = int(os.getenv("VECTOR_INDEX_LOAD_PAGE_SIZE", "1000"))
+SCORE_BLOCK_ROWS = 256  # Rows upcast to float32 at a time when scoring compact vectors
+
+# Models whose embeddings can be truncated to a prefix of their dimensions
+MATRYOSHKA_MODEL_PREFIX = "text-embedding-3-"
+
+
+def to_unit_vector(embedding, dimensions: int = 0) -> np.ndarray:
+    """
+    Converts an embedding (list, array or pgvector "[x,y,...]" string) to an L2-normalized float32 vector,
+    optionally truncated to its first `dimensions` dimensions.
+    """
+    if isinstance(embedding, str):
+        embedding = json.loads(embedding)
+    vector = np.asarray(embedding, dtype=np.float32)
+    if dimensions:
+        vector = vector[:dimensions]
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def index_dimensions(model: str) -> int:
+    """
+    Returns the truncated dimension count to index for `model`, or 0 for all dimensions.
+    Truncation is only meaningful for Matryoshka-trained models.
+    """
+    if VECTOR_INDEX_DIMENSIONS and not model.startswith(MATRYOSHKA_MODEL_PREFIX):
+        logging.warning(f"VECTOR_INDEX_DIMENSIONS ignored: {model} embeddings cannot be truncated.")
+        return 0
+    return VECTOR_INDEX_DIMENSIONS
+
+
+def duplicate_clusters(vectors: np.ndarray, threshold: float, order: Optional[List[int]] = None, block_size: int = 512) -> List[List[int]]:
+    """
+    Groups the rows of a matrix of unit vectors into clusters whose members are
+    all pairwise at least `threshold` similar (complete linkage), so a chain of
+    near-duplicates (A ~ B ~ C with A and C apart) is never merged as one.
+    Rows are taken in `order` (default: row order); each row not yet clustered
+    becomes a cluster's representative and first member, and the unclustered
+    rows nearest to it join while they are near-duplicates of every member.
+    Similarities are computed block by block to bound memory.
+    Returns the clusters of two or more row positions, representative first.
+    """
+    count = len(vectors)
+    order = list(range(count)) if order is None else list(order)
+    clustered = np.zeros(count, dtype=bool)
+    clusters = []
+    for start in range(0, count, block_size):
+        block = order[start:start + block_size]
+        similarities = vectors[block] @ vectors.T
+        for representative, row in zip(block, similarities):
+            if clustered[representative]:
+                continue
+            clustered[representative] = True
+            candidates = np.nonzero((row >= threshold) & ~clustered)[0]
+            if len(candidates) == 0:
+                continue
+            candidates = candidates[np.argsort(-row[candidates])]
+            members = [representative]
+            for candidate in candidates:
+                if len(members) == 1 or np.all(vectors[members[1:]] @ vectors[candidate] >= threshold):
+                    members.append(int(candidate))
+            clustered[members] = True
+            if len(members) > 1:
+                clusters.append(members)
+    return clusters
+
+
+class QuantizedMatrix:
+    """
+    A growable matrix of unit vectors stored as float32, float16, or int8 codes
+    with one float32 scale per row.
+    """
+    def __init__(self, dimensions: int, precision: str = VECTOR_INDEX_PRECISION, capacity: int = 16):
+        if precision not in ("float32", "float16", "int8"):
+            raise ValueError(f"Unsupported vector precision: {precision}")
+        self.dimensions = dimensions
+        self.precision = precision
+        self.size = 0
+        self.codes = np.zeros((capacity, dimensions), dtype=precision)
+        self.scales = np.ones(capacity, dtype=np.float32) if precision == "int8" else None
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def append(self, vector: np.ndarray):
+        if self.size == self.codes.shape[0]:
+            self._resize(max(16, self.size * 2))
+        if self.precision == "int8":
+            scale = float(np.max(np.abs(vector))) / 127 or 1.0
+            self.codes[self.size] = np.round(vector / scale).astype(np.int8)
+            self.scales[self.size] = scale
+        else:
+            self.codes[self.size] = vector
+        self.size += 1
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """
+        Approximate dot products of every stored vector with a float32 query.
+        """
+        codes = self.codes[:self.size]
+        if self.precision == "float32":
+            return codes @ query
+        # numpy has no BLAS path for int8 or float16 matmul (the mixed-type
+        # product runs a generic loop), so upcast block by block and use the
+        # float32 BLAS product; the block bounds the temporary's size
+        scores = np.empty(self.size, dtype=np.float32)
+        for start in range(0, self.size, SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+        if self.precision == "int8":
+            scores *= self.scales[:self.size]
+        return scores
+
+    def shrink_to_fit(self):
+        """
+        Drops the spare capacity left by growing, e.g. once a load has finished.
+        """
+        if self.codes.shape[0] > self.size:
+            self._resize(self.size)
+
+    def _resize(self, capacity: int):
+        codes = np.zeros((capacity, self.dimensions), dtype=self.codes.dtype)
+        codes[:self.size] = self.codes[:self.size]
+        self.codes = codes
+        if self.scales is not None:
+            scales = np.ones(capacity, dtype=np.float32)
+            scales[:self.size] = self.scales[:self.size]
+            self.scales = scales
+
+
+class UserVectorIndex:
+    """
+    The vectors and projected rows (id, text, metadata, mention_count) of one user.
+    The matrix is created on the first vector, so its width always matches the
+    embeddings (a user with no rows has no matrix yet).
+    """
+    def __init__(self, capacity: int = 16, precision: str = VECTOR_INDEX_PRECISION, truncate_to: int = 0):
+        self.capacity = capacity
+        self.precision = precision
+        self.truncate_to = truncate_to
+        self.matrix: Optional[QuantizedMatrix] = None
+        self.rows: List[dict] = []
+        self.positions: Dict[object, int] = {}  # row id -> matrix row
+        self.loaded_at = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        return len(self.rows)
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes if self.matrix is not None else 0
+
+    def add(self, row: dict, embedding):
+        if row["id"] in self.positions:
+            self.update(row["id"], **row)
+            return
+        vector = to_unit_vector(embedding, self.truncate_to)
+        if self.matrix is None:
+            self.matrix = QuantizedMatrix(len(vector), self.precision, self.capacity)
+        self.matrix.append(vector)
+        self.positions[row["id"]] = self.size
+        self.rows.append(row)
+
+    def shrink_to_fit(self):
+        if self.matrix is not None:
+            self.matrix.shrink_to_fit()
+
+    def update(self, row_id, **fields):
+        position = self.positions.get(row_id)
+        if position is not None:
+            self.rows[position].update(fields)
+
+    def candidates(self, query_embedding, count: int) -> List[tuple]:
+        """
+        Returns up to `count` (position, approximate similarity) pairs, best first.
+        """
+        if self.size == 0:
+            return []
+        scores = self.matrix.scores(to_unit_vector(query_embedding, self.truncate_to))
+        if self.size > count:
+            top = np.argpartition(-scores, count)[:count]
+        else:
+            top = np.arange(self.size)
+        order = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in order]
+
+    def search(self, query_embedding, top_k: int, exact_vectors: Optional[Callable] = None) -> List[dict]:
+        """
+        Returns the top_k most similar rows. With `exact_vectors` (a callable mapping
+        rows to {row id: full-precision embedding}), the compact search over-fetches
+        candidates and re-ranks them by exact cosine similarity.
+        """
+        if exact_vectors is None:
+            return [dict(self.rows[i], similarity=score) for i, score in self.candidates(query_embedding, top_k)]
+        return rerank(self.candidate_rows(query_embedding, top_k * VECTOR_INDEX_RERANK_FACTOR), query_embedding, top_k, exact_vectors)
+
+    def candidate_rows(self, query_embedding, count: int) -> List[tuple]:
+        """
+        Like candidates, with copies of the rows: (row, approximate similarity) pairs.
+        """
+        return [(dict(self.rows[i]), score) for i, score in self.candidates(query_embedding, count)]
+
+
+def rerank(candidates: List[tuple], query_embedding, top_k: int, exact_vectors: Callable) -> List[dict]:
+    """
+    Re-scores (row, approximate similarity) candidates, best first, by exact
+    cosine similarity against their full-precision embeddings
+    (exact_vectors(rows) -> {row id: embedding}) and returns the top_k rows with
+    their similarity. Exact and approximate scores are never ranked together:
+    if any candidate has no usable full-precision vector, the approximate
+    ranking is returned.
+    """
+    query = to_unit_vector(query_embedding)
+    try:
+        exact = exact_vectors([row for row, _ in candidates])
+    except Exception as e:
+        logging.error(f"Error reading full-precision vectors for re-ranking: {e}")
+        exact = {}
+    rescored = []
+    for position, (row, _) in enumerate(candidates):
+        vector = exact.get(row["id"])
+        vector = to_unit_vector(vector) if vector is not None else None
+        if vector is None or len(vector) != len(query):
+            logging.warning(f"No full-precision vector for row {row['id']}; returning the approximate ranking.")
+            return [dict(row, similarity=score) for row, score in candidates[:top_k]]
+        rescored.append((float(vector @ query), position))
+    rescored.sort(reverse=True)
+    return [dict(candidates[position][0], similarity=score) for score, position in rescored[:top_k]]
+
+
+class VectorIndexCache:
+    """
+    LRU of UserVectorIndex objects for one table, evicting whole users to stay
+    under a memory budget.
+    """
+    def __init__(
+        self,
+        supabase,
+        table_name: str,
+        text_column: str,
+        max_bytes: int = VECTOR_INDEX_MAX_BYTES,
+        cached_vectors: Optional[Callable[[List[str]], dict]] = None,
+        cache_vectors: Optional[Callable[[dict], None]] = None,
+        truncate_to: int = 0,
+    ):
+        """
+        With cached_vectors (texts -> {text: embedding}, e.g. the embedding
+        cache), searches are re-ranked exactly. Candidates it has no vector for
+        are read from the table and passed to cache_vectors ({text: embedding}).
+        """
+        self.supabase = supabase
+        self.table_name = table_name
+        self.text_column = text_column
+        self.max_bytes = max_bytes
+        self.cached_vectors = cached_vectors
+        self.cache_vectors = cache_vectors
+        self.truncate_to = truncate_to
+        self.indexes: "OrderedDict[str, UserVectorIndex]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.loads = 0
+        self.evictions = 0
+        self.stored_vector_reads = 0
+        self.search_latency = LatencyStats()
+        register_metrics(f"{table_name}_index", self.metrics)
+
+    def search(self, user_id: str, query_embedding, top_k: int) -> Optional[List[dict]]:
+        """
+        Returns the top_k most similar rows for the user, or None if the index
+        could not be loaded (callers then fall back to the RPC).
+        """
+        index = self.get(user_id)
+        if index is None:
+            return None
+        with self.search_latency.time():
+            if self.cached_vectors is None:
+                with self._lock:
+                    return index.search(query_embedding, top_k)
+            # Only the compact search holds the lock; the exact vectors may come
+            # from the disk cache or the table, so they are fetched and re-ranked outside it
+            with self._lock:
+                candidates = index.candidate_rows(query_embedding, top_k * VECTOR_INDEX_RERANK_FACTOR)
+            return rerank(candidates, query_embedding, top_k, self.exact_vectors)
+
+    def exact_vectors(self, rows: List[dict]) -> dict:
+        """
+        Full-precision embeddings of rows, as {row id: embedding}: from
+        cached_vectors, else read from the table in one query and cached.
+        """
+        cached = self.cached_vectors([row[self.text_column] for row in rows])
+        vectors = {row["id"]: cached[row[self.text_column]] for row in rows if row[self.text_column] in cached}
+        missing = [row for row in rows if row["id"] not in vectors]
+        if not missing:
+            return vectors
+        response = self.supabase.table(self.table_name).select("id, embedding")\
+            .in_("id", [row["id"] for row in missing]).execute()
+        stored = {
+            row["id"]: json.loads(row["embedding"]) if isinstance(row["embedding"], str) else row["embedding"]
+            for row in response.data or [] if row.get("embedding") is not None
+        }
+        vectors.update(stored)
+        self.stored_vector_reads += 1
+        if self.cache_vectors is not None:
+            self.cache_vectors({row[self.text_column]: stored[row["id"]] for row in missing if row["id"] in stored})
+        return vectors
+
+    def get(self, user_id: str) -> Optional[UserVectorIndex]:
+        with self._lock:
+            index = self.indexes.get(user_id)
+            if index is not None and time.monotonic() - index.loaded_at < VECTOR_INDEX_TTL_SECONDS:
+                self.indexes.move_to_end(user_id)
+                return index
+        index = self._load(user_id)
+        if index is None:
+            return None
+        with self._lock:
+            self.indexes[user_id] = index
+            self.indexes.move_to_end(user_id)
+            self._evict()
+        return index
+
+    def add(self, user_id: str, row: dict, embedding):
+        """
+        Adds a newly stored row to the user's index if it is loaded.
+        """
+        with self._lock:
+            index = self.indexes.get(user_id)
+            if index is not None:
+                index.add(row, embedding)
+                self._evict()
+
+    def update(self, user_id: str, row_id, **fields):
+        """
+        Updates the projected fields of a stored row if the user's index is loaded.
+        """
+        with self._lock:
+            index = self.indexes.get(user_id)
+            if index is not None:
+                index.update(row_id, **fields)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self.indexes.pop(user_id, None)
+
+    def _load(self, user_id: str) -> Optional[UserVectorIndex]:
+        index = UserVectorIndex(truncate_to=self.truncate_to)
+        after_id = None
+        try:
+            # Keyset pagination in id order, as in backfill.py
+            while True:
+                query = self.supabase.table(self.table_name)\
+                    .select(f"id, {self.text_column}, metadata, mention_count, embedding")\
+                    .eq("user_id", user_id).order("id").limit(VECTOR_INDEX_LOAD_PAGE_SIZE)
+                if after_id is not None:
+                    query = query.gt("id", after_id)
+                page = query.execute().data or []
+                if not page:
+                    break
+                after_id = page[-1]["id"]
+                for row in page:
+                    embedding = row.pop("embedding")
+                    if embedding is not None:
+                        index.add(row, embedding)
+        except Exception as e:
+            logging.error(f"Error loading {self.table_name} vectors for user {user_id}: {e}")
+            return None
+
+        index.shrink_to_fit()
+        self.loads += 1
+        logging.info(f"Loaded {index.size} {self.table_name} vectors for user {user_id}.")
+        return index
+
+    def _evict(self):
+        total = sum(index.nbytes for index in self.indexes.values())
+        while total > self.max_bytes and len(self.indexes) > 1:
+            _, evicted = self.indexes.popitem(last=False)
+            total -= evicted.nbytes
+            self.evictions += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self.indexes),
+                "vectors": sum(index.size for index in self.indexes.values()),
+                "bytes": sum(index.nbytes for index in self.indexes.values()),
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "stored_vector_reads": self.stored_vector_reads,
+                "search_latency": self.search_latency.snapshot(),
+            }
@@ -0,0 +1,94 @@
+# billing.py
+# Bills a request by the token usage the provider reports for every model
+# call the request makes: the agent's own turns, its tool-call turns, agents
+# used as tools and agents run inside tools. A per-request UsageLedger is
+# held in a context variable; agent hooks (attached to every registered
+# agent) add each model response's usage to the current ledger, attributed to
+# the agent's model. Runs outside a request (background jobs) have no ledger
+# and are not recorded. A ledger with a credit limit (the request's credit
+# hold) refuses to start another model call once the limit is used up.
+
+import logging
+from contextvars import ContextVar
+from typing import Dict, Optional
+from agents import AgentHooks
+from app.utils.token_count import calculate_credits_to_deduct, calculate_usage_cost
+
+
+class CreditLimitExceeded(RuntimeError):
+    pass
+
+
+class UsageLedger:
+    """
+    Token usage of one request, per model.
+    """
+    def __init__(self, credit_limit: Optional[int] = None):
+        self.models: Dict[str, Dict[str, int]] = {}
+        self.credit_limit = credit_limit
+
+    def add(self, model: str, input_tokens: int, output_tokens: int, cached_input_tokens: int = 0):
+        usage = self.models.setdefault(model, {"requests": 0, "input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0})
+        usage["requests"] += 1
+        usage["input_tokens"] += input_tokens
+        usage["cached_input_tokens"] += cached_input_tokens
+        usage["output_tokens"] += output_tokens
+
+    def provider_cost(self) -> float:
+        return sum(
+            calculate_usage_cost(model, usage["input_tokens"], usage["output_tokens"], usage["cached_input_tokens"])
+            for model, usage in self.models.items()
+        )
+
+    def credits(self) -> int:
+        return calculate_credits_to_deduct(self.provider_cost())
+
+    def summary(self) -> dict:
+        return {"models": self.models, "provider_cost": self.provider_cost(), "credits": self.credits()}
+
+
+_current_ledger: ContextVar[Optional[UsageLedger]] = ContextVar("usage_ledger", default=None)
+
+
+def start_usage_ledger(credit_limit: Optional[int] = None) -> UsageLedger:
+    """
+    Starts recording the current request's model usage. Call before starting
+    the run; tasks created afterwards (tool calls, streamed runs) inherit it.
+    With a credit_limit, model calls fail with CreditLimitExceeded once the
+    usage recorded so far costs that many credits.
+    """
+    ledger = UsageLedger(credit_limit)
+    _current_ledger.set(ledger)
+    return ledger
+
+
+def current_usage_ledger() -> Optional[UsageLedger]:
+    return _current_ledger.get()
+
+
+class UsageHooks(AgentHooks):
+    """
+    Adds the usage of each model response to the current request's ledger.
+    """
+    async def on_llm_start(self, context, agent, system_prompt, input_items):
+        ledger = _current_ledger.get()
+        if ledger is None or ledger.credit_limit is None:
+            return
+        credits = ledger.credits()
+        if credits >= ledger.credit_limit:
+            raise CreditLimitExceeded(
+                f"{agent.name} was not called: the request has used {credits} of its {ledger.credit_limit} credits"
+            )
+
+    async def on_llm_end(self, context, agent, response):
+        ledger = _current_ledger.get()
+        if ledger is None or response.usage is None:
+            return
+        usage = response.usage
+        model = agent.model if isinstance(agent.model, str) else getattr(agent.model, "model", "DEFAULT_FALLBACK")
+        details = usage.input_tokens_details
+        ledger.add(model, usage.input_tokens, usage.output_tokens, getattr(details, "cached_tokens", 0) or 0)
+        logging.debug(f"{agent.name} ({model}) used {usage.input_tokens} input and {usage.output_tokens} output tokens")
+
+
+usage_hooks = UsageHooks()
@@ -0,0 +1,119 @@
+# context_packer.py
+# Packs per-request prompt context into per-section token budgets, so the
+# size of a prompt is bounded no matter how much history or how many
+# retrieved items a user has. Each section is rendered as compact text (one
+# item per line, no Python reprs) and items are dropped to fit its budget:
+# the oldest items for history, the least similar ones for retrieved items.
+# Packed sizes are logged per request and summarized on /metrics.
+
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from app.utils.metrics import SizeStats, register_metrics
+from app.utils.prompts import render
+from app.utils.token_accounting import count_tokens, count_tokens_batch, truncate_to_tokens
+
+
+DEFAULT_SECTION_BUDGET = 256
+
+
+@dataclass
+class Section:
+    """
+    A titled block of prompt context.
+
+    value is rendered as a whole and truncated to the budget, unless drop is set:
+    - drop="oldest": value is a list of strings, oldest first. The oldest
+      items are dropped, `step` at a time, so that the kept window (and with
+      it the cached prompt prefix) only moves every `step` new items.
+    - drop="least_similar": value is a list of (text, similarity) pairs.
+      The least similar items are dropped; the rest are kept most similar first.
+    """
+    title: str
+    value: Any
+    drop: Optional[str] = None
+    step: int = 1
+
+
+def similar_items(results: Any, text_column: str) -> List[Tuple[str, float]]:
+    """
+    Converts similarity search results (rows with text_column and "similarity",
+    or a no-results message dict) into (text, similarity) pairs.
+    """
+    if not isinstance(results, list):
+        return []
+    return [(row[text_column], row.get("similarity") or 0.0) for row in results if row.get(text_column)]
+
+
+class ContextPacker:
+    """
+    Packs sections into their token budgets and records the packed sizes.
+    """
+    def __init__(self, name: str, budgets: Dict[str, int]):
+        self.name = name
+        self.budgets = budgets
+        self.section_tokens: Dict[str, SizeStats] = {}
+        self.total_tokens = SizeStats()
+        register_metrics(f"{name}_context", self.metrics)
+
+    def pack(self, sections: List[Section]) -> List[Tuple[str, str]]:
+        """
+        Returns (title, text) pairs, in order, each within its section's budget.
+        """
+        packed, sizes, total = [], [], 0
+        for section in sections:
+            budget = self.budgets.get(section.title, DEFAULT_SECTION_BUDGET)
+            if section.drop == "oldest":
+                text, tokens, kept = self._pack_oldest_dropped(section.value, budget, section.step)
+            elif section.drop == "least_similar":
+                text, tokens, kept = self._pack_least_similar_dropped(section.value, budget)
+            else:
+                text = truncate_to_tokens(render(section.value), budget)
+                tokens, kept = count_tokens(text), None
+            packed.append((section.title, text))
+            self.section_tokens.setdefault(section.title, SizeStats()).record(tokens)
+            total += tokens
+            items = f", {kept}/{len(section.value)} items" if kept is not None else ""
+            sizes.append(f"{section.title}: {tokens}{items}")
+
+        self.total_tokens.record(total)
+        logging.info(f"Packed {self.name} context: {total} tokens ({'; '.join(sizes)})")
+        return packed
+
+    @staticmethod
+    def _pack_oldest_dropped(items: List[str], budget: int, step: int) -> Tuple[str, int, int]:
+        counts = [count + 1 for count in count_tokens_batch(items)]  # +1 for the newline
+        # Keep the longest suffix of items that fits, then round the number of
+        # dropped items up to a multiple of step.
+        total, start = sum(counts), 0
+        while start < len(items) and total > budget:
+            total -= counts[start]
+            start += 1
+        if start and step > 1:
+            start = min(len(items), -(-start // step) * step)
+        kept = items[start:]
+        # A single item larger than the whole budget is truncated rather than dropped
+        if not kept and items:
+            kept = [truncate_to_tokens(items[-1], budget)]
+        text = render(kept)
+        return text, sum(counts[start:]) if start < len(items) else count_tokens(text), len(kept)
+
+    @staticmethod
+    def _pack_least_similar_dropped(items: List[Tuple[str, float]], budget: int) -> Tuple[str, int, int]:
+        ranked = sorted(items, key=lambda item: item[1], reverse=True)
+        counts = count_tokens_batch([text for text, _ in ranked])
+        kept, tokens = [], 0
+        for (text, _), count in zip(ranked, counts):
+            item_tokens = count + 1
+            if tokens + item_tokens > budget:
+                continue
+            kept.append(text)
+            tokens += item_tokens
+        text = render(kept)
+        return text, tokens if kept else count_tokens(text), len(kept)
+
+    def metrics(self) -> dict:
+        return {
+            "total_tokens": self.total_tokens.snapshot(),
+            "sections": {title: stats.snapshot() for title, stats in self.section_tokens.items()},
+        }
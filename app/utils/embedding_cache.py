@@ -0,0 +1,217 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+from app.utils.metrics import register_metrics
+
+
+# Anchored to the app directory (app/.cache) so that every entry point (the
+# server, CLIs, workers) shares one cache whatever its working directory
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), ".cache", "embeddings.sqlite3")
+)
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "5000"))
+EMBEDDING_CACHE_DISK_ITEMS = int(os.getenv("EMBEDDING_CACHE_DISK_ITEMS", "200000"))
+# Bump to invalidate every cached vector, e.g. when a provider silently updates a model.
+EMBEDDING_CACHE_VERSION = os.getenv("EMBEDDING_CACHE_VERSION", "1")
+# Disk reads record when each entry was last used; the updates are written in
+# batches of this many keys (or with the next write) instead of on every read.
+EMBEDDING_CACHE_TOUCH_BATCH = int(os.getenv("EMBEDDING_CACHE_TOUCH_BATCH", "500"))
+
+
+def embedding_cache_key(model: str, text: str) -> str:
+    """
+    Content address of an embedding: a hash of the cache version, model and text.
+    """
+    payload = f"{EMBEDDING_CACHE_VERSION}\0{model}\0{text}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by embedding_cache_key(model, text).
+
+    The memory tier is a per-process LRU of float32 arrays (4 bytes per
+    dimension rather than a Python float object each). The disk tier is a SQLite file of
+    float32 vectors in WAL mode, so it survives restarts and is shared by every
+    worker on the host. The disk tier is pruned to its least recently used
+    `disk_items` entries; last-used times of disk hits are written in batches.
+    """
+    def __init__(
+        self,
+        path: Optional[str] = EMBEDDING_CACHE_PATH,
+        memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS,
+        disk_items: int = EMBEDDING_CACHE_DISK_ITEMS,
+    ):
+        self.path = path
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self._memory: "OrderedDict[str, array]" = OrderedDict()
+        self._touched: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._disk_writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        register_metrics("embedding_cache", self.metrics)
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text]).get(text)
+
+    def get_many(self, model: str, texts: Iterable[str]) -> Dict[str, List[float]]:
+        """
+        Returns {text: embedding} for every text found in either tier.
+        """
+        found: Dict[str, List[float]] = {}
+        disk_keys: Dict[str, str] = {}
+        with self._lock:
+            for text in texts:
+                key = embedding_cache_key(model, text)
+                embedding = self._memory.get(key)
+                if embedding is not None:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    found[text] = embedding.tolist()
+                else:
+                    disk_keys[key] = text
+
+        if disk_keys:
+            for key, vector in self._disk_get(list(disk_keys)).items():
+                found[disk_keys[key]] = vector.tolist()
+                self._remember(key, vector)
+            with self._lock:
+                self.disk_hits += sum(1 for text in disk_keys.values() if text in found)
+                self.misses += sum(1 for text in disk_keys.values() if text not in found)
+        return found
+
+    def set(self, model: str, text: str, embedding: List[float]):
+        self.set_many(model, {text: embedding})
+
+    def set_many(self, model: str, embeddings: Dict[str, List[float]]):
+        rows = []
+        for text, embedding in embeddings.items():
+            if embedding is None:
+                continue
+            key = embedding_cache_key(model, text)
+            vector = array("f", embedding)
+            self._remember(key, vector)
+            rows.append((key, model, vector.tobytes(), time.time()))
+        if rows:
+            self._disk_set(rows)
+
+    def _remember(self, key: str, vector: array):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    # --- Disk tier ---
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                connection = sqlite3.connect(self.path, timeout=5.0)
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings ("
+                    "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used_idx ON embeddings (last_used)")
+                connection.commit()
+            except Exception as e:
+                logging.error(f"Embedding disk cache unavailable at {self.path}: {e}")
+                self.path = None
+                return None
+            self._local.connection = connection
+        return connection
+
+    def _disk_get(self, keys: List[str]) -> Dict[str, array]:
+        connection = self._connection()
+        if connection is None:
+            return {}
+        try:
+            rows = []
+            for start in range(0, len(keys), 500):  # Stay under SQLite's bound-parameter limit
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows += connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+            if rows:
+                now = time.time()
+                with self._lock:
+                    self._touched.update((key, now) for key, _ in rows)
+                    flush = len(self._touched) >= EMBEDDING_CACHE_TOUCH_BATCH
+                if flush:
+                    self._flush_touched(connection)
+            return {key: array("f", vector) for key, vector in rows}
+        except Exception as e:
+            logging.error(f"Error reading embedding disk cache: {e}")
+            return {}
+
+    def _disk_set(self, rows: List[tuple]):
+        connection = self._connection()
+        if connection is None:
+            return
+        try:
+            self._flush_touched(connection, commit=False)
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            connection.commit()
+            self._disk_writes += len(rows)
+            # Prune occasionally rather than on every write.
+            if self._disk_writes >= max(1, self.disk_items // 100):
+                self._disk_writes = 0
+                self._prune(connection)
+        except Exception as e:
+            logging.error(f"Error writing embedding disk cache: {e}")
+
+    def _flush_touched(self, connection: sqlite3.Connection, commit: bool = True):
+        """
+        Writes the pending last-used times of disk hits.
+        """
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if not touched:
+            return
+        connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key, now in touched.items()])
+        if commit:
+            connection.commit()
+
+    def _prune(self, connection: sqlite3.Connection):
+        (count,) = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.disk_items
+        if excess > 0:
+            connection.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+            )
+            connection.commit()
+            logging.info(f"Evicted {excess} embeddings from the disk cache.")
+
+    def metrics(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_items": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else None,
+        }
+
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,156 @@
+import asyncio
+import time
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+from app.utils.metrics import LatencyStats, register_metrics
+
+
+class BackgroundJobQueue:
+    """
+    An asyncio job queue drained by a bounded pool of workers.
+
+    Jobs are submitted under a key; while a job for a key is queued or running,
+    further submissions for the same key are coalesced into it. Failed jobs are
+    retried with exponential backoff.
+
+    With group_of, jobs whose keys map to the same group run one at a time, in
+    submission order: a job taken from the queue while another job of its group
+    is running is handed to that job's worker, which runs it next. Workers never
+    wait on a busy group, so one group's burst cannot hold up the others.
+    """
+    def __init__(
+        self,
+        name: str,
+        workers: int = 2,
+        max_retries: int = 2,
+        retry_delay: float = 1.0,
+        max_queue_size: int = 1000,
+        group_of: Optional[Callable[[Hashable], Hashable]] = None,
+    ):
+        self.name = name
+        self.worker_count = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue: "asyncio.Queue[Hashable]" = asyncio.Queue(maxsize=max_queue_size)
+        self._jobs: Dict[Hashable, tuple] = {}  # key -> (job, submitted_at)
+        self._running: set = set()
+        self.group_of = group_of
+        self._group_backlogs: Dict[Hashable, Deque[tuple]] = {}  # running group -> (key, job, submitted_at) waiting for it
+        self._waiting: set = set()  # keys in a group backlog
+        self._workers: List[asyncio.Task] = []
+        self.job_latency = LatencyStats()  # submit -> done
+        self.run_latency = LatencyStats()  # start -> done
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.deferred = 0
+        register_metrics(f"{name}_queue", self.metrics)
+
+    def submit(self, key: Hashable, job: Callable[[], Awaitable]) -> bool:
+        """
+        Queues job() under key. Returns False if the job was coalesced into one
+        already queued or running for the same key, or if the queue is full.
+        """
+        if key in self._jobs or key in self._running or key in self._waiting:
+            self.coalesced += 1
+            return False
+        try:
+            # Jobs waiting in group backlogs count towards the queue's size limit
+            if self.queue.maxsize and self.queue.qsize() + len(self._waiting) >= self.queue.maxsize:
+                raise asyncio.QueueFull
+            self.queue.put_nowait(key)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logging.warning(f"{self.name} queue is full; dropping job for {key}.")
+            return False
+        self._jobs[key] = (job, time.perf_counter())
+        self.submitted += 1
+        return True
+
+    def start(self):
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        not_run = len(self._jobs) + len(self._waiting)
+        if not_run:
+            logging.warning(f"{self.name} queue stopped with {not_run} jobs not run.")
+
+    async def _worker(self):
+        while True:
+            key = await self.queue.get()
+            job, submitted_at = self._jobs.pop(key)
+            self.queue.task_done()
+            if self.group_of is None:
+                await self._run(key, job, submitted_at)
+                continue
+
+            group = self.group_of(key)
+            backlog = self._group_backlogs.get(group)
+            if backlog is not None:
+                # A job of this group is running; its worker runs this one next
+                backlog.append((key, job, submitted_at))
+                self._waiting.add(key)
+                self.deferred += 1
+                continue
+            backlog = self._group_backlogs[group] = deque()
+            try:
+                while True:
+                    await self._run(key, job, submitted_at)
+                    if not backlog:
+                        break
+                    key, job, submitted_at = backlog.popleft()
+                    self._waiting.discard(key)
+            finally:
+                del self._group_backlogs[group]
+
+    async def _run(self, key: Hashable, job: Callable[[], Awaitable], submitted_at: float):
+        self._running.add(key)
+        started_at = time.perf_counter()
+        try:
+            await self._run_with_retries(key, job)
+        finally:
+            self._running.discard(key)
+            self.run_latency.record(time.perf_counter() - started_at)
+            self.job_latency.record(time.perf_counter() - submitted_at)
+
+    async def _run_with_retries(self, key: Hashable, job: Callable[[], Awaitable]):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await job()
+                self.completed += 1
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    logging.error(f"{self.name} job for {key} failed after {attempt + 1} attempts: {e}")
+                    return
+                self.retried += 1
+                logging.warning(f"{self.name} job for {key} failed (attempt {attempt + 1}), retrying: {e}")
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+
+    def metrics(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize() + len(self._waiting),
+            "running": len(self._running),
+            "workers": len(self._workers),
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "deferred": self.deferred,
+            "job_latency": self.job_latency.snapshot(),
+            "run_latency": self.run_latency.snapshot(),
+        }
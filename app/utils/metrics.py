@@ -0,0 +1,96 @@
+import time
+import threading
+from collections import deque
+from typing import Callable, Dict
+
+
+class LatencyStats:
+    """
+    Keeps the most recent latency samples and summarizes them in milliseconds.
+    """
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+            self.count += 1
+
+    def time(self):
+        """
+        Context manager that records the duration of its block.
+        """
+        return _Timer(self)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = sorted(self.samples)
+            count = self.count
+        if not samples:
+            return {"count": count}
+        return {
+            "count": count,
+            "avg_ms": round(sum(samples) / len(samples) * 1000, 2),
+            "p50_ms": round(samples[len(samples) // 2] * 1000, 2),
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 2),
+            "max_ms": round(samples[-1] * 1000, 2),
+        }
+
+
+class SizeStats:
+    """
+    Keeps the most recent size samples (e.g. token counts) and summarizes them.
+    """
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, size: int):
+        with self._lock:
+            self.samples.append(size)
+            self.count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = sorted(self.samples)
+            count = self.count
+        if not samples:
+            return {"count": count}
+        return {
+            "count": count,
+            "avg": round(sum(samples) / len(samples), 1),
+            "p50": samples[len(samples) // 2],
+            "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            "max": samples[-1],
+        }
+
+
+class _Timer:
+    def __init__(self, stats: LatencyStats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.record(time.perf_counter() - self.start)
+        return False
+
+
+# Named metric sources, each returning a JSON-serializable dict.
+_sources: Dict[str, Callable[[], dict]] = {}
+
+
+def register_metrics(name: str, source: Callable[[], dict]):
+    """
+    Registers a callable whose snapshot is exposed under `name` by the /metrics endpoint.
+    """
+    _sources[name] = source
+
+
+def collect_metrics() -> dict:
+    return {name: source() for name, source in _sources.items()}
@@ -1,11 +1,6 @@
 import logging
-import os
 from typing import Dict
-from openai import OpenAI
-
-
-api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
+from app.utils.openai_client import get_openai_client
 
 
 class ModerationService:
@@ -14,7 +9,7 @@ class ModerationService:
     def __init__(self):
         pass
 
-    def check_content(self, text: str) -> Dict:
+    async def check_content(self, text: str) -> Dict:
         """
         Check if content violates OpenAI's content policy
         
@@ -31,7 +26,7 @@ class ModerationService:
 
         try:
             # Make the API call
-            moderation = client.moderations.create(input=text)
+            moderation = await get_openai_client().moderations.create(input=text)
 
             # Check if results are present
             if not moderation.results:
@@ -50,7 +45,7 @@ class ModerationService:
             logging.error(f"An unexpected error occurred during moderation: {type(e).__name__} - {e}")
             return None
             
-    def check_image(self, image_url: str) -> Dict:
+    async def check_image(self, image_url: str) -> Dict:
         """
         Check if an image violates OpenAI's content policy
         """
@@ -58,7 +53,7 @@ class ModerationService:
                         # Convert HttpUrl to string if needed
             image_url_str = str(image_url)
             
-            moderation = client.moderations.create(
+            moderation = await get_openai_client().moderations.create(
             model="omni-moderation-latest",
             input=[
                     {
@@ -82,7 +77,7 @@ class ModerationService:
             logging.error(f"Moderation API request failed: {str(e)}")
             return False
 
-    def is_safe(self, text: str = None, image_url: str = None) -> bool:
+    async def is_safe(self, text: str = None, image_url: str = None) -> bool:
         """
         Simple helper that returns True if content is safe, False otherwise
         
@@ -95,12 +90,12 @@ class ModerationService:
         
         content_flagged = False
         if text and text.strip() != "": 
-            content_result = self.check_content(text)
+            content_result = await self.check_content(text)
             content_flagged = content_result["flagged"]
             
         image_flagged = False
         if image_url and image_url.strip() != "": 
-            image_result = self.check_image(image_url)
+            image_result = await self.check_image(image_url)
             image_flagged = image_result["flagged"]
             
         # only return true if both content and image are false
@@ -0,0 +1,131 @@
+# openai_client.py
+# One AsyncOpenAI client per process, shared by the embedding, moderation and
+# agent runner paths so that they reuse one pool of keep-alive connections.
+# Requests go through an instrumented transport that exposes pool utilization
+# and per-path latency on /metrics.
+# The client is created on application startup (see main.py lifespan), or
+# lazily by scripts that run outside the app, and closed on shutdown.
+
+import os
+import time
+import logging
+from collections import Counter
+from typing import Dict, Optional
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+try:
+    import httpx2 as httpx  # HTTP library of openai >= 3; the transport must come from it
+except ImportError:
+    import httpx
+from app.utils.metrics import LatencyStats, register_metrics
+
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY_SECONDS", "60"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    Wraps the pooled HTTP transport to record request latency per API path,
+    response statuses and connection pool utilization.
+    """
+    def __init__(self, transport: httpx.AsyncHTTPTransport):
+        self.transport = transport
+        self.latency: Dict[str, LatencyStats] = {}
+        self.statuses = Counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        # Latency is measured to the response headers; streamed bodies are not included.
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started_at = time.perf_counter()
+        status = "error"
+        try:
+            response = await self.transport.handle_async_request(request)
+            status = response.status_code
+            return response
+        finally:
+            self.in_flight -= 1
+            self.latency.setdefault(request.url.path, LatencyStats()).record(time.perf_counter() - started_at)
+            self.statuses[status] += 1
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    def pool(self) -> dict:
+        # httpcore's pool is not public API; report what it exposes, if anything.
+        connections = list(getattr(getattr(self.transport, "_pool", None), "connections", []))
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {
+            "connections": len(connections),
+            "idle": idle,
+            "active": len(connections) - idle,
+            "max_connections": OPENAI_MAX_CONNECTIONS,
+            "utilization": round((len(connections) - idle) / OPENAI_MAX_CONNECTIONS, 4),
+        }
+
+    def metrics(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "pool": self.pool(),
+            "statuses": {str(status): count for status, count in self.statuses.items()},
+            "latency": {path: stats.snapshot() for path, stats in self.latency.items()},
+        }
+
+
+_client: Optional[AsyncOpenAI] = None
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """
+    Returns the shared AsyncOpenAI client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        transport = InstrumentedTransport(httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+            )
+        ))
+        register_metrics("openai_client", transport.metrics)
+        http_client = DefaultAsyncHttpxClient(
+            transport=transport,
+            timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS),
+        )
+        _client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=OPENAI_MAX_RETRIES)
+    return _client
+
+
+def start_openai_client() -> AsyncOpenAI:
+    """
+    Creates the shared client and makes it the default client of the agents SDK.
+    Called on application startup.
+    """
+    from agents import set_default_openai_client
+
+    client = get_openai_client()
+    set_default_openai_client(client)
+    logging.info(
+        f"OpenAI client ready (max {OPENAI_MAX_CONNECTIONS} connections, "
+        f"{OPENAI_MAX_KEEPALIVE_CONNECTIONS} keep-alive)."
+    )
+    return client
+
+
+async def close_openai_client():
+    """
+    Closes the shared client's connection pool. Called on application shutdown.
+    """
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
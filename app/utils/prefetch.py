@@ -0,0 +1,78 @@
+# prefetch.py
+# Fetches a request's independent inputs concurrently in one stage, so the
+# stage takes as long as its slowest source instead of the sum of all of them.
+# Each source has its own timeout and a default that is used when it times out
+# or fails; per-source latency, timeouts and failures are exposed on /metrics.
+
+import os
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from app.utils.metrics import LatencyStats, register_metrics
+
+
+PREFETCH_TIMEOUT_SECONDS = float(os.getenv("PREFETCH_TIMEOUT_SECONDS", "2"))
+
+REQUIRED = object()  # Default marking a source whose failure fails the stage
+
+
+class PrefetchStage:
+    """
+    Runs named fetches concurrently with per-source timeouts and defaults.
+    """
+    def __init__(self, name: str, timeouts: Optional[Dict[str, float]] = None, default_timeout: float = PREFETCH_TIMEOUT_SECONDS):
+        self.name = name
+        self.timeouts = timeouts or {}
+        self.default_timeout = default_timeout
+        self.latency: Dict[str, LatencyStats] = {}
+        self.stage_latency = LatencyStats()
+        self.timed_out = Counter()
+        self.failed = Counter()
+        register_metrics(f"{name}_prefetch", self.metrics)
+
+    async def run(self, **sources: Tuple[Callable[[], Awaitable], Any]) -> Dict[str, Any]:
+        """
+        Runs every source, given as name=(fetch, default), and returns their
+        results by name. A source that times out or raises gets its default;
+        if its default is REQUIRED, the error is raised once all sources finish.
+        """
+        started_at = time.perf_counter()
+        names = list(sources)
+        results = await asyncio.gather(*(self._fetch(name, *sources[name]) for name in names), return_exceptions=True)
+        self.stage_latency.record(time.perf_counter() - started_at)
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return dict(zip(names, results))
+
+    async def _fetch(self, name: str, fetch: Callable[[], Awaitable], default: Any) -> Any:
+        timeout = self.timeouts.get(name, self.default_timeout)
+        started_at = time.perf_counter()
+        try:
+            return await asyncio.wait_for(fetch(), timeout)
+        except asyncio.TimeoutError:
+            self.timed_out[name] += 1
+            logging.warning(f"{self.name} prefetch: {name} timed out after {timeout}s.")
+            if default is REQUIRED:
+                raise
+            return default
+        except Exception as e:
+            self.failed[name] += 1
+            logging.error(f"{self.name} prefetch: {name} failed: {e}")
+            if default is REQUIRED:
+                raise
+            return default
+        finally:
+            self.latency.setdefault(name, LatencyStats()).record(time.perf_counter() - started_at)
+
+    def metrics(self) -> dict:
+        return {
+            "stage": self.stage_latency.snapshot(),
+            "sources": {
+                name: {**stats.snapshot(), "timed_out": self.timed_out[name], "failed": self.failed[name]}
+                for name, stats in self.latency.items()
+            },
+        }
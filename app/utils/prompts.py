@@ -0,0 +1,85 @@
+# prompts.py
+# Builds system prompts that providers can cache. OpenAI caches the longest
+# previously seen prompt prefix (in 128-token steps once it is 1024 tokens or
+# longer) and bills cached input at a discount. Inserting user data into
+# the middle of static text stops the cached prefix at the first user-specific
+# byte. So prompts are built as a byte-stable static prefix followed by
+# per-user sections ordered from least to most volatile. Anything that changes
+# every message goes last.
+#
+# Cached-token counts are read from each run's usage and the hit ratio per
+# endpoint is exposed on /metrics as "prompt_cache".
+
+import json
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+from app.utils.metrics import register_metrics
+
+
+def render(value: Any) -> str:
+    """
+    Renders a section value deterministically: lists one item per line,
+    dicts as "key: value" lines, other values as JSON or plain text.
+    """
+    if value is None:
+        return "(none)"
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (list, tuple)):
+        return "\n".join(render(item) for item in value) if value else "(none)"
+    if isinstance(value, dict):
+        return "\n".join(f"{key}: {render(item)}" for key, item in value.items()) if value else "(none)"
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+class PromptBuilder:
+    """
+    A static instruction prefix followed by titled sections, in the order given.
+    Pass the sections from least to most volatile.
+    """
+    def __init__(self, static_prefix: str):
+        self.static_prefix = static_prefix.strip() + "\n"
+
+    def build(self, sections: Iterable[Tuple[str, Any]]) -> str:
+        parts = [self.static_prefix]
+        for title, value in sections:
+            parts.append(f"\n## {title}\n{render(value)}\n")
+        return "".join(parts)
+
+
+class PromptCacheStats:
+    """
+    Input and cached input tokens per endpoint.
+    """
+    def __init__(self):
+        self.endpoints: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, usage: Optional[Any]):
+        """
+        Records a run's usage (agents.usage.Usage).
+        """
+        if usage is None:
+            return
+        details = getattr(usage, "input_tokens_details", None)
+        cached = getattr(details, "cached_tokens", 0) or 0
+        with self._lock:
+            stats = self.endpoints.setdefault(endpoint, {"runs": 0, "runs_with_hit": 0, "input_tokens": 0, "cached_tokens": 0})
+            stats["runs"] += 1
+            stats["runs_with_hit"] += cached > 0
+            stats["input_tokens"] += usage.input_tokens
+            stats["cached_tokens"] += cached
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                endpoint: {
+                    **stats,
+                    "hit_ratio": round(stats["cached_tokens"] / stats["input_tokens"], 4) if stats["input_tokens"] else 0.0,
+                }
+                for endpoint, stats in self.endpoints.items()
+            }
+
+
+prompt_cache_stats = PromptCacheStats()
+register_metrics("prompt_cache", prompt_cache_stats.metrics)
@@ -0,0 +1,99 @@
+# streaming.py
+# Streams an agent run to the client as Server-Sent Events. Text deltas are
+# sent as they are generated; once the run completes, a completion callback
+# (history append, credit deduction) runs and a final "done" event carries the
+# full output. If the run does not complete (an error or the client
+# disconnecting), an abort callback runs instead. Time to first token and total stream time are recorded per
+# endpoint and exposed on /metrics.
+
+import json
+import time
+import logging
+from typing import Any, Awaitable, AsyncIterator, Callable, Dict, Optional
+from agents import Agent, Runner
+from fastapi.responses import StreamingResponse
+from openai.types.responses import ResponseTextDeltaEvent
+from app.utils.metrics import LatencyStats, register_metrics
+from app.utils.prompts import prompt_cache_stats
+
+
+time_to_first_token: Dict[str, LatencyStats] = {}
+stream_latency: Dict[str, LatencyStats] = {}
+
+
+def _streaming_metrics() -> dict:
+    return {
+        endpoint: {
+            "time_to_first_token": stats.snapshot(),
+            "total": stream_latency[endpoint].snapshot(),
+        }
+        for endpoint, stats in time_to_first_token.items()
+    }
+
+
+register_metrics("streaming", _streaming_metrics)
+
+
+def sse_event(data: Any, event: Optional[str] = None) -> str:
+    """
+    Formats one Server-Sent Event with a JSON payload.
+    """
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def stream_agent(
+    endpoint: str,
+    agent: Agent,
+    message: str,
+    started_at: float,
+    on_complete: Optional[Callable[[Any], Awaitable]] = None,
+    context: Any = None,
+    on_abort: Optional[Callable[[], None]] = None,
+) -> AsyncIterator[str]:
+    """
+    Runs the agent (with the given run context) using the streamed runner and
+    yields its text deltas as SSE "delta" events, then calls
+    on_complete(final_output) and yields a "done" event. Errors are sent as an
+    "error" event. If the run or on_complete does not finish, on_abort() is
+    called (synchronously, as it may run while the stream is being torn down).
+    started_at is the request's perf_counter start, so time to first token
+    includes the work before the run.
+    """
+    first_token = time_to_first_token.setdefault(endpoint, LatencyStats())
+    total = stream_latency.setdefault(endpoint, LatencyStats())
+    result = Runner.run_streamed(agent, message, context=context)
+    received_first_token = False
+    completed = False
+    try:
+        async for event in result.stream_events():
+            if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+                if not received_first_token:
+                    received_first_token = True
+                    first_token.record(time.perf_counter() - started_at)
+                yield sse_event({"delta": event.data.delta}, "delta")
+
+        final_output = result.final_output
+        prompt_cache_stats.record(endpoint, result.context_wrapper.usage)
+        if on_complete is not None:
+            await on_complete(final_output)
+        completed = True
+        total.record(time.perf_counter() - started_at)
+        yield sse_event({"final_output": final_output}, "done")
+    except Exception as e:
+        logging.error(f"Error streaming {endpoint}: {e}")
+        yield sse_event({"detail": "Internal Server Error"}, "error")
+    finally:
+        # Stops the run if the client disconnected mid-stream
+        if not result.is_complete:
+            result.cancel()
+        if not completed and on_abort is not None:
+            on_abort()
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,355 @@
+# token_accounting.py
+# Token counting for prompt packing, truncation and pre-flight estimates.
+# The tiktoken encoder is loaded once per process. Counts of repeated
+# strings (static instruction prefixes, history messages that are re-packed
+# every turn) are memoized in a bounded LRU. Lists of strings are counted
+# with the encoder's multi-threaded batch API.
+#
+# For hot paths that only need an approximate count, CharEstimator converts
+# characters to tokens. It is calibrated continuously from the exact counts
+# taken here and reports a measured error bound. Pre-flight checks use
+# estimate_tokens_upper, which adds that bound.
+#
+# The encoder's BPE ranks are read from TIKTOKEN_CACHE_DIR (app/assets/tiktoken
+# by default), so the app never downloads them at request time. Populate it at
+# build time with `python -m app.utils.token_accounting`. The encoder is
+# loaded during startup (warm_encoder), and startup fails if it cannot be
+# loaded, unless TOKENIZER_REQUIRED is false.
+
+import os
+import math
+import asyncio
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import List, Optional
+import tiktoken
+from app.utils.metrics import register_metrics
+
+
+ENCODING = "o200k_base"
+# tiktoken reads its cache directory from the environment when it loads an encoding
+TIKTOKEN_CACHE_DIR = os.environ.setdefault(
+    "TIKTOKEN_CACHE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "assets", "tiktoken")
+)
+TOKENIZER_REQUIRED = os.getenv("TOKENIZER_REQUIRED", "true").lower() == "true"
+TOKENIZER_LOAD_TIMEOUT_SECONDS = float(os.getenv("TOKENIZER_LOAD_TIMEOUT_SECONDS", "30"))
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "4096"))
+TOKEN_COUNT_CACHE_MAX_CHARS = int(os.getenv("TOKEN_COUNT_CACHE_MAX_CHARS", "20000"))  # Longer strings are not memoized
+TOKEN_COUNT_THREADS = int(os.getenv("TOKEN_COUNT_THREADS", str(min(4, os.cpu_count() or 1))))
+TOKEN_COUNT_BATCH_MIN_CHARS = int(os.getenv("TOKEN_COUNT_BATCH_MIN_CHARS", "20000"))  # Smaller batches are encoded serially; the thread pool costs more than it saves
+
+# Until enough exact counts have been observed, the estimator assumes 4
+# characters per token with a 25% error bound.
+DEFAULT_CHARS_PER_TOKEN = 4.0
+DEFAULT_ESTIMATE_ERROR_BOUND = 0.25
+
+# How long the encoder took to load (set by warm_encoder), or why it could not
+# be loaded (set on the first failed load, in any process: the app, CLIs and
+# benchmarks alike). encoder_loading is set while a load that outlived the
+# startup timeout is still running: counts are estimated until it finishes.
+encoder_load_seconds: Optional[float] = None
+encoder_error: Optional[Exception] = None
+encoder_loading = False
+_encoder_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _load_encoder() -> tiktoken.Encoding:
+    return tiktoken.get_encoding(ENCODING)
+
+
+def get_encoder() -> tiktoken.Encoding:
+    """
+    Returns the tiktoken encoder, loaded once. If loading fails, the failure is
+    remembered for the rest of the process: later calls raise at once instead
+    of retrying the download, and counts fall back to the character estimate.
+    """
+    global encoder_error
+    if encoder_error is not None:
+        raise RuntimeError(f"The {ENCODING} encoder is unavailable") from encoder_error
+    # Callers do not wait on a load that is still running after the startup timeout
+    if not _encoder_lock.acquire(blocking=not encoder_loading):
+        raise RuntimeError(f"The {ENCODING} encoder is still loading")
+    try:
+        if encoder_error is not None:
+            raise RuntimeError(f"The {ENCODING} encoder is unavailable") from encoder_error
+        try:
+            return _load_encoder()
+        except Exception as e:
+            encoder_error = e
+            logging.error(
+                f"Could not load the {ENCODING} tokenizer from {TIKTOKEN_CACHE_DIR}: {e}. "
+                "Token counts will be estimated from characters for the rest of this process."
+            )
+            raise
+    finally:
+        _encoder_lock.release()
+
+
+def warm_encoder() -> float:
+    """
+    Loads the encoder and encodes a sample string, so the first request does
+    not pay for it. Returns the load time in seconds.
+    """
+    global encoder_load_seconds, encoder_loading
+    start = time.perf_counter()
+    try:
+        get_encoder().encode_ordinary("warm up")
+    except Exception as e:
+        encoder_loading = False
+        _encoder_unavailable(e)
+        return time.perf_counter() - start
+    encoder_load_seconds = time.perf_counter() - start
+    if encoder_loading:
+        encoder_loading = False
+        logging.info(f"Loaded the {ENCODING} tokenizer in {encoder_load_seconds * 1000:.1f} ms, after the startup timeout; token counts are exact from now on")
+    else:
+        logging.info(f"Loaded the {ENCODING} tokenizer in {encoder_load_seconds * 1000:.1f} ms")
+    return encoder_load_seconds
+
+
+async def start_tokenizer():
+    """
+    Warms the encoder at startup, off the event loop and within
+    TOKENIZER_LOAD_TIMEOUT_SECONDS (a blocked download would otherwise stall startup).
+    A load that times out keeps running in its thread, and counts become exact
+    once it finishes.
+    """
+    global encoder_loading
+    try:
+        await asyncio.wait_for(asyncio.to_thread(warm_encoder), TOKENIZER_LOAD_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        encoder_loading = True
+        _encoder_unavailable(
+            TimeoutError(f"loading took longer than {TOKENIZER_LOAD_TIMEOUT_SECONDS}s"), permanent=False
+        )
+
+
+def _encoder_unavailable(error: Exception, permanent: bool = True):
+    """
+    Raises if TOKENIZER_REQUIRED is set. Otherwise logs the error, and token
+    counts fall back to the character estimate: from then on if the failure is
+    permanent, else until the encoder loads.
+    """
+    global encoder_error
+    message = (
+        f"Could not load the {ENCODING} tokenizer from {TIKTOKEN_CACHE_DIR}: {error}. "
+        "Populate it with `python -m app.utils.token_accounting` or point TIKTOKEN_CACHE_DIR at a directory that has the ranks."
+    )
+    if permanent:
+        encoder_error = error
+    if TOKENIZER_REQUIRED:
+        raise RuntimeError(message) from error
+    if permanent:
+        logging.error(f"{message} Token counts will be estimated from characters.")
+    else:
+        logging.error(f"{message} Token counts will be estimated from characters until it finishes loading.")
+
+
+class TokenCountCache:
+    """
+    Bounded LRU of token counts by string.
+    """
+    def __init__(self, max_size: int = TOKEN_COUNT_CACHE_SIZE):
+        self.max_size = max_size
+        self.counts: "OrderedDict[str, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, text: str) -> Optional[int]:
+        with self._lock:
+            count = self.counts.get(text)
+            if count is None:
+                self.misses += 1
+                return None
+            self.counts.move_to_end(text)
+            self.hits += 1
+            return count
+
+    def put(self, text: str, count: int):
+        if len(text) > TOKEN_COUNT_CACHE_MAX_CHARS:
+            return
+        with self._lock:
+            self.counts[text] = count
+            self.counts.move_to_end(text)
+            while len(self.counts) > self.max_size:
+                self.counts.popitem(last=False)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.counts),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class CharEstimator:
+    """
+    Estimates token counts from character counts. The characters-per-token
+    ratio and the error bound (the given quantile of the relative error) are
+    measured over the most recent exact counts.
+    """
+    def __init__(self, window: int = 2000, min_samples: int = 100, quantile: float = 0.99):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.quantile = quantile
+        self._lock = threading.Lock()
+        self._chars_per_token = DEFAULT_CHARS_PER_TOKEN
+        self._error_bound = DEFAULT_ESTIMATE_ERROR_BOUND
+        self._stale = False
+
+    def observe(self, chars: int, tokens: int):
+        if tokens <= 0:
+            return
+        with self._lock:
+            self.samples.append((chars, tokens))
+            self._stale = True
+
+    def _calibrate(self):
+        # Called with the lock held
+        if not self._stale or len(self.samples) < self.min_samples:
+            return
+        chars_per_token = sum(chars for chars, _ in self.samples) / sum(tokens for _, tokens in self.samples)
+        errors = sorted(abs(chars / chars_per_token - tokens) / tokens for chars, tokens in self.samples)
+        self._chars_per_token = chars_per_token
+        self._error_bound = errors[min(len(errors) - 1, int(len(errors) * self.quantile))]
+        self._stale = False
+
+    def calibration(self) -> tuple:
+        """
+        Returns (characters per token, relative error bound).
+        """
+        with self._lock:
+            self._calibrate()
+            return self._chars_per_token, self._error_bound
+
+    def estimate(self, text: str) -> int:
+        chars_per_token, _ = self.calibration()
+        return math.ceil(len(text) / chars_per_token)
+
+    def estimate_upper(self, text: str) -> int:
+        chars_per_token, error_bound = self.calibration()
+        return math.ceil(len(text) / chars_per_token * (1 + error_bound))
+
+    def metrics(self) -> dict:
+        chars_per_token, error_bound = self.calibration()
+        return {
+            "samples": len(self.samples),
+            "chars_per_token": round(chars_per_token, 3),
+            "error_bound": round(error_bound, 4),
+            "calibrated": len(self.samples) >= self.min_samples,
+        }
+
+
+token_count_cache = TokenCountCache()
+char_estimator = CharEstimator()
+
+
+def encoder_metrics() -> dict:
+    return {
+        "encoding": ENCODING,
+        "available": encoder_load_seconds is not None,
+        "load_ms": round(encoder_load_seconds * 1000, 1) if encoder_load_seconds is not None else None,
+    }
+
+
+register_metrics("token_count", lambda: {
+    "encoder": encoder_metrics(), "cache": token_count_cache.metrics(), "estimator": char_estimator.metrics(),
+})
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens of a string. Repeated strings are served from the LRU.
+    """
+    count = token_count_cache.get(text)
+    if count is not None:
+        return count
+    try:
+        count = len(get_encoder().encode_ordinary(text))
+    except Exception as e:
+        if encoder_error is None and not encoder_loading:  # A failed or pending load has already been reported
+            logging.warning(f"Warning: Could not count tokens encoding failed and defaulted to the estimate. Error: {e}")
+        return char_estimator.estimate(text)
+    token_count_cache.put(text, count)
+    char_estimator.observe(len(text), count)
+    return count
+
+
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    """
+    Counts the tokens of each string. Strings not in the LRU are encoded in one
+    call to the encoder's batch API, which runs on several threads (large
+    batches on multi-core hosts only).
+    """
+    counts = [token_count_cache.get(text) for text in texts]
+    missing = [i for i, count in enumerate(counts) if count is None]
+    if not missing:
+        return counts
+    missing_texts = [texts[i] for i in missing]
+    try:
+        encoder = get_encoder()
+        if TOKEN_COUNT_THREADS > 1 and len(missing_texts) > 1 and sum(map(len, missing_texts)) >= TOKEN_COUNT_BATCH_MIN_CHARS:
+            encoded = [len(tokens) for tokens in encoder.encode_ordinary_batch(missing_texts, num_threads=TOKEN_COUNT_THREADS)]
+        else:
+            encoded = [len(encoder.encode_ordinary(text)) for text in missing_texts]
+    except Exception as e:
+        if encoder_error is None and not encoder_loading:  # A failed or pending load has already been reported
+            logging.warning(f"Warning: Could not count tokens encoding failed and defaulted to the estimate. Error: {e}")
+        for i in missing:
+            counts[i] = char_estimator.estimate(texts[i])
+        return counts
+    for i, text, count in zip(missing, missing_texts, encoded):
+        counts[i] = count
+        token_count_cache.put(text, count)
+        char_estimator.observe(len(text), count)
+    return counts
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Truncates text to at most max_tokens tokens.
+    """
+    # Every token is at least one character
+    if len(text) <= max_tokens:
+        return text
+    try:
+        encoder = get_encoder()
+        tokens = encoder.encode_ordinary(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return encoder.decode(tokens[:max_tokens])
+    except Exception as e:
+        if encoder_error is None and not encoder_loading:  # A failed or pending load has already been reported
+            logging.warning(f"Warning: Could not truncate tokens encoding failed and defaulted to the estimate. Error: {e}")
+        chars_per_token, _ = char_estimator.calibration()
+        return text[:int(max_tokens * chars_per_token)]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Character-based token estimate, without encoding.
+    """
+    return char_estimator.estimate(text)
+
+
+def estimate_tokens_upper(text: str) -> int:
+    """
+    Character-based token estimate plus the measured error bound, for
+    pre-flight checks that must not underestimate.
+    """
+    return char_estimator.estimate_upper(text)
+
+
+if __name__ == "__main__":
+    # Build step: downloads the ranks into TIKTOKEN_CACHE_DIR (tiktoken caches them there)
+    logging.basicConfig(level=logging.INFO)
+    warm_encoder()
+    print(f"{ENCODING} ranks are in {TIKTOKEN_CACHE_DIR}")
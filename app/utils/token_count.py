@@ -1,25 +1,27 @@
 import logging
 import math
-import tiktoken
+# Token counting lives in token_accounting; re-exported here for existing callers.
+from app.utils.token_accounting import ENCODING, count_tokens, count_tokens_batch, estimate_tokens_upper, get_encoder, truncate_to_tokens
 
 
 USD_PER_CREDIT = 0.001 # $0.001 per credit or 1000 credits per dollar
 PROFIT_MARGIN_MULTIPLIER = 1.5 # 50% profit margin
-ENCODING="o200k_base"
+ESTIMATED_OUTPUT_TOKENS = 300 # Expected completion length for pre-flight cost estimates
 
 LLM_PRICING_USD_PER_TOKEN = {
 
     # --- GPT-4o Models ---
     "gpt-4o": {
         "prompt": 2.50 / 1_000_000,  # $2.50 per 1M input tokens
+        "cached_prompt": 1.25 / 1_000_000,  # $1.25 per 1M cached input tokens
         "completion": 10.00 / 1_000_000, # $10.00 per 1M output tokens
     },
     "gpt-4o-mini": {
         "prompt": 0.150 / 1_000_000, # $0.15 per 1M input tokens
+        "cached_prompt": 0.075 / 1_000_000, # $0.075 per 1M cached input tokens
         "completion": 0.600 / 1_000_000, # $0.60 per 1M output tokens
     },
-    # Note: gpt-4o also has 'cached_input' pricing ($1.25 / 1M tokens) which might apply in some contexts (e.g., Assistants API).
-    # Note: gpt-4o-mini also has 'cached_input' pricing ($0.075 / 1M tokens).
+    # Models without a "cached_prompt" price bill cached input at the "prompt" price.
 
     # --- GPT-4 Turbo Models (Often Aliased/Replaced by GPT-4o, but check if specific versions used) ---
     "gpt-4-turbo": { # This might represent the latest Turbo version, check model list (Could be gpt-4-turbo-2024-04-09 or similar)
@@ -70,8 +72,8 @@ LLM_PRICING_USD_PER_TOKEN = {
      # --- New Reasoning Models (Example) ---
     "o1-mini": { # Example from search results - verify official status/pricing
         "prompt": 1.10 / 1_000_000,
+        "cached_prompt": 0.55 / 1_000_000,
         "completion": 4.40 / 1_000_000,
-        # Also mentions cached input pricing
     },
 
 
@@ -83,34 +85,31 @@ LLM_PRICING_USD_PER_TOKEN = {
 }
 
 
-def count_tokens(text: str) -> int:
-    """Counts tokens using tiktoken for a given text and model."""
-    try:
-        encoding = tiktoken.get_encoding(ENCODING)
-        num_tokens = len(encoding.encode(text))
-        return num_tokens
-    
-    except Exception as e:
-        logging.warning(f"Warning: Could not count tokens encoding failed and defaulted to fallback. Error: {e}")
-        # Fallback or default logic if needed, e.g., estimate based on chars/words
-        return len(text) // 4 # Very rough estimate everthing is 4 characters
-    
-def calculate_provider_cost(text: str, model: str = "gpt-4o-mini") -> float:
-    """Calculates the cost of tokens for a given text and model."""
-    global LLM_PRICING_USD_PER_TOKEN
-    try:
-        if model not in LLM_PRICING_USD_PER_TOKEN:
-            logging.warning(f"Warning: Model {model} not found in LLM_PRICING_USD_PER_TOKEN. Using DEFAULT_FALLBACK.")
-            model = "DEFAULT_FALLBACK"
-            
-        pricing = LLM_PRICING_USD_PER_TOKEN[model]
-        input_tokens = count_tokens(text)
-        output_tokens = count_tokens(text)
-        cost = (pricing["prompt"] * input_tokens) + (pricing["completion"] * output_tokens)
-        return cost
-    except Exception as e:
-        logging.error(f"Error calculating token cost for model {model}: {e}")
-        return 0.0
+def get_pricing(model: str) -> dict:
+    """Returns the per-token prices of a model, or the fallback prices if it is not listed."""
+    if model not in LLM_PRICING_USD_PER_TOKEN:
+        logging.warning(f"Warning: Model {model} not found in LLM_PRICING_USD_PER_TOKEN. Using DEFAULT_FALLBACK.")
+        model = "DEFAULT_FALLBACK"
+    return LLM_PRICING_USD_PER_TOKEN[model]
+
+def calculate_usage_cost(model: str, input_tokens: int, output_tokens: int, cached_input_tokens: int = 0) -> float:
+    """Calculates the provider cost of reported token usage, with cached input at its discounted price."""
+    pricing = get_pricing(model)
+    cached_input_tokens = min(cached_input_tokens, input_tokens)
+    return (
+        pricing["prompt"] * (input_tokens - cached_input_tokens)
+        + pricing.get("cached_prompt", pricing["prompt"]) * cached_input_tokens
+        + pricing["completion"] * output_tokens
+    )
+
+def estimate_provider_cost(input_text: str, model: str = "gpt-4o-mini", output_tokens: int = ESTIMATED_OUTPUT_TOKENS) -> float:
+    """
+    Pre-flight estimate of a model call's cost: a character-based upper bound
+    on the tokens of its input, uncached, plus an expected number of output
+    tokens. Actual charges are calculated from the usage the provider reports
+    (calculate_usage_cost).
+    """
+    return calculate_usage_cost(model, estimate_tokens_upper(input_text), output_tokens)
 
 def calculate_credits_to_deduct(token_cost : float) -> int:
     """Calculates the integer number of credits to deduct from the user."""
@@ -0,0 +1,114 @@
+"""
+Per-request agent setup cost: building fresh Agent instances, tool lists and
+the planner's as_tool wrapper on every request (the previous behavior) versus
+reusing the registered agent templates and passing the request's data as run
+context.
+
+Both sides include rendering the system prompt, which happens on every run
+either way. Reports time and peak allocated memory per request (tracemalloc); no
+model calls are made.
+
+Run from the repository root:
+    python -m benchmarks.agent_setup
+"""
+import os
+import time
+import asyncio
+import tracemalloc
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench.bench.bench")
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+from agents import Agent, RunContextWrapper, WebSearchTool
+from app.personal_agents import knowledge_extraction, planner, slang_extraction
+from app.personal_agents.knowledge_extraction import KnowledgeResult
+from app.personal_agents.planner import PlannerOutput, PlannerService
+from app.personal_agents.slang_extraction import SlangResult
+from app.routes.orchestration import (
+    ConvoLeadContext, WitContext, convo_lead_agent, convo_lead_instructions, get_users_name,
+    retrieve_personalized_info_about_user, update_user_name, wit_agent, wit_instructions,
+)
+
+ITERATIONS = 2000
+
+TRAITS = {"openness": 0.7, "conscientiousness": 0.4, "extraversion": 0.6, "agreeableness": 0.8, "neuroticism": 0.3}
+HISTORY = [f"User: message {i}" for i in range(20)]
+
+
+def convo_lead_context() -> ConvoLeadContext:
+    return ConvoLeadContext("user-1", "Sam", "ENFP", "warm and curious", TRAITS, "ngl, lowkey", HISTORY)
+
+
+def wit_context() -> WitContext:
+    return WitContext("ENFP", "warm and curious", TRAITS, "likes climbing")
+
+
+async def per_request_agents():
+    """
+    The previous setup: every request built its agents, tools and wrappers.
+    """
+    convo = convo_lead_context()
+    Agent(name="KnowledgeExtractor", instructions=knowledge_extraction.instructions, model="gpt-4o-mini", output_type=KnowledgeResult)
+    Agent(name="SlangExtractor", instructions=slang_extraction.instructions, model="gpt-4o-mini", output_type=SlangResult)
+    planner_agent = Agent(
+        name="Planner", instructions=planner.instructions, model="gpt-4o-mini",
+        output_type=PlannerOutput, tools=[PlannerService.create_plan],
+    )
+    astra = Agent(
+        name="Astra AI",
+        instructions=convo_lead_instructions(RunContextWrapper(convo), None),
+        model="gpt-4o-mini",
+        tools=[
+            get_users_name, update_user_name, retrieve_personalized_info_about_user,
+            planner_agent.as_tool(tool_name="create_plan", tool_description="A tool that creates a plan for the user to follow."),
+        ],
+    )
+    wit = Agent(
+        name="Wit",
+        instructions=wit_instructions(RunContextWrapper(wit_context()), None),
+        model="gpt-4o-mini",
+        tools=[WebSearchTool()],
+    )
+    await astra.get_system_prompt(RunContextWrapper(None))
+    await wit.get_system_prompt(RunContextWrapper(None))
+
+
+async def registered_agents():
+    """
+    The current setup: shared templates, per-request data as run context.
+    """
+    await convo_lead_agent.get_system_prompt(RunContextWrapper(convo_lead_context()))
+    await wit_agent.get_system_prompt(RunContextWrapper(wit_context()))
+
+
+async def measure(label, setup):
+    for _ in range(100):
+        await setup()
+
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        await setup()
+    elapsed = time.perf_counter() - started
+
+    # Peak memory allocated during one request's setup, averaged
+    tracemalloc.start()
+    allocated = 0
+    for _ in range(200):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        await setup()
+        allocated += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    print(f"{label:<22} {elapsed / ITERATIONS * 1e6:8.1f} us/request   {allocated / 200 / 1024:7.1f} KiB allocated/request")
+
+
+def main():
+    print(f"Agent setup per request ({ITERATIONS} iterations)")
+    asyncio.run(measure("per-request agents", per_request_agents))
+    asyncio.run(measure("registered templates", registered_agents))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Compares the separate MBTI, OCEAN, knowledge and slang agents with the
+combined analysis agent: model calls, input/output tokens, cost and latency
+per message.
+
+Every agent runs against a stand-in model that returns schema-valid output
+after a simulated delay (fixed overhead plus prefill and decode time per
+token), so the benchmark runs offline. Input tokens include the system
+prompt and output schema that each call re-sends.
+
+Run from the repository root:
+    python -m benchmarks.analysis_calls
+"""
+import os
+import json
+import time
+import asyncio
+import statistics
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench.bench.bench")
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+from agents import Runner, RunConfig
+from agents.items import ModelResponse
+from agents.models.interface import Model
+from agents.usage import Usage
+from openai.types.responses import (
+    Response,
+    ResponseCompletedEvent,
+    ResponseOutputMessage,
+    ResponseOutputText,
+    ResponseTextDeltaEvent,
+    ResponseUsage,
+)
+from openai.types.responses.response_usage import InputTokensDetails, OutputTokensDetails
+from app.personal_agents.knowledge_extraction import KnowledgeExtractionService
+from app.personal_agents.message_analysis import analysis_agent
+from app.personal_agents.slang_extraction import SlangExtractionService
+from app.psychology.mbti_analysis import mbti_agent
+from app.psychology.ocean_analysis import ocean_agent
+from app.utils.token_count import LLM_PRICING_USD_PER_TOKEN, count_tokens
+
+OVERHEAD_SECONDS = 0.25  # Network round trip and queueing per call
+PREFILL_SECONDS_PER_TOKEN = 0.00005
+DECODE_SECONDS_PER_TOKEN = 0.008
+PRICING = LLM_PRICING_USD_PER_TOKEN["gpt-4o-mini"]
+
+MESSAGES = [
+    "hey, just got back from the climbing gym, my forearms are toast lol",
+    "I've been thinking about switching careers from accounting to UX design",
+    "ngl the new album slaps, been on repeat all week",
+    "my daughter starts kindergarten tomorrow and I'm way more nervous than she is",
+    "can you help me plan a vegetarian dinner for six people?",
+]
+
+# Summarization input: the turns since the latest summary (SUMMARY_TRIGGER_TOKENS ~ 1500)
+TURNS = [
+    f"User: {message}\nWit: That sounds like a lot to take in. Tell me more about how that has been going for you lately?"
+    for message in MESSAGES
+]
+SUMMARY_INPUTS = ["\n".join(TURNS * 6)]
+
+
+def sample(schema: dict, definitions: dict):
+    """
+    A minimal value that satisfies a JSON schema.
+    """
+    if "$ref" in schema:
+        return sample(definitions[schema["$ref"].split("/")[-1]], definitions)
+    if "anyOf" in schema:
+        options = [option for option in schema["anyOf"] if option.get("type") != "null"]
+        return sample(options[0], definitions)
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: sample(prop, definitions) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [sample(schema["items"], definitions)]
+    if kind in ("number", "integer"):
+        return 0.5
+    if kind == "boolean":
+        return True
+    return "a short example value"
+
+
+class StandInModel(Model):
+    def __init__(self):
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, **kwargs):
+        message, input_tokens, output_tokens = await self._respond(system_instructions, input, output_schema)
+        usage = Usage(requests=1, input_tokens=input_tokens, output_tokens=output_tokens, total_tokens=input_tokens + output_tokens)
+        return ModelResponse(output=[message], usage=usage, response_id=None)
+
+    async def stream_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, **kwargs):
+        # The whole output as one delta, then the completed response
+        message, input_tokens, output_tokens = await self._respond(system_instructions, input, output_schema)
+        yield ResponseTextDeltaEvent(
+            type="response.output_text.delta", item_id=message.id, output_index=0, content_index=0,
+            delta=message.content[0].text, logprobs=[], sequence_number=0,
+        )
+        response = Response(
+            id="resp_stand_in", object="response", created_at=time.time(), model="stand-in", output=[message],
+            parallel_tool_calls=False, tool_choice="auto", tools=[],
+            usage=ResponseUsage(
+                input_tokens=input_tokens, output_tokens=output_tokens, total_tokens=input_tokens + output_tokens,
+                input_tokens_details=InputTokensDetails(cached_tokens=0, cache_write_tokens=0),
+                output_tokens_details=OutputTokensDetails(reasoning_tokens=0),
+            ),
+        )
+        yield ResponseCompletedEvent(type="response.completed", response=response, sequence_number=1)
+
+    async def _respond(self, system_instructions, input, output_schema):
+        # Returns (message, input tokens, output tokens) after the simulated delay
+        schema = output_schema.json_schema() if output_schema else {}
+        prompt = (system_instructions or "") + json.dumps(input) + json.dumps(schema)
+        output = json.dumps(sample(schema, schema.get("$defs", {})))
+        input_tokens, output_tokens = count_tokens(prompt), count_tokens(output)
+        self.calls += 1
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+
+        await asyncio.sleep(
+            OVERHEAD_SECONDS + input_tokens * PREFILL_SECONDS_PER_TOKEN + output_tokens * DECODE_SECONDS_PER_TOKEN
+        )
+        message = ResponseOutputMessage(
+            id="msg_stand_in", type="message", role="assistant", status="completed",
+            content=[ResponseOutputText(type="output_text", text=output, annotations=[])],
+        )
+        return message, input_tokens, output_tokens
+
+
+async def run(label, agents, messages):
+    model = StandInModel()
+    config = RunConfig(model=model, tracing_disabled=True)
+    latencies = []
+    for message in messages:
+        start = time.perf_counter()
+        await asyncio.gather(*(Runner.run(agent, message, run_config=config) for agent in agents))
+        latencies.append(time.perf_counter() - start)
+
+    count = len(messages)
+    cost = model.input_tokens * PRICING["prompt"] + model.output_tokens * PRICING["completion"]
+    print(
+        f"{label:<10} calls/msg={model.calls / count:<4.1f} input tokens/msg={model.input_tokens / count:<7.0f} "
+        f"output tokens/msg={model.output_tokens / count:<5.0f} cost/1k msgs=${cost / count * 1000:.4f} "
+        f"latency p50={statistics.median(latencies) * 1000:.0f} ms"
+    )
+
+
+def main():
+    separate = [
+        mbti_agent,
+        ocean_agent,
+        KnowledgeExtractionService("bench").extraction_agent,
+        SlangExtractionService("bench").extraction_agent,
+    ]
+    for title, messages in (("Chat messages", MESSAGES), ("Summarization input", SUMMARY_INPUTS)):
+        print(f"{title} ({len(messages)}, ~{count_tokens(messages[0])} tokens each), stand-in gpt-4o-mini pricing")
+        asyncio.run(run("separate", separate, messages))
+        asyncio.run(run("combined", [analysis_agent], messages))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Compares per-text embedding calls with the batched generate_embeddings path.
+
+The embeddings API is replaced by a stand-in that sleeps for a fixed round
+trip, so the benchmark runs offline and measures request count and latency.
+
+Run from the repository root:
+    python -m benchmarks.embedding_batch
+"""
+import os
+import time
+import random
+import asyncio
+from types import SimpleNamespace
+
+# pgvector creates its clients at import time; give them harmless settings.
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench.bench.bench")
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+from app.supabase import pgvector
+from app.utils.embedding_cache import EmbeddingCache
+
+ROUND_TRIP_SECONDS = 0.05
+DIMENSIONS = 1536
+
+
+class StubEmbeddings:
+    def __init__(self):
+        self.requests = 0
+
+    async def create(self, model, input):
+        self.requests += 1
+        await asyncio.sleep(ROUND_TRIP_SECONDS)
+        texts = input if isinstance(input, list) else [input]
+        data = [
+            SimpleNamespace(index=i, embedding=[random.random() for _ in range(DIMENSIONS)])
+            for i in range(len(texts))
+        ]
+        return SimpleNamespace(data=data)
+
+
+def run(label, texts, embed):
+    stub = StubEmbeddings()
+    pgvector.get_openai_client = lambda: SimpleNamespace(embeddings=stub)
+    pgvector.embedding_cache = EmbeddingCache(path=None)
+    start = time.perf_counter()
+    asyncio.run(embed(texts))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} requests={stub.requests:<4} time={elapsed * 1000:8.1f} ms")
+
+
+def main():
+    random.seed(0)
+    base = [f"message number {i} about my day" for i in range(40)]
+    texts = base + random.sample(base, 10)  # 20% repeated texts
+    random.shuffle(texts)
+
+    print(f"{len(texts)} texts ({len(set(texts))} unique), {ROUND_TRIP_SECONDS * 1000:.0f} ms per request")
+
+    async def one_by_one(batch):
+        return [await pgvector.generate_embedding(t) for t in batch]
+
+    run("generate_embedding (loop)", texts, one_by_one)
+    run("generate_embeddings", texts, pgvector.generate_embeddings)
+
+
+if __name__ == "__main__":
+    main()
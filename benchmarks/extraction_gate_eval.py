@@ -0,0 +1,122 @@
+"""
+Offline evaluation of the extraction gate: how many knowledge and slang
+extraction calls it saves, and how much extractable value it misses.
+
+Input is a JSONL file of recorded messages, one {"message": ...} object per
+line with the value scores the extraction agents gave them as
+"knowledge_score" and "slang_score". With --label, missing scores are filled
+in by running the extraction agents (requires OPENAI_API_KEY). Without a file,
+a small built-in sample with hand-assigned scores is used.
+
+A skipped message counts as missed value when its score reaches the storage
+threshold (0.3), i.e. when the extraction call would have stored something.
+
+Run from the repository root:
+    python -m benchmarks.extraction_gate_eval [messages.jsonl] [--label]
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+from app.personal_agents.extraction_gate import knowledge_gate, slang_gate
+
+STORE_THRESHOLD = 0.3
+
+SAMPLE = [
+    {"message": "hi", "knowledge_score": 0.0, "slang_score": 0.0},
+    {"message": "hello!", "knowledge_score": 0.0, "slang_score": 0.0},
+    {"message": "ok thanks", "knowledge_score": 0.0, "slang_score": 0.0},
+    {"message": "yes", "knowledge_score": 0.0, "slang_score": 0.0},
+    {"message": "good morning", "knowledge_score": 0.0, "slang_score": 0.0},
+    {"message": "sure, sounds good", "knowledge_score": 0.0, "slang_score": 0.1},
+    {"message": "lol", "knowledge_score": 0.0, "slang_score": 0.4},
+    {"message": "ngl that's lowkey fire", "knowledge_score": 0.0, "slang_score": 0.7},
+    {"message": "bruh", "knowledge_score": 0.0, "slang_score": 0.4},
+    {"message": "why?", "knowledge_score": 0.0, "slang_score": 0.0},
+    {"message": "what do you mean", "knowledge_score": 0.0, "slang_score": 0.0},
+    {"message": "pizza", "knowledge_score": 0.1, "slang_score": 0.0},
+    {"message": "I'm vegan", "knowledge_score": 0.9, "slang_score": 0.0},
+    {"message": "my sister lives in Berlin", "knowledge_score": 0.8, "slang_score": 0.0},
+    {"message": "I work night shifts as a nurse", "knowledge_score": 0.9, "slang_score": 0.0},
+    {"message": "love hiking on weekends", "knowledge_score": 0.7, "slang_score": 0.0},
+    {"message": "can you explain how tides work?", "knowledge_score": 0.2, "slang_score": 0.0},
+    {"message": "tell me a joke", "knowledge_score": 0.0, "slang_score": 0.0},
+    {"message": "thank you so much, really", "knowledge_score": 0.0, "slang_score": 0.0},
+    {"message": "I've been learning Japanese for two years", "knowledge_score": 0.9, "slang_score": 0.0},
+    {"message": "gonna grab some boba brb", "knowledge_score": 0.3, "slang_score": 0.6},
+    {"message": "hmm ok", "knowledge_score": 0.0, "slang_score": 0.0},
+    {"message": "allergic to peanuts", "knowledge_score": 0.8, "slang_score": 0.0},
+    {"message": "nope", "knowledge_score": 0.0, "slang_score": 0.0},
+]
+
+
+async def label(records):
+    """
+    Fills in missing scores by running the extraction agents on each message.
+    """
+    from agents import Runner
+    from app.personal_agents.knowledge_extraction import KnowledgeExtractionService
+    from app.personal_agents.slang_extraction import SlangExtractionService
+    knowledge_agent = KnowledgeExtractionService("eval").extraction_agent
+    slang_agent = SlangExtractionService("eval").extraction_agent
+
+    async def score(agent, message):
+        result = await Runner.run(agent, message)
+        return result.final_output.metadata.score.value_score
+
+    for record in records:
+        if "knowledge_score" not in record:
+            record["knowledge_score"] = await score(knowledge_agent, record["message"])
+        if "slang_score" not in record:
+            record["slang_score"] = await score(slang_agent, record["message"])
+
+
+def evaluate(gate, records, score_key):
+    skipped, missed, missed_value, valuable = 0, [], 0.0, 0
+    started = time.perf_counter()
+    for record in records:
+        extract, _ = gate.evaluate(record["message"])
+        is_valuable = record[score_key] >= STORE_THRESHOLD
+        valuable += is_valuable
+        if not extract:
+            skipped += 1
+            if is_valuable:
+                missed.append(record)
+                missed_value += record[score_key]
+    elapsed = time.perf_counter() - started
+
+    total = len(records)
+    print(f"{gate.kind}:")
+    print(f"  calls saved:  {skipped}/{total} ({skipped / total:.0%})")
+    print(f"  value missed: {len(missed)}/{valuable} storable messages, score sum {missed_value:.2f}")
+    print(f"  gate time:    {elapsed / total * 1e6:.0f} us/message")
+    for record in missed:
+        print(f"    missed {record[score_key]:.1f}: {record['message']!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("path", nargs="?", help="JSONL file of recorded messages")
+    parser.add_argument("--label", action="store_true", help="Score unlabeled messages with the extraction agents")
+    args = parser.parse_args()
+
+    if args.path:
+        with open(args.path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    else:
+        records = [dict(record) for record in SAMPLE]
+        print("Using the built-in sample (hand-assigned scores).\n")
+
+    if args.label:
+        asyncio.run(label(records))
+    unlabeled = [record for record in records if "knowledge_score" not in record or "slang_score" not in record]
+    if unlabeled:
+        sys.exit(f"{len(unlabeled)} messages have no scores; pass --label to score them.")
+
+    evaluate(knowledge_gate, records, "knowledge_score")
+    evaluate(slang_gate, records, "slang_score")
+
+
+if __name__ == "__main__":
+    main()
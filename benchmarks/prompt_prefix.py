@@ -0,0 +1,116 @@
+"""
+How much of the convo_lead system prompt a provider prompt cache can reuse
+on repeat turns: the previous layout (user data interleaved in the static
+text) versus the PromptBuilder layout (static prefix, then per-user sections
+from least to most volatile).
+
+A simulated conversation adds one exchange per turn and retrieves different
+slang examples each turn. A turn's cached tokens follow OpenAI's rule: the
+prefix shared with the previous turn's prompt, rounded down to a multiple of
+128 tokens, and only once the prompt is 1024 tokens or longer. Tool
+definitions and the user message are not included.
+
+Run from the repository root:
+    python -m benchmarks.prompt_prefix
+"""
+import os
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench.bench.bench")
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+from agents import RunContextWrapper
+from app.routes.orchestration import ConvoLeadContext, convo_lead_instructions
+from app.utils.token_count import count_tokens
+
+TURNS = 30
+PROMPT_PRICE = 0.150 / 1_000_000  # gpt-4o-mini input
+CACHED_PRICE = 0.075 / 1_000_000  # gpt-4o-mini cached input
+TRAITS = {"openness": "High", "conscientiousness": "Low", "extraversion": "High", "agreeableness": "High", "neuroticism": "Low"}
+SLANG = ["ngl", "lowkey", "no cap", "it's giving", "bet", "fr fr", "vibe check", "slaps", "mid", "say less", "deadass", "bussin"]
+
+
+def previous_instructions(context: ConvoLeadContext) -> str:
+    """
+    The convo_lead instructions before the PromptBuilder layout.
+    """
+    return f"""
+        You are a conversational agent.
+
+        The user_id is {context.user_id}.
+        You are having a conversation with (this is the user's name) {context.user_name}.
+        If their name is not available, ask for it first.
+        When the user's name is given, update it using the update_user_name tool.
+
+        You will lead the conversation with the user. You will ask questions to get to know the user better.
+        Ask your questions in a natural way as the conversation progresses. Ask questions that are relevant to gain accurate MBTI type and OCEAN analysis traits of the user.
+        Ask questions that are relevant to the user's message.
+
+        Keep your language simple, natural, and conversational. Keep it at a 5th grade level.
+
+        DO NOT MENTION MBTI OR OCEAN analysis in your response.
+
+        Personality OCEAN Traits of the {context.user_id} are: {context.ocean_traits}
+        Personality MBTI Type of the {context.user_id} is: {context.mbti_type}
+
+        Your conversational style should be: {context.style_prompt}
+
+        Use similar language as the user, here are some examples: {context.slang}
+
+        Conversation History: {context.history}
+    """
+
+
+def contexts():
+    history = [
+        "Summary: Sam is a nurse who works night shifts, is learning Japanese and likes climbing on weekends. "
+        "They recently moved to a new city and are looking for ways to meet people with similar interests."
+    ]
+    for turn in range(TURNS):
+        yield ConvoLeadContext(
+            user_id="3f1c2a9e-5b7d-4e2a-9c1f-8d6b4a2e7f10",
+            user_name="Sam",
+            mbti_type="ENFP",
+            style_prompt="Your tone should be energetic, conversational, and expressive; imaginative, big-picture, and metaphorical.",
+            ocean_traits=TRAITS,
+            slang=[{"slang_text": SLANG[turn % len(SLANG)]}, {"slang_text": SLANG[(turn + 5) % len(SLANG)]}],
+            history=list(history),
+        )
+        history.append(f"Sam: this is my message number {turn}, telling you a bit more about my week and what I've been up to lately")
+        history.append(f"Astra AI: That sounds great! Tell me more about turn {turn}: what did you enjoy most, and what would you change?")
+
+
+def cached_tokens(previous: str, prompt: str) -> int:
+    if previous is None or count_tokens(prompt) < 1024:
+        return 0
+    shared = 0
+    for a, b in zip(previous, prompt):
+        if a != b:
+            break
+        shared += 1
+    return count_tokens(prompt[:shared]) // 128 * 128
+
+
+def simulate(label, build):
+    previous = None
+    total_input, total_cached = 0, 0
+    for context in contexts():
+        prompt = build(context)
+        total_input += count_tokens(prompt)
+        total_cached += cached_tokens(previous, prompt)
+        previous = prompt
+    cost = (total_input - total_cached) * PROMPT_PRICE + total_cached * CACHED_PRICE
+    print(
+        f"{label:<14} input tokens {total_input:6d}   cached {total_cached:6d} ({total_cached / total_input:5.1%})   "
+        f"system prompt cost/1k conversations ${cost * 1000:.4f}"
+    )
+
+
+def main():
+    print(f"convo_lead system prompt over {TURNS} turns")
+    simulate("interleaved", previous_instructions)
+    simulate("prompt builder", lambda context: convo_lead_instructions(RunContextWrapper(context), None))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Estimates response bytes per similarity search before and after the lean
+retrieval path (projected columns, no select("*") existence pre-check).
+
+Rows are synthesized the way PostgREST serializes them (pgvector columns are
+sent as "[x,y,...]" strings), so no database is needed.
+
+Run from the repository root:
+    python -m benchmarks.retrieval_payload
+"""
+import json
+import random
+
+DIMENSIONS = 1536
+TOP_K = 5
+
+
+def stored_row(i):
+    embedding = "[" + ",".join(f"{random.uniform(-0.1, 0.1):.8f}" for _ in range(DIMENSIONS)) + "]"
+    return {
+        "id": i,
+        "user_id": "00000000-0000-0000-0000-000000000000",
+        "knowledge_text": f"The user enjoys hiking on weekends with friends #{i}",
+        "embedding": embedding,
+        "metadata": json.dumps({"score": {"value_score": 0.8, "reason": "preference"}, "topic": ["hobbies"], "timestamp": "2025-01-01T00:00:00"}),
+        "mention_count": 1,
+        "last_updated": "2025-01-01T00:00:00+00:00",
+    }
+
+
+def projected(row, similarity):
+    return {
+        "id": row["id"],
+        "knowledge_text": row["knowledge_text"],
+        "metadata": row["metadata"],
+        "mention_count": row["mention_count"],
+        "similarity": similarity,
+    }
+
+
+def size(payload):
+    return len(json.dumps(payload).encode("utf-8"))
+
+
+def main():
+    random.seed(0)
+    print(f"{'stored rows':>12} {'before (bytes)':>16} {'after (bytes)':>14} {'reduction':>10}")
+    for count in (10, 100, 1000):
+        rows = [stored_row(i) for i in range(count)]
+        matches = rows[:TOP_K]
+        # Before: select("*") over every row, then the RPC result (full rows incl. embeddings).
+        before = size(rows) + size([dict(row, similarity=0.9) for row in matches])
+        # After: the RPC's projected JSON array only.
+        after = size([projected(row, 0.9) for row in matches])
+        print(f"{count:>12} {before:>16,} {after:>14,} {before / after:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Cost of counting tokens for prompt packing, and accuracy of the
+character-based estimate used by pre-flight checks.
+
+Two workloads:
+- short messages: 500 chat messages of 5-60 words, counted one call each.
+- 10k-token history: a conversation history of about 10k tokens, counted as
+  a list of messages (as ContextPacker does on every turn).
+
+Each workload is counted four ways: the previous implementation
+(tiktoken.get_encoding + encode per string), count_tokens with an empty
+memo, count_tokens_batch with an empty memo, and count_tokens_batch with a
+warm memo (the repeat-turn case, where most history is unchanged).
+
+The estimator is calibrated on half of the messages and evaluated on the
+other half. The report shows the median and p99 relative error of the
+plain estimate, and how often the upper-bound estimate undercounts.
+
+Needs the real o200k_base encoder: populate its ranks with
+`python -m app.utils.token_accounting`, or set TIKTOKEN_CACHE_DIR.
+
+Run from the repository root:
+    python -m benchmarks.token_count
+"""
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench.bench.bench")
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+import tiktoken
+from app.utils import token_accounting
+from app.utils.token_accounting import ENCODING, CharEstimator, TokenCountCache, count_tokens, count_tokens_batch
+
+SHORT_MESSAGES = 500
+HISTORY_TOKENS = 10_000
+REPEATS = 5
+WORDS = (
+    "i you we they the a to and of in on for with my your that this it is was just really "
+    "work shift hospital climbing weekend japanese lesson coffee tired excited honestly maybe "
+    "tomorrow yesterday friends family moved city apartment cooking dinner movie music playlist "
+    "ngl lowkey bet fr vibe slaps mid deadass bussin 2am 10k km 😂 🙌 don't can't it's I'm"
+).split()
+
+
+def message(rng: random.Random, min_words: int, max_words: int) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    text = " ".join(words).capitalize()
+    return text + rng.choice([".", "!", "?", "...", " lol", ""])
+
+
+def history(rng: random.Random, encoder: tiktoken.Encoding):
+    lines, tokens, turn = [], 0, 0
+    while tokens < HISTORY_TOKENS:
+        speaker = "Sam" if turn % 2 == 0 else "Astra AI"
+        line = f"{speaker}: {message(rng, 10, 80)}"
+        lines.append(line)
+        tokens += len(encoder.encode_ordinary(line))
+        turn += 1
+    return lines
+
+
+def previous_count(texts):
+    return [len(tiktoken.get_encoding(ENCODING).encode(text)) for text in texts]
+
+
+def loop_count(texts):
+    return [count_tokens(text) for text in texts]
+
+
+def reset_memo():
+    token_accounting.token_count_cache = TokenCountCache()
+
+
+def timed(fn, texts, cold: bool) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        if cold:
+            reset_memo()
+        start = time.perf_counter()
+        fn(texts)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(label, texts, expected):
+    print(f"{label}: {len(texts)} strings, {sum(expected)} tokens")
+    reset_memo()
+    count_tokens_batch(texts)
+    results = [
+        ("get_encoding + encode", timed(previous_count, texts, cold=True)),
+        ("count_tokens, cold memo", timed(loop_count, texts, cold=True)),
+        ("count_tokens_batch, cold memo", timed(count_tokens_batch, texts, cold=True)),
+        ("count_tokens_batch, warm memo", timed(count_tokens_batch, texts, cold=False)),
+    ]
+    assert count_tokens_batch(texts) == expected
+    baseline = results[0][1]
+    for name, seconds in results:
+        print(f"  {name:<31} {seconds * 1000:8.2f} ms   {baseline / seconds:6.1f}x")
+
+
+def estimator_error(texts, expected):
+    indexes = list(range(len(texts)))
+    random.Random(1).shuffle(indexes)
+    calibration, evaluation = indexes[::2], indexes[1::2]
+    estimator = CharEstimator(window=len(calibration), min_samples=1)
+    for i in calibration:
+        estimator.observe(len(texts[i]), expected[i])
+    chars_per_token, bound = estimator.calibration()
+    errors = sorted(abs(estimator.estimate(texts[i]) - expected[i]) / expected[i] for i in evaluation)
+    under = sum(estimator.estimate_upper(texts[i]) < expected[i] for i in evaluation)
+    print(
+        f"  {chars_per_token:.2f} chars/token, calibrated p99 bound {bound:.1%}; held-out error "
+        f"p50 {errors[len(errors) // 2]:.1%}, p99 {errors[min(len(errors) - 1, int(len(errors) * 0.99))]:.1%}; "
+        f"upper bound undercounts {under}/{len(evaluation)}"
+    )
+
+
+def main():
+    try:
+        encoder = token_accounting.get_encoder()
+    except Exception as e:
+        sys.exit(
+            f"The {ENCODING} encoder is not available ({e.__cause__ or e}). Populate its ranks with "
+            "`python -m app.utils.token_accounting` where the network is available, or set TIKTOKEN_CACHE_DIR."
+        )
+    rng = random.Random(0)
+    short = [message(rng, 5, 60) for _ in range(SHORT_MESSAGES)]
+    lines = history(rng, encoder)
+    short_counts = [len(encoder.encode_ordinary(text)) for text in short]
+    history_counts = [len(encoder.encode_ordinary(text)) for text in lines]
+
+    report("short messages", short, short_counts)
+    report("10k-token history", lines, history_counts)
+
+    print("estimator, short messages")
+    estimator_error(short, short_counts)
+    print("estimator, history messages")
+    estimator_error(lines, history_counts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""
+Shared test setup. The app's modules create their Supabase and OpenAI clients
+at import time; the tests never reach either service.
+
+Run from the repository root:
+    python -m pytest -q
+"""
+import os
+import tempfile
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "test.test.test")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("EMBEDDING_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "embeddings.sqlite3"))
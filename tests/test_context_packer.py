@@ -0,0 +1,68 @@
+import pytest
+from app.utils import context_packer
+from app.utils.context_packer import DEFAULT_SECTION_BUDGET, ContextPacker, Section, similar_items
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # One token per word, so budgets are easy to reason about
+    monkeypatch.setattr(context_packer, "count_tokens", lambda text: len(text.split()))
+    monkeypatch.setattr(context_packer, "count_tokens_batch", lambda texts: [len(text.split()) for text in texts])
+    monkeypatch.setattr(context_packer, "truncate_to_tokens", lambda text, limit: " ".join(text.split()[:limit]))
+
+
+def pack(section: Section, budget: int) -> str:
+    (title, text), = ContextPacker("test", {section.title: budget}).pack([section])
+    assert title == section.title
+    return text
+
+
+# Five history items of three words; each costs 4 tokens with its newline
+HISTORY = [f"turn {i} text" for i in range(5)]
+
+
+def test_history_that_exactly_fits_is_kept_whole():
+    assert pack(Section("History", HISTORY, drop="oldest"), 20) == "\n".join(HISTORY)
+
+
+def test_the_oldest_items_are_dropped_to_fit():
+    assert pack(Section("History", HISTORY, drop="oldest"), 12).splitlines() == HISTORY[2:]
+    assert pack(Section("History", HISTORY, drop="oldest"), 11).splitlines() == HISTORY[3:]
+
+
+def test_dropped_items_are_rounded_up_to_a_multiple_of_step():
+    assert pack(Section("History", HISTORY, drop="oldest", step=2), 12).splitlines() == HISTORY[2:]
+    assert pack(Section("History", HISTORY, drop="oldest", step=2), 11).splitlines() == HISTORY[4:]
+
+
+def test_an_item_larger_than_the_budget_is_truncated_not_dropped():
+    items = ["older", "one two three four five six"]
+    assert pack(Section("History", items, drop="oldest"), 3) == "one two three"
+
+
+def test_empty_history_renders_as_none():
+    assert pack(Section("History", [], drop="oldest"), 10) == "(none)"
+
+
+def test_least_similar_items_are_dropped_and_the_rest_ranked():
+    items = [("low match", 0.1), ("best match here", 0.9), ("second best match here too", 0.5)]
+    # 4 + 7 tokens: the second best does not fit, the least similar still does
+    assert pack(Section("Knowledge", items, drop="least_similar"), 7).splitlines() == ["best match here", "low match"]
+    assert pack(Section("Knowledge", items, drop="least_similar"), 14).splitlines() == [
+        "best match here", "second best match here too", "low match",
+    ]
+    assert pack(Section("Knowledge", items, drop="least_similar"), 2) == "(none)"
+
+
+def test_whole_values_are_truncated_and_unbudgeted_sections_use_the_default():
+    packer = ContextPacker("test", {"Traits": 2})
+    long_value = " ".join(["word"] * (DEFAULT_SECTION_BUDGET + 10))
+    packed = dict(packer.pack([Section("Traits", "a b c d"), Section("Other", long_value)]))
+    assert packed["Traits"] == "a b"
+    assert len(packed["Other"].split()) == DEFAULT_SECTION_BUDGET
+
+
+def test_similar_items_reads_rows_and_ignores_no_result_messages():
+    rows = [{"knowledge_text": "likes tea", "similarity": 0.8}, {"knowledge_text": ""}, {"knowledge_text": "runs", "similarity": None}]
+    assert similar_items(rows, "knowledge_text") == [("likes tea", 0.8), ("runs", 0.0)]
+    assert similar_items({"message": "No similar knowledge found."}, "knowledge_text") == []
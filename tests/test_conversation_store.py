@@ -0,0 +1,91 @@
+import asyncio
+import pytest
+from app.personal_agents import conversation_context
+from app.personal_agents.conversation_context import ConversationStore
+
+
+class FakeHistory:
+    """
+    Stands in for the conversation_messages table: inserts fail while failing is set.
+    """
+    def __init__(self):
+        self.rows = []
+        self.inserts = 0
+        self.failing = False
+
+    def append(self, rows):
+        self.inserts += 1
+        if self.failing:
+            return None
+        stored = [dict(row, ordinal=len(self.rows) + i + 1) for i, row in enumerate(rows)]
+        self.rows.extend(stored)
+        return stored
+
+
+@pytest.fixture
+def history(monkeypatch):
+    fake = FakeHistory()
+    monkeypatch.setattr(conversation_context, "append_messages_to_history", fake.append)
+    monkeypatch.setattr(conversation_context, "get_conversation_messages", lambda user_id: [])
+    return fake
+
+
+def test_failed_flush_keeps_messages_and_the_next_flush_persists_them_in_order(history):
+    async def scenario():
+        store = ConversationStore(max_pending=10, flush_interval=0)
+        await store.add_message("u1", "user", "one")
+        history.failing = True
+        await store.flush()
+        assert store.pending_count == 1
+        assert store.metrics()["flush_failing"]
+
+        await store.add_message("u1", "assistant", "two")
+        history.failing = False
+        await store.flush()
+        context = await store.get("u1")
+        return store, context
+
+    store, context = asyncio.run(scenario())
+    assert [row["content"] for row in history.rows] == ["one", "two"]
+    assert [message.ordinal for message in context.history] == [1, 2]
+    assert store.pending_count == 0
+    assert not store.metrics()["flush_failing"]
+
+
+def test_messages_are_rejected_while_pending_messages_cannot_be_flushed(history):
+    async def scenario():
+        store = ConversationStore(max_pending=2, flush_interval=60)
+        history.failing = True
+        assert await store.add_message("u1", "user", "one")
+        assert await store.add_message("u2", "user", "two")
+        inserts = history.inserts
+        # At the limit: one flush is attempted, and fails
+        assert not await store.add_message("u1", "user", "three")
+        assert history.inserts == inserts + 1
+        # Within the flush interval of the failure, no further insert is attempted
+        assert not await store.add_message("u1", "user", "four")
+        assert history.inserts == inserts + 1
+
+        history.failing = False
+        store._flush_failed_at = None  # the interval has passed
+        accepted = await store.add_message("u1", "user", "five")
+        return store, accepted
+
+    store, accepted = asyncio.run(scenario())
+    assert accepted
+    assert store.rejected == 2
+    assert [row["content"] for row in history.rows] == ["one", "two"]
+    assert store.pending_count == 1
+
+
+def test_stop_flushes_pending_messages(history):
+    async def scenario():
+        store = ConversationStore(flush_interval=60)
+        await store.start()
+        await store.add_message("u1", "user", "one", speaker="Sam")
+        await store.stop()
+        return store
+
+    store = asyncio.run(scenario())
+    assert history.rows == [{"user_id": "u1", "role": "user", "speaker": "Sam", "content": "one", "ordinal": 1}]
+    assert store.pending_count == 0
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+import pytest
+from app.supabase import profiles
+from app.supabase.credit_holds import CreditBalances
+from app.supabase.profiles import ProfileRepository
+from app.utils.billing import CreditLimitExceeded, start_usage_ledger, usage_hooks
+
+
+class FakeProfiles:
+    """
+    Stands in for the deduct_credits RPC (migrations/005) against one balance.
+    """
+    def __init__(self, credits):
+        self.credits = credits
+        self.deductions = []
+        self.failing = False
+
+    def rpc(self, name, params):
+        assert name == "deduct_credits"
+        fake = self
+
+        class Call:
+            def execute(self):
+                if fake.failing:
+                    raise ConnectionError("database unavailable")
+                fake.deductions.append(params["p_amount"])
+                fake.credits = max(fake.credits - params["p_amount"], 0)
+                return type("Response", (), {"data": fake.credits})()
+        return Call()
+
+
+@pytest.fixture
+def balances(monkeypatch):
+    balances = CreditBalances(hold_ttl_seconds=60, balance_ttl_seconds=60, maxsize=100)
+    monkeypatch.setattr(profiles, "credit_balances", balances)
+    monkeypatch.setattr(profiles, "patch_persona", lambda user_id, **fields: None)
+    return balances
+
+
+@pytest.fixture
+def database():
+    return FakeProfiles(100)
+
+
+@pytest.fixture
+def repo(database):
+    repo = ProfileRepository()
+    repo.supabase = database
+    return repo
+
+
+def test_holds_count_against_the_available_balance(balances):
+    first = balances.hold("u1", 60, lambda: 100)
+    assert first is not None
+    assert balances.hold("u1", 60, lambda: 100) is None
+    balances.release(first)
+    assert balances.hold("u1", 60, lambda: 100) is not None
+
+
+def test_a_hold_is_captured_once(balances, database, repo):
+    hold = repo.hold_credits("u1", 30, 100)
+    assert repo.capture_credits(hold, 20)
+    assert repo.capture_credits(hold, 20)
+    repo.release_credits(hold)
+    assert database.deductions == [20]
+    assert balances.metrics()["active_holds"] == 0
+    # The cached balance is the database's
+    assert balances.hold("u1", 81, lambda: None) is None
+    assert balances.hold("u1", 80, lambda: None) is not None
+
+
+def test_a_released_hold_is_not_captured(balances, database, repo):
+    hold = repo.hold_credits("u1", 30, 100)
+    repo.release_credits(hold)
+    assert repo.capture_credits(hold, 20)
+    assert database.deductions == []
+
+
+def test_concurrent_settlements_charge_once(balances, database, repo):
+    hold = repo.hold_credits("u1", 30, 100)
+    barrier = threading.Barrier(8)
+
+    def settle():
+        barrier.wait()
+        repo.capture_credits(hold, 10)
+
+    threads = [threading.Thread(target=settle) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert database.deductions == [10]
+
+
+def test_a_capture_is_capped_at_the_hold(balances, database, repo):
+    hold = repo.hold_credits("u1", 30, 100)
+    assert repo.capture_credits(hold, 45)
+    assert database.deductions == [30]
+
+
+def test_a_zero_capture_releases_the_hold(balances, database, repo):
+    hold = repo.hold_credits("u1", 30, 100)
+    assert repo.capture_credits(hold, 0)
+    assert database.deductions == []
+    assert balances.metrics()["held_credits"] == 0
+
+
+def test_a_failed_capture_ends_the_hold_and_is_counted(balances, database, repo):
+    hold = repo.hold_credits("u1", 30, 100)
+    database.failing = True
+    assert not repo.capture_credits(hold, 20)
+    metrics = balances.metrics()
+    assert metrics["failed_captures"] == 1
+    assert metrics["active_holds"] == 0
+
+
+def test_model_calls_are_refused_once_the_ledger_reaches_its_limit():
+    async def scenario():
+        agent = SimpleNamespace(name="Lead", model="gpt-4o-mini")
+        ledger = start_usage_ledger(credit_limit=2)
+        await usage_hooks.on_llm_start(None, agent, None, [])
+        ledger.add("gpt-4o-mini", 10_000, 1_000)
+        assert ledger.credits() >= 2
+        with pytest.raises(CreditLimitExceeded):
+            await usage_hooks.on_llm_start(None, agent, None, [])
+
+    asyncio.run(scenario())
@@ -0,0 +1,115 @@
+import asyncio
+from app.utils.job_queue import BackgroundJobQueue
+
+
+async def _drain(queue: BackgroundJobQueue, timeout: float = 2.0):
+    async def idle():
+        while queue.metrics()["queue_depth"] or queue.metrics()["running"]:
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(idle(), timeout)
+
+
+def test_submissions_for_a_queued_or_running_key_are_coalesced():
+    async def scenario():
+        queue = BackgroundJobQueue("test_coalesce", workers=1)
+        release = asyncio.Event()
+        runs = []
+
+        async def job(name):
+            runs.append(name)
+            await release.wait()
+
+        assert queue.submit("a", lambda: job("a1"))
+        assert not queue.submit("a", lambda: job("a2"))  # queued
+        queue.start()
+        await asyncio.sleep(0.01)
+        assert not queue.submit("a", lambda: job("a3"))  # running
+        release.set()
+        await _drain(queue)
+        # A key can be submitted again once its job is done
+        assert queue.submit("a", lambda: job("a4"))
+        await _drain(queue)
+        await queue.stop()
+        return runs, queue.metrics()
+
+    runs, metrics = asyncio.run(scenario())
+    assert runs == ["a1", "a4"]
+    assert metrics["coalesced"] == 2
+    assert metrics["completed"] == 2
+
+
+def test_jobs_of_a_group_run_one_at_a_time_in_submission_order():
+    async def scenario():
+        queue = BackgroundJobQueue("test_groups", workers=3, group_of=lambda key: key[0])
+        events = []
+
+        async def job(key):
+            events.append(("start", key))
+            await asyncio.sleep(0.02)
+            events.append(("end", key))
+
+        for key in [("u1", 1), ("u1", 2), ("u2", 1), ("u1", 3)]:
+            assert queue.submit(key, lambda key=key: job(key))
+        queue.start()
+        await _drain(queue)
+        await queue.stop()
+        return events, queue.metrics()
+
+    events, metrics = asyncio.run(scenario())
+    u1 = [(kind, key) for kind, key in events if key[0] == "u1"]
+    assert u1 == [
+        ("start", ("u1", 1)), ("end", ("u1", 1)),
+        ("start", ("u1", 2)), ("end", ("u1", 2)),
+        ("start", ("u1", 3)), ("end", ("u1", 3)),
+    ]
+    # The other group was not held up behind u1's jobs
+    assert events.index(("start", ("u2", 1))) < events.index(("end", ("u1", 1)))
+    assert metrics["deferred"] >= 1
+    assert metrics["completed"] == 4
+
+
+def test_a_deferred_key_is_coalesced_and_counts_towards_the_size_limit():
+    async def scenario():
+        queue = BackgroundJobQueue("test_group_limit", workers=2, max_queue_size=2, group_of=lambda key: key[0])
+        release = asyncio.Event()
+
+        async def job():
+            await release.wait()
+
+        queue.submit(("u1", 1), job)
+        queue.submit(("u1", 2), job)
+        queue.start()
+        await asyncio.sleep(0.01)  # ("u1", 2) now waits in u1's backlog
+        coalesced = queue.submit(("u1", 2), job)
+        queue.submit(("u2", 1), job)
+        dropped = queue.submit(("u3", 1), job)
+        release.set()
+        await _drain(queue)
+        await queue.stop()
+        return coalesced, dropped, queue.metrics()
+
+    coalesced, dropped, metrics = asyncio.run(scenario())
+    assert not coalesced
+    assert not dropped
+    assert metrics["dropped"] == 1
+
+
+def test_failed_jobs_are_retried_then_counted_as_failed():
+    async def scenario():
+        queue = BackgroundJobQueue("test_retries", workers=1, max_retries=2, retry_delay=0)
+        attempts = []
+
+        async def job():
+            attempts.append(1)
+            raise RuntimeError("boom")
+
+        queue.submit("a", job)
+        queue.start()
+        await _drain(queue)
+        await queue.stop()
+        return len(attempts), queue.metrics()
+
+    attempts, metrics = asyncio.run(scenario())
+    assert attempts == 3
+    assert metrics["retried"] == 2
+    assert metrics["failed"] == 1